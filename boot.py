@@ -0,0 +1,62 @@
+# boot.py for the receiver node: the health check for over-the-air updates.
+# Load it onto the receiver node as boot.py, next to rxRadio_v011.py as main.py.
+#
+# After an update is installed (see installImage() in rxRadio_v011.py), ota_install.txt
+# counts the boots of the new image until the image confirms that it started properly.
+# An image that is booted _TRIAL_BOOTS times without confirming is rolled back to the one
+# it replaced, which is still there as <name>.bak.
+
+import uos
+from micropython import const
+
+_INSTALL_RECORD = "ota_install.txt"  # must match the receiver
+_TRIAL_BOOTS = const(2)
+
+def writeInstallRecord(state, targets):
+    d = open(_INSTALL_RECORD + ".tmp","w")
+    d.write(state + "\n")
+    for target in targets:
+        d.write(target + "\n")
+    d.close()
+    uos.rename(_INSTALL_RECORD + ".tmp", _INSTALL_RECORD)
+
+def swapBackup(target):
+    # Puts target.bak back in place of target and keeps target as the backup.  Must match
+    # the receiver.
+    try:
+        uos.stat(target + ".bak")
+    except OSError:
+        return  # nothing to go back to
+    try:
+        uos.rename(target, target + ".tmp")
+    except OSError:  # an install that was cut short
+        pass
+    uos.rename(target + ".bak", target)
+    try:
+        uos.rename(target + ".tmp", target + ".bak")
+    except OSError:
+        pass
+
+def checkUpdate():
+    try:
+        f=open(_INSTALL_RECORD)
+    except OSError:  # nothing installed over the air yet
+        return
+    lines = f.read().split("\n")
+    f.close()
+    if (lines[0] == "ok"):
+        return
+    targets = [line for line in lines[1:] if line]
+    try:
+        boots = int(lines[0]) + 1
+    except ValueError:  # a damaged record; trust the previous image instead
+        boots = _TRIAL_BOOTS + 1
+    if (boots > _TRIAL_BOOTS):
+        for target in targets:
+            swapBackup(target)
+        writeInstallRecord("ok", targets)
+        print("The last update did not start properly.  Rolled back to the code it replaced.")
+    else:
+        writeInstallRecord(str(boots), targets)
+
+checkUpdate()
@@ -0,0 +1,128 @@
+# Throughput benchmark for the OTA update, run on a host against the real txRadio_v011.py
+# and rxRadio_v011.py through the radio emulator in nrfEmulator.py.
+#
+# For every file size and loss rate it runs transmit() on one simulated node and receive() on
+# another, checks that the receiver installed exactly the file that was sent, and reports:
+#   seconds   end-to-end update time, from transmit() until the receiver resets
+#   goodput   file bytes delivered per second
+#   pkts/KB   radio packets sent by the transmitter per KB of file
+#   extra     packets sent beyond one per frame (retransmissions, polls and parity)
+#   timeouts  ACK timeouts seen by the transmitter
+#
+# Examples:
+#   python3 host/benchmark.py
+#   python3 host/benchmark.py --sizes 4096,65536 --loss 0,0.2 --fec
+#   python3 host/benchmark.py --baud 115200    (include the cost of console output)
+#   python3 host/benchmark.py --mode-loss 1:0.6,0:0.05    (a link too long for 2 Mbit/s)
+#   python3 host/benchmark.py --mode-loss 1:0.6,0:0.05 --fixed-link    (the same without adapting)
+#   python3 host/benchmark.py --channel-loss 98:0.5    (Wi-Fi or another network on 2498 MHz)
+#
+# The emulator runs the nodes as CPython threads, so absolute times differ from the boards;
+# compare runs with each other, before and after a change.
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+
+from nrfEmulator import Channel, runPair
+
+_REPO = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+_TX_SCRIPT = os.path.join(_REPO, "txRadio_v011.py")
+_RX_SCRIPT = os.path.join(_REPO, "rxRadio_v011.py")
+_MAX_PAYLOAD = 252  # file bytes per DATA frame
+
+
+def makeUpdate(size, content):
+    if content == "random":
+        return os.urandom(size)
+    source = open(_RX_SCRIPT, "rb").read()  # realistic, compressible MicroPython source
+    return (source * (size // len(source) + 1))[:size]
+
+
+def parseLosses(text):
+    # "value:loss,..." with MODE or FREQUENCY register values, e.g. 1:0.6 for 2 Mbit/s or
+    # 98:0.5 for 2498 MHz
+    losses = {}
+    for item in text.split(","):
+        if item:
+            value, loss = item.split(":")
+            losses[int(value)] = float(loss)
+    return losses
+
+
+def runOnce(size, loss, args, seed):
+    data = makeUpdate(size, args.content)
+    workDir = tempfile.mkdtemp(prefix="otaBenchmark")
+    try:
+        modeLoss = parseLosses(args.mode_loss)
+        channelLoss = parseLosses(args.channel_loss)
+        # an interferer on a channel loses packets there and shows in its RSSI
+        noise = dict((frequency, int(100 - 60 * l)) for frequency, l in channelLoss.items())
+        channel = Channel(loss=loss, latencyUs=args.latency_us, bitErrorRate=args.bit_error_rate,
+                          seed=seed, noise=noise,
+                          lossModel=lambda frequency, mode, txPower:
+                              1 - (1 - modeLoss.get(mode, 0.0)) * (1 - channelLoss.get(frequency, 0.0)))
+        txKwargs = {"windowSize": args.window}
+        if args.fec:
+            txKwargs["fec"] = True
+        if args.compress:
+            txKwargs["compress"] = True
+        if args.fixed_link:
+            txKwargs["adapt"] = False
+        tx, rx, seconds = runPair(_TX_SCRIPT, _RX_SCRIPT, workDir, data, channel, args.timeout,
+                                  serialBaud=args.baud, txKwargs=txKwargs)
+        installed = rx.path("main.py")
+        ok = os.path.exists(installed) and open(installed, "rb").read() == data
+        frames = (size + _MAX_PAYLOAD - 1) // _MAX_PAYLOAD + 1  # DATA frames and the END frame
+        timeouts = tx.namespace["stats"]()["ackTimeouts"]
+        return {"ok": ok, "seconds": seconds, "packets": tx.packetsSent,
+                "extra": max(0, tx.packetsSent - frames), "timeouts": timeouts}
+    finally:
+        shutil.rmtree(workDir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the OTA transfer in the radio emulator.")
+    parser.add_argument("--sizes", default="1024,8192,32768", help="file sizes in bytes")
+    parser.add_argument("--loss", default="0,0.05,0.2", help="packet loss rates")
+    parser.add_argument("--latency-us", type=int, default=0)
+    parser.add_argument("--bit-error-rate", type=float, default=0.0)
+    parser.add_argument("--baud", type=int, default=0,
+                        help="serial console speed; 0 makes console output free")
+    parser.add_argument("--window", type=int, default=8)
+    parser.add_argument("--fec", action="store_true")
+    parser.add_argument("--compress", action="store_true")
+    parser.add_argument("--mode-loss", default="",
+                        help="extra loss per radio MODE value, e.g. 1:0.6,0:0.05")
+    parser.add_argument("--channel-loss", default="",
+                        help="extra loss per radio FREQUENCY value from interference, e.g. 98:0.5,25:0.2")
+    parser.add_argument("--fixed-link", action="store_true",
+                        help="stay at 2 Mbit/s and +8 dBm instead of adapting the link")
+    parser.add_argument("--content", choices=("source", "random"), default="source")
+    parser.add_argument("--repeat", type=int, default=1, help="runs per case, averaged")
+    parser.add_argument("--timeout", type=float, default=120)
+    args = parser.parse_args()
+
+    print("%8s %6s %8s %10s %8s %7s %8s %s" % ("bytes", "loss", "seconds", "goodput", "pkts/KB",
+                                                "extra", "timeouts", "ok"))
+    failed = False
+    for size in [int(s) for s in args.sizes.split(",")]:
+        for loss in [float(l) for l in args.loss.split(",")]:
+            runs = [runOnce(size, loss, args, seed) for seed in range(1, args.repeat + 1)]
+            seconds = sum(r["seconds"] for r in runs) / len(runs)
+            packets = sum(r["packets"] for r in runs) / len(runs)
+            extra = sum(r["extra"] for r in runs) / len(runs)
+            timeouts = sum(r["timeouts"] for r in runs) / len(runs)
+            ok = all(r["ok"] for r in runs)
+            failed = failed or not ok
+            print("%8d %6.2f %8.3f %8.1f/s %8.1f %7.1f %8.1f %s" % (
+                size, loss, seconds, size / seconds, packets * 1024 / size, extra, timeouts,
+                "yes" if ok else "NO"))
+            sys.stdout.flush()
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,132 @@
+# Builds an update image for txRadio_v011.py on a host, so the transmitter node has nothing to
+# prepare at send time.  The image holds the update already cut into radio frames, with the
+# SHA-256 and the block checks taken here; transmit(theFile="update.ota") then only copies
+# frames from flash into the radio buffers.  See openImage() in txRadio_v011.py for the layout.
+#
+# Examples:
+#   python3 host/buildImage.py main.py    (writes update.ota)
+#   python3 host/buildImage.py main.py --compress -o update.ota
+#   python3 host/buildImage.py app.mpy --compress    (installed as ota_app.mpy, see README.md)
+#   python3 host/buildImage.py --bundle bundle.txt --compress    (every file the manifest lists)
+#
+# Then load update.ota onto the transmitter node next to txRadio_v011.py.
+
+import argparse
+import hashlib
+import os
+import struct
+import sys
+import zlib
+
+# must match txRadio_v011.py and rxRadio_v011.py
+_IMAGE_MAGIC = b"OTA1"
+_IMAGE_HEADER_SIZE = 52
+_IMAGE_MPY = 0x01
+_IMAGE_COMPRESSED = 0x02
+_IMAGE_BUNDLE = 0x08
+_FRAME_DATA = 0
+_FRAME_END = 1
+_FRAME_HEADER_SIZE = 3  # type and sequence number bytes counted by LENGTH
+_FRAME_SIZE = 256
+_MAX_PAYLOAD = 252
+_CHECK_BLOCK = 16
+_DEFLATE_WBITS = 10
+
+
+def checksumPayload(check, payload):
+    # the Fletcher checksum of checksumPayload() in txRadio_v011.py, as the pair of sums
+    a, b = check
+    for byte in payload:
+        a = (a + byte) & 0xFFFF
+        b = (b + a) & 0xFFFF
+    return (a, b)
+
+
+def frame(frameType, seq, payload):
+    header = bytes((_FRAME_HEADER_SIZE + len(payload), frameType, seq & 0xFF, (seq >> 8) & 0xFF))
+    return (header + payload).ljust(_FRAME_SIZE, b"\0")
+
+
+def readManifest(manifestFile):
+    # The (file here, name on the receiver) pairs of a bundle manifest, as readManifest() in
+    # txRadio_v011.py reads them.  Names here are taken from the manifest's directory.
+    directory = os.path.dirname(manifestFile)
+    files = []
+    for line in open(manifestFile).read().split("\n"):
+        names = line.split()
+        if len(names) == 1:
+            files.append((os.path.join(directory, names[0]), names[0]))
+        elif len(names) > 1:
+            files.append((os.path.join(directory, names[0]), names[1]))
+    return files
+
+
+def buildBundle(files):
+    # The bundle of writeBundle() in txRadio_v011.py: a line for each file with its size,
+    # SHA-256 and name on the receiver, an empty line, then the files one after the other.
+    contents = [open(source, "rb").read() for source, target in files]
+    index = b"".join(b"%d %s %s\n" % (len(data), hashlib.sha256(data).hexdigest().encode(), target.encode())
+                     for data, (source, target) in zip(contents, files))
+    return index + b"\n" + b"".join(contents)
+
+
+def buildImage(data, flags, compress):
+    # Returns the image of the file data, to be installed with flags (_IMAGE_MPY,
+    # _IMAGE_BUNDLE or 0).
+    digest = hashlib.sha256(data).digest()
+    installedSize = len(data)
+    if compress:
+        compressor = zlib.compressobj(9, zlib.DEFLATED, _DEFLATE_WBITS)
+        packed = compressor.compress(data) + compressor.flush()
+        if len(packed) < len(data):
+            data = packed
+            flags |= _IMAGE_COMPRESSED
+    frames = []
+    checks = []
+    check = (0, 0)
+    for seq in range((len(data) + _MAX_PAYLOAD - 1) // _MAX_PAYLOAD):
+        payload = data[seq * _MAX_PAYLOAD:(seq + 1) * _MAX_PAYLOAD]
+        frames.append(frame(_FRAME_DATA, seq, payload))
+        check = checksumPayload(check, payload)
+        if seq % _CHECK_BLOCK == _CHECK_BLOCK - 1:
+            checks.append(struct.pack("<HH", *check))
+            check = (0, 0)
+    frames.append(frame(_FRAME_END, len(frames), digest + bytes((flags,))))
+    framesOffset = (_IMAGE_HEADER_SIZE + 4 * len(checks) + _FRAME_SIZE - 1) // _FRAME_SIZE * _FRAME_SIZE
+    header = _IMAGE_MAGIC + struct.pack("<B3xIII", flags, len(data), installedSize, framesOffset) + digest
+    index = (header + b"".join(checks)).ljust(framesOffset, b"\0")
+    return index + b"".join(frames)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build an update image for transmit() on a host.")
+    parser.add_argument("source", nargs="?", help="the file to install on the receiver, e.g. main.py or app.mpy")
+    parser.add_argument("--bundle", metavar="MANIFEST",
+                        help="a bundle manifest (see README.md) instead of the source; the image holds every "
+                             "file it lists, as the receiver is not asked which ones it has")
+    parser.add_argument("-o", "--output", default="update.ota")
+    parser.add_argument("--compress", action="store_true",
+                        help="compress the update, if that makes it smaller; the receiver inflates it")
+    args = parser.parse_args()
+    if (args.source is None) == (args.bundle is None):
+        parser.error("give either a source file or --bundle")
+
+    if args.bundle:
+        files = readManifest(args.bundle)
+        data = buildBundle(files)
+        flags = _IMAGE_BUNDLE
+        contents = "%d files" % len(files)
+    else:
+        data = open(args.source, "rb").read()
+        flags = _IMAGE_MPY if args.source.endswith(".mpy") else 0
+        contents = os.path.basename(args.source)
+    image = buildImage(data, flags, args.compress)
+    open(args.output, "wb").write(image)
+    print("%s: %d bytes in %d frames, for %d bytes of %s" % (
+        args.output, len(image), (len(image) - struct.unpack_from("<I", image, 16)[0]) // _FRAME_SIZE,
+        len(data), contents))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
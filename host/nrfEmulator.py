@@ -0,0 +1,645 @@
+# Host-side (CPython) stand-in for the MicroPython modules and the nRF52840 RADIO peripheral
+# used by txRadio_v011.py and rxRadio_v011.py, so that the real scripts can be run and
+# measured without any boards.
+#
+# Each script runs unmodified in its own thread as a simulated node, with its own directory
+# as the file system.  Modules a script imports from beside it, such as nrfRadio.py, are
+# loaded afresh for each node.  machine.mem32 reads and writes of the RADIO registers drive a
+# model of the peripheral: TASKS_TXEN/RXEN/START/DISABLE, EVENTS_READY/END/DISABLED/CRCOK/
+# CRCERROR, STATE, PACKETPTR, SHORTS, the logical addresses and RXMATCH, with ramp-up and
+# on-air times taken from the MODE register.  Packets go over a shared Channel with configurable loss,
+# latency and bit errors; packets that overlap in time on the same frequency collide.
+# Buffers passed to the radio by address come from uctypes.addressof().
+#
+# Timing is only as good as CPython's threads, so compare runs with each other rather than
+# with the hardware.  See benchmark.py, or for a single transfer:
+#
+#   tx, rx, seconds = runPair("txRadio_v011.py", "rxRadio_v011.py", "work", data, Channel(loss=0.1))
+#
+# EMU_TRACE=1 records the radio activity of each node in its timedLog.  EMU_ZLIB chooses what
+# the firmware offers for compression: "deflate" (the default), "inflate" (a deflate module
+# built without compression) or "uzlib" (older firmware).
+
+import asyncio
+import binascii
+import builtins
+import hashlib
+import os
+import random
+import sys
+import threading
+import time
+import traceback
+import types
+import zlib
+
+_RADIO_BASE = 0x40001000
+_POWER_CLOCK_BASE = 0x40000000
+
+# RADIO register offsets
+_TASKS_TXEN = 0x000
+_TASKS_RXEN = 0x004
+_TASKS_START = 0x008
+_TASKS_STOP = 0x00C
+_TASKS_DISABLE = 0x010
+_TASKS_RSSISTART = 0x014
+_TASKS_RSSISTOP = 0x018
+_EVENTS_READY = 0x100
+_EVENTS_ADDRESS = 0x104
+_EVENTS_PAYLOAD = 0x108
+_EVENTS_END = 0x10C
+_EVENTS_DISABLED = 0x110
+_EVENTS_RSSIEND = 0x11C
+_EVENTS_CRCOK = 0x130
+_EVENTS_CRCERROR = 0x134
+_SHORTS = 0x200
+_PACKETPTR = 0x504
+_FREQUENCY = 0x508
+_TXPOWER = 0x50C
+_MODE = 0x510
+_PCNF0 = 0x514
+_PCNF1 = 0x518
+_BASE0 = 0x51C
+_BASE1 = 0x520
+_PREFIX0 = 0x524
+_PREFIX1 = 0x528
+_TXADDRESS = 0x52C
+_RXADDRESSES = 0x530
+_RSSISAMPLE = 0x548
+_RXMATCH = 0x408
+_STATE = 0x550
+
+_SHORT_READY_START = 1 << 0
+_SHORT_END_DISABLE = 1 << 1
+_SHORT_DISABLED_TXEN = 1 << 2
+_SHORT_DISABLED_RXEN = 1 << 3
+
+_STATE_DISABLED = 0
+_STATE_RXRU = 1
+_STATE_RXIDLE = 2
+_STATE_RX = 3
+_STATE_TXRU = 9
+_STATE_TXIDLE = 10
+_STATE_TX = 11
+
+_EVENTS = (_EVENTS_READY, _EVENTS_ADDRESS, _EVENTS_PAYLOAD, _EVENTS_END, _EVENTS_DISABLED,
+           _EVENTS_RSSIEND, _EVENTS_CRCOK, _EVENTS_CRCERROR)
+
+# on-air bit rate (bits per microsecond) and preamble length (bytes) for each MODE value
+_MODE_BITRATE = {0: 1.0, 1: 2.0, 3: 1.0, 4: 2.0, 5: 0.125, 6: 0.5}
+_RAMP_UP_US = 40
+
+
+class NodeStopped(Exception):
+    pass
+
+
+class NodeReset(Exception):
+    pass
+
+
+def nowUs():
+    return time.perf_counter_ns() // 1000
+
+
+class Channel:
+    # The shared 2.4 GHz medium.  Every transmitted packet is kept for a short while so that
+    # any node that was listening on the same frequency/mode/address when it started can pick it up.
+
+    def __init__(self, loss=0.0, latencyUs=0, bitErrorRate=0.0, seed=1, noise=None, lossModel=None):
+        self.loss = loss
+        self.latencyUs = latencyUs
+        self.bitErrorRate = bitErrorRate
+        self.random = random.Random(seed)
+        self.noise = noise or {}  # frequency -> RSSISAMPLE value (positive, i.e. -dBm)
+        self.lossModel = lossModel  # optional callable(frequency, mode, txPower) -> extra loss probability
+        self.lock = threading.Lock()
+        self.packets = []
+        self.delivered = 0
+        self.packetCount = 0
+        self.dropped = 0
+
+    def transmit(self, sender, startUs, endUs, frequency, mode, txPower, address, data):
+        with self.lock:
+            self.packets = [p for p in self.packets if p[1] > startUs - 200000]
+            self.packetCount += 1
+            self.packets.append((startUs, endUs, frequency, mode, txPower, address, data, sender,
+                                 self.packetCount))
+
+    def lossFor(self, frequency, mode, txPower):
+        loss = self.loss
+        if self.lossModel is not None:
+            extra = self.lossModel(frequency, mode, txPower)
+            loss = 1 - (1 - loss) * (1 - extra)
+        return loss
+
+    def collect(self, receiver, sinceUs, untilUs, frequency, mode, addresses):
+        # returns the first packet the receiver could hear, or None
+        with self.lock:
+            for packet in self.packets:
+                startUs, endUs, pFrequency, pMode, pTxPower, address, data, sender, number = packet
+                if sender is receiver or startUs < sinceUs or endUs + self.latencyUs > untilUs:
+                    continue
+                if pFrequency != frequency or pMode != mode or address not in addresses:
+                    continue
+                if number <= receiver.lastHeard:
+                    continue
+                receiver.lastHeard = number
+                collided = any(other is not packet and other[2] == pFrequency and
+                               other[0] < endUs and startUs < other[1] for other in self.packets)
+                return packet, collided
+        return None, False
+
+
+class Radio:
+    def __init__(self, node):
+        self.node = node
+        self.registers = {}
+        self.state = _STATE_DISABLED
+        self.readyAtUs = 0
+        self.endAtUs = 0
+        self.listenSinceUs = 0
+        self.pendingPacketPtr = 0
+        self.activePacketPtr = 0
+        self.txPacket = None
+        self.startPending = False
+
+    def reg(self, offset):
+        return self.registers.get(offset, 0)
+
+    def shorts(self):
+        return self.reg(_SHORTS)
+
+    def address(self, logical):
+        if logical == 0:
+            base = self.reg(_BASE0)
+        else:
+            base = self.reg(_BASE1)
+        if logical < 4:
+            prefix = (self.reg(_PREFIX0) >> (8 * logical)) & 0xFF
+        else:
+            prefix = (self.reg(_PREFIX1) >> (8 * (logical - 4))) & 0xFF
+        return (prefix, base & 0xFFFFFFFF)
+
+    def write(self, offset, value):
+        self.update()
+        if offset in _EVENTS:
+            self.registers[offset] = value
+            return
+        if offset == _TASKS_TXEN and value:
+            if self.state == _STATE_DISABLED:
+                self.rampUp(_STATE_TXRU)
+        elif offset == _TASKS_RXEN and value:
+            if self.state == _STATE_DISABLED:
+                self.rampUp(_STATE_RXRU)
+        elif offset == _TASKS_START and value:
+            self.start()
+        elif offset == _TASKS_STOP and value:
+            if self.state == _STATE_RX:
+                self.state = _STATE_RXIDLE
+        elif offset == _TASKS_DISABLE and value:
+            self.disable()
+        elif offset == _TASKS_RSSISTART and value:
+            self.registers[_RSSISAMPLE] = self.node.channel.noise.get(self.reg(_FREQUENCY), 100)
+            self.registers[_EVENTS_RSSIEND] = 1
+        elif offset == _PACKETPTR:
+            self.registers[offset] = value
+        else:
+            self.registers[offset] = value
+
+    def read(self, offset):
+        self.update()
+        if offset == _STATE:
+            return self.state
+        value = self.registers.get(offset, 0)
+        if value == 0 and offset in _EVENTS:
+            time.sleep(0)  # a busy-wait poll: let the other node's thread run
+        return value
+
+    def rampUp(self, state):
+        self.state = state
+        self.readyAtUs = nowUs() + _RAMP_UP_US
+
+    def disable(self):
+        self.node.trace("disable")
+        self.startPending = False
+        self.state = _STATE_DISABLED
+        self.registers[_EVENTS_DISABLED] = 1
+        shorts = self.shorts()
+        if shorts & _SHORT_DISABLED_TXEN:
+            self.rampUp(_STATE_TXRU)
+        elif shorts & _SHORT_DISABLED_RXEN:
+            self.rampUp(_STATE_RXRU)
+
+    def start(self):
+        now = nowUs()
+        if self.state in (_STATE_TXRU, _STATE_RXRU):
+            self.startPending = True  # lenient: START during ramp-up fires once READY
+            return
+        self.activePacketPtr = self.reg(_PACKETPTR)
+        if self.state == _STATE_TXIDLE:
+            buffer = self.node.memory(self.activePacketPtr)
+            length = buffer[0]
+            data = bytes(buffer[0:1 + length])
+            mode = self.reg(_MODE)
+            airtimeUs = int((10 + len(data) + 3) * 8 / _MODE_BITRATE.get(mode, 2.0))
+            self.state = _STATE_TX
+            self.endAtUs = now + airtimeUs
+            self.node.channel.transmit(self.node, now, self.endAtUs, self.reg(_FREQUENCY), mode,
+                                       self.reg(_TXPOWER), self.address(self.reg(_TXADDRESS)), data)
+            self.node.packetsSent += 1
+            self.node.trace("tx %d" % len(data))
+        elif self.state == _STATE_RXIDLE:
+            self.state = _STATE_RX
+            self.listenSinceUs = now
+            self.node.trace("listen")
+
+    def update(self):
+        node = self.node
+        if node.stopped:
+            raise NodeStopped()
+        now = nowUs()
+        while True:
+            if self.state in (_STATE_TXRU, _STATE_RXRU) and now >= self.readyAtUs:
+                self.state = _STATE_TXIDLE if self.state == _STATE_TXRU else _STATE_RXIDLE
+                self.registers[_EVENTS_READY] = 1
+                if (self.shorts() & _SHORT_READY_START) or self.startPending:
+                    self.startPending = False
+                    self.start()
+                continue
+            if self.state == _STATE_TX and now >= self.endAtUs:
+                self.state = _STATE_TXIDLE
+                self.registers[_EVENTS_END] = 1
+                if self.shorts() & _SHORT_END_DISABLE:
+                    self.disable()
+                continue
+            if self.state == _STATE_RX:
+                if self.receive(now):
+                    continue
+            return
+
+    def receive(self, now):
+        channel = self.node.channel
+        rxAddresses = self.reg(_RXADDRESSES)
+        addresses = [self.address(i) for i in range(8) if rxAddresses & (1 << i)]
+        packet, collided = channel.collect(self.node, self.listenSinceUs, now, self.reg(_FREQUENCY),
+                                           self.reg(_MODE), addresses)
+        if packet is None:
+            return False
+        startUs, endUs, frequency, mode, txPower, address, data, sender, number = packet
+        rng = channel.random
+        if rng.random() < channel.lossFor(frequency, mode, txPower):
+            channel.dropped += 1
+            self.node.trace("dropped #%d" % number)
+            return False  # preamble/address never detected; radio keeps listening
+        data = bytearray(data)
+        corrupt = collided
+        if channel.bitErrorRate:
+            for i in range(len(data) * 8):
+                if rng.random() < channel.bitErrorRate:
+                    data[i >> 3] ^= 1 << (i & 7)
+                    corrupt = True
+        buffer = self.node.memory(self.activePacketPtr)
+        buffer[0:len(data)] = data[0:len(buffer)]
+        self.registers[_RXMATCH] = [i for i in range(8) if rxAddresses & (1 << i) and
+                                    self.address(i) == address][0]
+        channel.delivered += 1
+        self.node.trace("rx #%d len %d%s" % (number, len(data), " CORRUPT" if corrupt else ""))
+        self.state = _STATE_RXIDLE
+        self.registers[_EVENTS_ADDRESS] = 1
+        self.registers[_EVENTS_PAYLOAD] = 1
+        self.registers[_EVENTS_END] = 1
+        if corrupt:
+            self.registers[_EVENTS_CRCERROR] = 1
+        else:
+            self.registers[_EVENTS_CRCOK] = 1
+        if self.shorts() & _SHORT_END_DISABLE:
+            self.disable()
+        return True
+
+
+class Mem32:
+    def __init__(self, node):
+        self.node = node
+
+    def __getitem__(self, address):
+        if _RADIO_BASE <= address < _RADIO_BASE + 0x1000:
+            return self.node.radio.read(address - _RADIO_BASE)
+        if self.node.stopped:
+            raise NodeStopped()
+        return self.node.peripherals.get(address, 1 if address == _POWER_CLOCK_BASE + 0x100 else 0)
+
+    def __setitem__(self, address, value):
+        value &= 0xFFFFFFFF
+        if _RADIO_BASE <= address < _RADIO_BASE + 0x1000:
+            self.node.radio.write(address - _RADIO_BASE, value)
+        else:
+            self.node.peripherals[address] = value
+
+
+_addresses = {}
+_nextAddress = [0x20001000]
+_addressLock = threading.Lock()
+
+
+def addressof(obj):
+    with _addressLock:
+        for address, buffer in _addresses.items():
+            if buffer is obj:
+                return address
+        address = _nextAddress[0]
+        _nextAddress[0] += 0x1000
+        _addresses[address] = obj
+        return address
+
+
+class Sha256:
+    # MicroPython's uhashlib accepts str as well as bytes-like objects
+    def __init__(self, data=b""):
+        self.hash = hashlib.sha256()
+        self.update(data)
+
+    def update(self, data):
+        self.hash.update(data.encode() if isinstance(data, str) else data)
+
+    def digest(self):
+        return self.hash.digest()
+
+
+class DecompIO:
+    # uzlib.DecompIO / deflate.DeflateIO opened for reading (zlib format only)
+    def __init__(self, stream, wbits):
+        self.stream = stream
+        self.inflater = zlib.decompressobj(wbits)
+        self.pending = b""
+
+    def read(self, n=-1):
+        while (n < 0 or len(self.pending) < n) and not self.inflater.eof:
+            data = self.stream.read(256)
+            if not data:
+                break
+            try:
+                self.pending += self.inflater.decompress(data)
+            except zlib.error as e:
+                raise OSError(str(e))
+        if n < 0:
+            n = len(self.pending)
+        out, self.pending = self.pending[:n], self.pending[n:]
+        return out
+
+
+class DeflateIO(DecompIO):
+    def __init__(self, stream, format=2, wbits=0, canCompress=True):
+        DecompIO.__init__(self, stream, wbits or 15)
+        self.compressor = zlib.compressobj(9, zlib.DEFLATED, wbits or 15)
+        self.canCompress = canCompress
+
+    def write(self, data):
+        if not self.canCompress:
+            raise AttributeError("write")
+        self.stream.write(self.compressor.compress(bytes(data)))
+        return len(data)
+
+    def close(self):
+        if self.canCompress:
+            self.stream.write(self.compressor.flush())
+
+
+class Node:
+    def __init__(self, name, channel, directory, serialBaud=115200, echo=False):
+        self.name = name
+        self.channel = channel
+        self.directory = directory
+        self.serialBaud = serialBaud
+        self.echo = echo
+        self.stopped = False
+        self.peripherals = {0x10000060: binascii.crc32(name.encode()),  # FICR DEVICEID[0..1]
+                            0x10000064: binascii.crc32(name.encode() + b"1")}
+        self.lastHeard = 0
+        self.packetsSent = 0
+        self.radio = Radio(self)
+        self.log = []
+        self.timedLog = []
+        self.tracing = os.environ.get("EMU_TRACE") == "1"
+        self.modules = {}
+        self.namespace = None
+        self.result = None
+        self.error = None
+        self.resetCount = 0
+        self.finishedUs = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def trace(self, text):
+        if self.tracing:
+            self.timedLog.append((nowUs(), "~" + text))
+
+    def memory(self, address):
+        return _addresses[address]
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    # ---- MicroPython module stand-ins -----------------------------------------------------
+
+    def buildModules(self):
+        node = self
+
+        micropython = types.ModuleType("micropython")
+        micropython.const = lambda value: value
+        micropython.native = lambda function: function
+        micropython.viper = lambda function: function
+        micropython.mem_info = lambda *args: None
+
+        machine = types.ModuleType("machine")
+        machine.mem32 = Mem32(self)
+
+        def reset():
+            node.resetCount += 1
+            raise NodeReset()
+        machine.reset = reset
+
+        uctypes = types.ModuleType("uctypes")
+        uctypes.addressof = addressof
+
+        utime = types.ModuleType("utime")
+        period = 1 << 30
+        utime.ticks_us = lambda: nowUs() & (period - 1)
+        utime.ticks_ms = lambda: (nowUs() // 1000) & (period - 1)
+        utime.ticks_add = lambda ticks, delta: (ticks + delta) & (period - 1)
+        utime.ticks_diff = lambda a, b: ((a - b + period // 2) & (period - 1)) - period // 2
+        utime.sleep_ms = lambda ms: self.sleep(ms / 1000)
+        utime.sleep_us = lambda us: self.sleep(us / 1000000)
+        utime.sleep = lambda s: self.sleep(s)
+        utime.time = time.time
+
+        gc = types.ModuleType("gc")
+        gc.collect = lambda: None
+        gc.mem_free = lambda: 100000
+        gc.mem_alloc = lambda: 50000
+
+        uhashlib = types.ModuleType("uhashlib")
+        uhashlib.sha256 = Sha256
+
+        ubinascii = types.ModuleType("ubinascii")
+        ubinascii.hexlify = binascii.hexlify
+        ubinascii.unhexlify = binascii.unhexlify
+
+        uos = types.ModuleType("uos")
+        uos.rename = lambda a, b: os.replace(self.path(a), self.path(b))
+        uos.remove = lambda a: os.remove(self.path(a))
+        uos.stat = lambda a: tuple(os.stat(self.path(a)))
+        uos.listdir = lambda a="": os.listdir(self.path(a))
+        uos.mkdir = lambda a: os.mkdir(self.path(a))
+        uos.statvfs = lambda a="": (4096, 4096, 256, 200, 200, 0, 0, 0, 0, 255)
+
+        # the node's coroutines run on an event loop of its own, in its thread
+        uasyncio = types.ModuleType("uasyncio")
+
+        async def sleep(seconds):
+            if node.stopped:
+                raise NodeStopped()
+            await asyncio.sleep(seconds)
+        uasyncio.sleep = sleep
+        uasyncio.sleep_ms = lambda ms: sleep(ms / 1000)
+        uasyncio.run = asyncio.run
+        uasyncio.create_task = asyncio.create_task
+        uasyncio.gather = asyncio.gather
+
+        self.modules = {"micropython": micropython, "machine": machine, "uctypes": uctypes,
+                        "utime": utime, "gc": gc, "uhashlib": uhashlib, "ubinascii": ubinascii,
+                        "uos": uos, "uasyncio": uasyncio}
+
+        # see EMU_ZLIB at the top
+        zlibKind = os.environ.get("EMU_ZLIB", "deflate")
+        if zlibKind == "uzlib":
+            uzlib = types.ModuleType("uzlib")
+            uzlib.DecompIO = DecompIO
+            self.modules["uzlib"] = uzlib
+        else:
+            deflate = types.ModuleType("deflate")
+            deflate.AUTO, deflate.RAW, deflate.ZLIB, deflate.GZIP = 0, 1, 2, 3
+            deflate.DeflateIO = lambda stream, format=0, wbits=0, close=False: DeflateIO(
+                stream, format, wbits, zlibKind == "deflate")
+            self.modules["deflate"] = deflate
+
+    def sleep(self, seconds):
+        end = time.perf_counter() + seconds
+        while True:
+            if self.stopped:
+                raise NodeStopped()
+            remaining = end - time.perf_counter()
+            if remaining <= 0:
+                return
+            time.sleep(min(remaining, 0.01))
+
+    def importModule(self, name, globals=None, locals=None, fromlist=(), level=0):
+        if name in self.modules:
+            return self.modules[name]
+        local = os.path.join(os.path.dirname(self.scriptPath), name + ".py")
+        if os.path.exists(local):
+            self.modules[name] = self.loadModule(local, name)
+            return self.modules[name]
+        return builtins.__import__(name, globals, locals, fromlist, level)
+
+    def open(self, name, mode="r"):
+        if "b" in mode:
+            return builtins.open(self.path(name), mode)
+        return builtins.open(self.path(name), mode, encoding="utf-8", newline="")  # no newline translation
+
+    def print(self, *args, sep=" ", end="\n", **kwargs):
+        text = sep.join(str(a) for a in args) + end
+        self.log.append(text)
+        self.timedLog.append((nowUs(), text))
+        if self.echo:
+            sys.stdout.write("[" + self.name + "] " + text)
+        if self.serialBaud:
+            self.sleep(len(text) * 10 / self.serialBaud)
+
+    def loadModule(self, path, name):
+        namespaceBuiltins = dict(builtins.__dict__)
+        namespaceBuiltins["__import__"] = self.importModule
+        namespaceBuiltins["open"] = self.open
+        namespaceBuiltins["print"] = self.print
+        for viperType in ("ptr", "ptr8", "ptr16", "ptr32", "uint"):  # viper annotations
+            namespaceBuiltins[viperType] = object
+        module = types.ModuleType(name)
+        module.__dict__["__builtins__"] = namespaceBuiltins
+        module.__dict__["__file__"] = path
+        with builtins.open(path) as source:
+            code = compile(source.read(), path, "exec")
+        exec(code, module.__dict__)
+        return module
+
+    def load(self, scriptPath):
+        self.scriptPath = scriptPath
+        self.buildModules()
+        self.namespace = self.loadModule(scriptPath, "__main__").__dict__
+        return self.namespace
+
+    def run(self, functionName, *args, **kwargs):
+        def body():
+            try:
+                self.result = self.namespace[functionName](*args, **kwargs)
+            except NodeReset:
+                self.result = "reset"
+            except NodeStopped:
+                self.result = "stopped"
+            except BaseException as error:  # whatever the node's script raised
+                self.error = error
+                traceback.print_exc()
+            self.finishedUs = nowUs()
+        self.thread = threading.Thread(target=body, name=self.name, daemon=True)
+        self.thread.start()
+        return self.thread
+
+    def stop(self):
+        self.stopped = True
+
+
+def runGroup(txScript, rxScript, workDir, updateBytes, receivers=3, channel=None, timeout=60,
+             echo=False, serialBaud=115200, txCall="broadcast", rxCall="receive", txArgs=(),
+             txKwargs=None, updateName="update.txt", txFiles=None, rxFiles=None):
+    # Runs txCall on one node and rxCall on each of the receivers, with updateBytes in the
+    # transmitter's updateName and any other files given.  Returns the transmitter node, the
+    # receiver nodes and the seconds from the start of txCall until every node had finished
+    # (or the timeout).
+    sys.setswitchinterval(0.0001)  # let the nodes' threads take turns quickly
+    channel = channel or Channel()
+    tx = Node("tx", channel, os.path.join(workDir, "tx"), serialBaud, echo)
+    rxs = [Node("rx%d" % i, channel, os.path.join(workDir, "rx%d" % i), serialBaud, echo)
+           for i in range(receivers)]
+    with builtins.open(tx.path(updateName), "wb") as f:
+        f.write(updateBytes)
+    for node, files in [(tx, txFiles)] + [(rx, rxFiles) for rx in rxs]:
+        for name, data in (files or {}).items():
+            with builtins.open(node.path(name), "wb") as f:
+                f.write(data)
+        node.load(txScript if node is tx else rxScript)
+    rxThreads = [rx.run(rxCall) for rx in rxs]
+    time.sleep(0.05)  # the receivers are listening before the transmitter starts
+    started = time.perf_counter()
+    startedUs = nowUs()
+    txThread = tx.run(txCall, *txArgs, **(txKwargs or {}))
+    txThread.join(timeout)
+    for thread in rxThreads:
+        thread.join(max(0.0, timeout - (time.perf_counter() - started)))
+    finished = [node.finishedUs for node in [tx] + rxs]
+    if all(finished):
+        elapsed = (max(finished) - startedUs) / 1000000
+    else:
+        elapsed = time.perf_counter() - started
+    for node in [tx] + rxs:
+        node.stop()
+    for thread in [txThread] + rxThreads:
+        thread.join(1)
+    return tx, rxs, elapsed
+
+
+def runPair(txScript, rxScript, workDir, updateBytes, channel=None, timeout=60, echo=False,
+            serialBaud=115200, txCall="transmit", rxCall="receive", txArgs=(), txKwargs=None,
+            updateName="update.txt", txFiles=None, rxFiles=None):
+    # one transmitter and one receiver; see runGroup()
+    tx, rxs, elapsed = runGroup(txScript, rxScript, workDir, updateBytes, 1, channel, timeout,
+                                echo, serialBaud, txCall, rxCall, txArgs, txKwargs, updateName,
+                                txFiles, rxFiles)
+    return tx, rxs[0], elapsed
@@ -0,0 +1,222 @@
+# Fault scenarios for the OTA update, run on a host against the real txRadio_v011.py and
+# rxRadio_v011.py through the radio emulator in nrfEmulator.py.
+#
+# The receiver runs serve() for the whole scenario, as it would under an application, while
+# transmitters come and go.  Each scenario sets up a fault that a benchmark run never meets and
+# checks that the receiver still ends up running the update:
+#   reset      the transmitter resets partway; transmit() again carries on from the receiver's
+#              checkpoint instead of starting over (plain, compress, fec and an image)
+#   quiet      the transmitter goes quiet partway; the receiver gives up after _SESSION_IDLE_MS
+#              and takes the next transmit()
+#   ready      the receiver's radio withholds READY once and an RSSI sample never ends; the
+#              driver gives up on both instead of hanging
+#   broadcast  a broadcast fails the SHA-256 check, so the receiver NACKs it; a unicast
+#              transmit() to the same receiver follows
+#
+# Examples:
+#   python3 host/scenarios.py
+#   python3 host/scenarios.py reset quiet --loss 0.2
+
+import argparse
+import builtins
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import nrfEmulator
+from buildImage import buildImage
+from nrfEmulator import Channel, Node
+
+_REPO = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+_TX_SCRIPT = os.path.join(_REPO, "txRadio_v011.py")
+_RX_SCRIPT = os.path.join(_REPO, "rxRadio_v011.py")
+
+
+def makeUpdate(size):
+    source = open(_RX_SCRIPT, "rb").read()  # realistic, compressible MicroPython source
+    return (source * (size // len(source) + 1))[:size]
+
+
+def waitFor(condition, timeout):
+    started = time.perf_counter()
+    while time.perf_counter() - started < timeout:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def startReceiver(workDir, channel):
+    # a receiver that runs serve() until it installs an update, or is stopped
+    sys.setswitchinterval(0.0001)  # let the nodes' threads take turns quickly
+    rx = Node("rx", channel, os.path.join(workDir, "rx"))
+    namespace = rx.load(_RX_SCRIPT)
+    namespace["serveForever"] = lambda: rx.modules["uasyncio"].run(namespace["serve"]())
+    rx.run("serveForever")
+    time.sleep(0.05)  # listening before the first transmitter starts
+    return rx
+
+
+def runTransmitter(workDir, channel, data, timeout, call="transmit", kwargs=None, files=None,
+                   until=None, patch=None):
+    # One run of call on a transmitter whose flash is workDir/tx, so a second run is the same
+    # node after a reset.  It is stopped after timeout seconds, or as soon as until() holds.
+    tx = Node("tx", channel, os.path.join(workDir, "tx"))
+    with builtins.open(tx.path("update.txt"), "wb") as f:
+        f.write(data)
+    for name, contents in (files or {}).items():
+        with builtins.open(tx.path(name), "wb") as f:
+            f.write(contents)
+    namespace = tx.load(_TX_SCRIPT)
+    if patch:
+        patch(namespace)
+    thread = tx.run(call, **(kwargs or {}))
+    if until:
+        waitFor(lambda: until() or not thread.is_alive(), timeout)
+    else:
+        thread.join(timeout)
+    tx.stop()
+    thread.join(1)
+    return tx
+
+
+def received(rx):
+    # bytes the receiver has written to update.txt so far, which is the file as sent, so
+    # compressed only a third or so of the update
+    try:
+        return os.path.getsize(rx.path("update.txt"))
+    except OSError:
+        return 0
+
+
+def installed(rx, data):
+    waitFor(lambda: rx.result is not None, 5)  # the receiver resets once it has installed it
+    try:
+        return builtins.open(rx.path("main.py"), "rb").read() == data
+    except OSError:
+        return False
+
+
+def logged(node, text):
+    return any(text in line for line in node.log)
+
+
+def reset(workDir, channel, args, case):
+    data = makeUpdate(args.size)
+    kwargs = {}
+    files = None
+    if case == "image":
+        files = {"update.ota": buildImage(data, 0, False)}
+        kwargs = {"theFile": "update.ota"}
+    elif case != "plain":
+        kwargs = {case: True}
+    rx = startReceiver(workDir, channel)
+    try:
+        runTransmitter(workDir, channel, data, args.timeout, kwargs=kwargs, files=files,
+                       until=lambda: received(rx) >= args.size // 8)
+        tx = runTransmitter(workDir, channel, data, args.timeout, kwargs=kwargs, files=files)
+        return tx.result is True and logged(tx, "carrying on from there") and installed(rx, data)
+    finally:
+        rx.stop()
+
+
+def quiet(workDir, channel, args, case):
+    data = makeUpdate(args.size)
+    rx = startReceiver(workDir, channel)
+    try:
+        runTransmitter(workDir, channel, data, args.timeout,
+                       until=lambda: received(rx) >= args.size // 8)
+        if not waitFor(lambda: logged(rx, "Waiting for the update to be sent again"), 10):
+            return False
+        tx = runTransmitter(workDir, channel, data, args.timeout)
+        return tx.result is True and installed(rx, data)
+    finally:
+        rx.stop()
+
+
+def ready(workDir, channel, args, case):
+    data = makeUpdate(args.size)
+    rx = startReceiver(workDir, channel)
+    counts = {"rampUp": 0, "rssi": 0}
+    rampUp = rx.radio.rampUp
+    write = rx.radio.write
+
+    def withheldReady(state):
+        rampUp(state)
+        if state == nrfEmulator._STATE_TXRU and (rx.radio.shorts() & 0x08):  # DISABLED_RXEN
+            counts["rampUp"] += 1
+            if counts["rampUp"] == 5:  # the turnaround of an ACK that never gets READY
+                rx.radio.readyAtUs = nrfEmulator.nowUs() + 10 ** 9
+
+    def lostRssiSample(offset, value):
+        if offset == nrfEmulator._TASKS_RSSISTART and value:
+            counts["rssi"] += 1
+            if counts["rssi"] == 3:  # RSSIEND never comes
+                return
+        write(offset, value)
+
+    rx.radio.rampUp = withheldReady
+    rx.radio.write = lostRssiSample
+    try:
+        tx = runTransmitter(workDir, channel, data, args.timeout)
+        return tx.result is True and counts["rampUp"] >= 5 and counts["rssi"] >= 3 and installed(rx, data)
+    finally:
+        rx.stop()
+
+
+def broadcast(workDir, channel, args, case):
+    data = makeUpdate(args.size)
+
+    def wrongHash(namespace):
+        sendGroupFrames = namespace["sendGroupFrames"]
+        namespace["sendGroupFrames"] = lambda f, resend, endSeq, theHash, imageFlags, fec, fileHash: \
+            sendGroupFrames(f, resend, endSeq, "00" * 32, imageFlags, fec, None)
+
+    rx = startReceiver(workDir, channel)
+    try:
+        tx = runTransmitter(workDir, channel, data, args.timeout, "broadcast", patch=wrongHash)
+        if tx.result is True:
+            return False  # the receiver took an update that failed its check
+        tx = runTransmitter(workDir, channel, data, args.timeout)
+        return tx.result is True and installed(rx, data)
+    finally:
+        rx.stop()
+
+
+_SCENARIOS = {"reset": (reset, ("plain", "compress", "fec", "image")), "quiet": (quiet, ("plain",)),
+              "ready": (ready, ("plain",)), "broadcast": (broadcast, ("plain",))}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the OTA update through faults in the radio emulator.")
+    parser.add_argument("scenarios", nargs="*", help="reset, quiet, ready or broadcast; all of them by default")
+    parser.add_argument("--size", type=int, default=150000, help="update size in bytes")
+    parser.add_argument("--loss", type=float, default=0.1, help="packet loss rate")
+    parser.add_argument("--seed", type=int, default=3)
+    parser.add_argument("--timeout", type=float, default=120, help="seconds allowed for each transmitter")
+    args = parser.parse_args()
+    for name in args.scenarios:
+        if name not in _SCENARIOS:
+            parser.error("no scenario called " + name)
+
+    print("%-10s %-9s %8s %s" % ("scenario", "case", "seconds", "ok"))
+    failed = False
+    for name in args.scenarios or ["reset", "quiet", "ready", "broadcast"]:
+        scenario, cases = _SCENARIOS[name]
+        for case in cases:
+            workDir = tempfile.mkdtemp(prefix="otaScenario")
+            started = time.perf_counter()
+            try:
+                ok = scenario(workDir, Channel(loss=args.loss, seed=args.seed), args, case)
+            finally:
+                shutil.rmtree(workDir, ignore_errors=True)
+            failed = failed or not ok
+            print("%-10s %-9s %8.2f %s" % (name, case, time.perf_counter() - started, "yes" if ok else "NO"))
+            sys.stdout.flush()
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
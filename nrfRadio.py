@@ -0,0 +1,308 @@
+# The nRF52840 RADIO driver shared by txRadio_v011.py, rxRadio_v011.py and any application
+# code on the node.  It holds the register table, the radio buffer and the turnaround layer,
+# so none of them are compiled more than once, and keeps no state of the OTA protocol, so it
+# can be frozen into the firmware or shipped precompiled:
+#   mpy-cross nrfRadio.py
+# then load nrfRadio.mpy onto the node instead of nrfRadio.py.  Either way it has to be on
+# both nodes, next to the OTA scripts.
+#
+# The API, all of it for a radio that has been set up with radioConfigure():
+#   radioConfigure(...)        set up the clocks, the packet format and the addresses
+#   radioSetMode(...)          MODE, TXPOWER and FREQUENCY; radioSetFrequency() only the last
+#   radioTransmit(tx, rx)      send a frame, and turn around in hardware to listen for a reply
+#   radioSend(tx)              send a frame and wait until it has gone
+#   radioListen(rx)            start listening for a frame
+#   radioReceived()            whether a frame has arrived since, polled
+#   radioReceive(rx, us)       listen and wait up to us microseconds for a frame
+#   radioDisable()             stop whatever the radio is doing
+# A frame is a buffer whose first byte is LENGTH, the number of bytes that follow; tx and rx
+# are the addresses of buffers (see uctypes.addressof()) of at least 256 bytes.
+#
+# ATTRIBUTIONS: Thank you to Peter Hinch (aka "pythoncoder") for his suggestions on how
+# to improve the efficiency of variables declared with const(..).
+
+from micropython import const  # needed to efficiently access memory by avoiding micropython lookups
+import machine  # so can peek and poke different registers on the nRF5x
+import uctypes # needed to create the radio buffer (a byte array)
+import utime # needed to create delays
+
+radioBuffer_size = 256
+radioBuffer = bytearray(radioBuffer_size)  # allocate IO buffer for use by nRF5x radio
+radioBuffer_address = uctypes.addressof(radioBuffer)
+
+_NRF_POWER = const(0x40000000)
+_DCDCEN = const(0x578)
+_NRF_POWER___DCDCEN = const(_NRF_POWER + _DCDCEN)
+
+_NRF_CLOCK = const(0x40000000)
+_TASKS_HFCLKSTART = const(0)
+_EVENTS_HFCLKSTARTED = const(0x100)
+_NRF_CLOCK___TASKS_HFCLKSTART = const(_NRF_CLOCK + _TASKS_HFCLKSTART)
+_NRF_CLOCK___EVENTS_HFCLKSTARTED = const(_NRF_CLOCK + _EVENTS_HFCLKSTARTED)
+
+_NRF_FICR = const(0x10000000)
+_DEVICEID0 = const(0x060)
+_NRF_FICR___DEVICEID0 = const(_NRF_FICR + _DEVICEID0)
+
+_NRF_RADIO = const(0x40001000)
+_BASE0 = const(0x51C)
+_BASE1 = const(0x520)
+_PREFIX0 = const(0x524)
+_FREQUENCY = const(0x508)
+_PCNF1 = const(0x518)
+_PCNF0 = const(0x514)
+_MODE = const(0x510)
+_MODECNF0 = const(0x650)
+_CRCCNF = const(0x534)
+_PACKETPTR = const(0x504)
+_TXADDRESS = const(0x52C)
+_RXADDRESSES = const(0x530)
+_TXPOWER = const(0x50C)
+_TASKS_DISABLE = const(0x010)
+_STATE = const(0x550)
+_TASKS_TXEN = const(0)
+_TASKS_RXEN = const(0x004)
+_EVENTS_READY = const(0x100)
+_EVENTS_DISABLED = const(0x110)
+_EVENTS_CRCOK = const(0x130)
+_RXMATCH = const(0x408)
+_SHORTS = const(0x200)
+_TASKS_RSSISTART = const(0x014)
+_EVENTS_RSSIEND = const(0x11C)
+_RSSISAMPLE = const(0x548)
+_NRF_RADIO___BASE0 = const(_NRF_RADIO + _BASE0)
+_NRF_RADIO___BASE1 = const(_NRF_RADIO + _BASE1)
+_NRF_RADIO___PREFIX0 = const(_NRF_RADIO + _PREFIX0)
+_NRF_RADIO___FREQUENCY = const(_NRF_RADIO + _FREQUENCY)
+_NRF_RADIO___PCNF1 = const(_NRF_RADIO + _PCNF1)
+_NRF_RADIO___PCNF0 = const(_NRF_RADIO + _PCNF0)
+_NRF_RADIO___MODE = const(_NRF_RADIO + _MODE)
+_NRF_RADIO___MODECNF0 = const(_NRF_RADIO + _MODECNF0)
+_NRF_RADIO___CRCCNF = const(_NRF_RADIO + _CRCCNF)
+_NRF_RADIO___PACKETPTR = const(_NRF_RADIO + _PACKETPTR)
+_NRF_RADIO___TXADDRESS = const(_NRF_RADIO + _TXADDRESS)
+_NRF_RADIO___RXADDRESSES = const(_NRF_RADIO + _RXADDRESSES)
+_NRF_RADIO___TXPOWER = const(_NRF_RADIO + _TXPOWER)
+_NRF_RADIO___TASKS_DISABLE = const(_NRF_RADIO + _TASKS_DISABLE)
+_NRF_RADIO___STATE = const(_NRF_RADIO + _STATE)
+_NRF_RADIO___TASKS_TXEN = const(_NRF_RADIO + _TASKS_TXEN)
+_NRF_RADIO___TASKS_RXEN = const(_NRF_RADIO + _TASKS_RXEN)
+_NRF_RADIO___EVENTS_READY = const(_NRF_RADIO + _EVENTS_READY)
+_NRF_RADIO___EVENTS_DISABLED = const(_NRF_RADIO + _EVENTS_DISABLED)
+_NRF_RADIO___EVENTS_CRCOK = const(_NRF_RADIO + _EVENTS_CRCOK)
+_NRF_RADIO___RXMATCH = const(_NRF_RADIO + _RXMATCH)
+_NRF_RADIO___SHORTS = const(_NRF_RADIO + _SHORTS)
+_NRF_RADIO___TASKS_RSSISTART = const(_NRF_RADIO + _TASKS_RSSISTART)
+_NRF_RADIO___EVENTS_RSSIEND = const(_NRF_RADIO + _EVENTS_RSSIEND)
+_NRF_RADIO___RSSISAMPLE = const(_NRF_RADIO + _RSSISAMPLE)
+
+# SHORTS let the radio chain its own tasks and events in hardware
+_SHORTS_READY_START = const(0x01)
+_SHORTS_END_DISABLE = const(0x02)
+_SHORTS_DISABLED_RXEN = const(0x08)
+
+_CODED_MODE = const(5)  # MODE values from here up (Ble_LR125Kbit, Ble_LR500Kbit) are coded
+
+# The longest the radio takes to get through a frame: ramp-up, 255 bytes at 125 kbps and the
+# turnaround.  A wait for an event that has not come by then gives up, as the event was missed.
+_EVENT_TIMEOUT_US = const(25000)
+
+radioPrefixes = 0  # PREFIX0 as radioConfigure() set it, see radioUseGroup()
+
+def initializeHardware():  # enable the DCDC voltage regulator
+    machine.mem32[_NRF_POWER___DCDCEN] = 1  # NRF_POWER->DCDCEN=1;
+
+def initializeClocks():
+    machine.mem32[_NRF_CLOCK___TASKS_HFCLKSTART] = 1 # activate the high frequency crystal oscillator
+    # wait until high frequency clock start is confirmed
+    while (machine.mem32[_NRF_CLOCK___EVENTS_HFCLKSTARTED] == 0):
+        True
+    # ASERTION: High frequency clock now activated and running
+
+def radioConfigure(myBase, myPrefix, targetBase, targetPrefix, groupPrefix=-1):
+    # Logical address 0 (BASE0/AP0) is this node and logical address 1 (BASE1/AP1) is the
+    # other node, so the addresses never have to be rewritten between TX and RX.  With a
+    # groupPrefix, logical address 2 (BASE1/AP2) is the other node's group address and is
+    # listened on as well.  Frames are sent to the other node.  Leaves the radio DISABLED,
+    # at the MODE, TXPOWER and FREQUENCY it had; see radioSetMode().
+    global radioPrefixes
+    initializeHardware()
+    initializeClocks()
+    # Enable data whitening.
+    # Base address is 4 bytes long (possible range is 2 to 4) and
+    # max size of payload is 255,and 0 bytes of static length payload
+    machine.mem32[_NRF_RADIO___PCNF1] = 0x020400FF  # 0x020400FF
+    # Use an 8-byte preamble, and LENGTH can be 8 bits long.  S0 and S1 are all zero bits long.
+    machine.mem32[_NRF_RADIO___PCNF0] = 0x03000008
+
+    machine.mem32[_NRF_RADIO___MODECNF0] = 1  # enable fast ramp-up of radio from DISABLED state.
+
+    machine.mem32[_NRF_RADIO___CRCCNF] = 3  # CRC will be 3 (3 is max)  bytes and is computed including the address field
+    machine.mem32[_NRF_RADIO___PACKETPTR] = radioBuffer_address  # pointer to the payload in radioBuffer
+
+    machine.mem32[_NRF_RADIO___BASE0] = myBase
+    machine.mem32[_NRF_RADIO___BASE1] = targetBase
+    radioPrefixes = (targetPrefix << 8) | myPrefix
+    machine.mem32[_NRF_RADIO___TXADDRESS] = 1  # transmit to the other node
+    if (groupPrefix >= 0):
+        radioPrefixes = radioPrefixes | (groupPrefix << 16)
+        machine.mem32[_NRF_RADIO___RXADDRESSES] = 0x05  # receive on logical addresses 0 and 2
+    else:
+        machine.mem32[_NRF_RADIO___RXADDRESSES] = 1  # receive on logical address 0 only
+    machine.mem32[_NRF_RADIO___PREFIX0] = radioPrefixes
+    radioDisable()
+
+def radioSetMode(mode, txPower, frequency):
+    # The radio must be DISABLED.  The coded modes need a 4 byte address (3 bytes of base and
+    # the prefix) and the coding indicator and TERM fields of PCNF0.
+    if (mode >= _CODED_MODE):
+        machine.mem32[_NRF_RADIO___PCNF1] = 0x020300FF
+        machine.mem32[_NRF_RADIO___PCNF0] = 0x63800008
+    else:
+        machine.mem32[_NRF_RADIO___PCNF1] = 0x020400FF
+        machine.mem32[_NRF_RADIO___PCNF0] = 0x03000008
+    machine.mem32[_NRF_RADIO___MODE] = mode
+    machine.mem32[_NRF_RADIO___TXPOWER] = txPower  # dBm
+    machine.mem32[_NRF_RADIO___FREQUENCY] = frequency  # MHz above 2400
+
+def radioSetFrequency(frequency):
+    # the radio must be DISABLED
+    machine.mem32[_NRF_RADIO___FREQUENCY] = frequency
+
+def radioUseGroup(groupPrefix):
+    # For a broadcast logical address 0 becomes this node's group address, so frames are sent
+    # to every node listening on it at once and their replies come back on it.
+    # radioConfigure() undoes this.
+    machine.mem32[_NRF_RADIO___PREFIX0] = (radioPrefixes & 0xFFFFFF00) | groupPrefix
+    machine.mem32[_NRF_RADIO___TXADDRESS] = 0
+
+def radioSendTo(logicalAddress):
+    # frames go to logicalAddress from now on, e.g. 2 for the other node's group address
+    machine.mem32[_NRF_RADIO___TXADDRESS] = logicalAddress
+
+def radioMatch():
+    # the logical address the last frame arrived on
+    return machine.mem32[_NRF_RADIO___RXMATCH]
+
+def deviceId():
+    # the low 16 bits of this chip's factory-programmed device ID
+    return machine.mem32[_NRF_FICR___DEVICEID0] & 0xFFFF
+
+# Radio turnaround layer.  Every packet ends with the radio switching itself off (END_DISABLE)
+# and every TXEN/RXEN starts the packet as soon as the radio is ready (READY_START), so the
+# software never has to spin through DISABLE/STATE/READY between packets.
+
+def radioDisable():
+    # abort whatever the radio is doing, e.g. listening for a packet that never came
+    machine.mem32[_NRF_RADIO___SHORTS] = 0
+    machine.mem32[_NRF_RADIO___TASKS_DISABLE] = 1  # DISABLE the radio to establish a known state.
+    while (machine.mem32[_NRF_RADIO___STATE] != 0):  # wait until radio is DISABLED (i.e. STATE=0);
+        True
+
+def radioListen(rxAddress):
+    # From DISABLED: receive one packet into the buffer at rxAddress.  radioReceived() tells
+    # once it has arrived.
+    machine.mem32[_NRF_RADIO___PACKETPTR] = rxAddress
+    machine.mem32[_NRF_RADIO___EVENTS_CRCOK] = 0
+    machine.mem32[_NRF_RADIO___EVENTS_DISABLED] = 0
+    machine.mem32[_NRF_RADIO___SHORTS] = _SHORTS_READY_START | _SHORTS_END_DISABLE
+    machine.mem32[_NRF_RADIO___TASKS_RXEN] = 1
+
+def radioReceived():
+    # After radioListen() or radioTransmit() with an rxAddress: 0 while nothing has arrived,
+    # then 1 for a good frame or -1 for a corrupted one.  The radio is DISABLED once it is
+    # not 0.
+    if (machine.mem32[_NRF_RADIO___EVENTS_DISABLED] == 0):
+        return 0
+    if (machine.mem32[_NRF_RADIO___EVENTS_CRCOK] == 0):
+        return -1
+    return 1
+
+def radioWaitReady(startTime):
+    # Waits for READY, up to _EVENT_TIMEOUT_US after startTime.  If it never comes the radio is
+    # DISABLED, so radioReceived() reports a corrupted frame and the caller carries on as if
+    # the frame had been lost.  Returns whether READY came.
+    while (machine.mem32[_NRF_RADIO___EVENTS_READY] == 0):
+        if (utime.ticks_diff(utime.ticks_us(), startTime) > _EVENT_TIMEOUT_US):
+            radioDisable()
+            return False
+    return True
+
+def radioTransmit(txAddress, rxAddress):
+    # From DISABLED: transmit the frame at txAddress.  If rxAddress is not 0 the radio turns
+    # around in hardware (END -> DISABLE -> RXEN -> START) and this returns once it is
+    # listening for the reply, which will land in the buffer at rxAddress.  Otherwise it
+    # returns at once, see radioSend().
+    machine.mem32[_NRF_RADIO___PACKETPTR] = txAddress
+    machine.mem32[_NRF_RADIO___EVENTS_READY] = 0
+    machine.mem32[_NRF_RADIO___EVENTS_CRCOK] = 0
+    machine.mem32[_NRF_RADIO___EVENTS_DISABLED] = 0
+    if (rxAddress == 0):
+        machine.mem32[_NRF_RADIO___SHORTS] = _SHORTS_READY_START | _SHORTS_END_DISABLE
+        machine.mem32[_NRF_RADIO___TASKS_TXEN] = 1
+        return
+    machine.mem32[_NRF_RADIO___SHORTS] = _SHORTS_READY_START | _SHORTS_END_DISABLE | _SHORTS_DISABLED_RXEN
+    startTime = utime.ticks_us()
+    machine.mem32[_NRF_RADIO___TASKS_TXEN] = 1
+    if (not radioWaitReady(startTime)):  # TX has started
+        return
+    machine.mem32[_NRF_RADIO___EVENTS_READY] = 0
+    # PACKETPTR is read again when START fires, so the reply goes to its own buffer
+    machine.mem32[_NRF_RADIO___PACKETPTR] = rxAddress
+    if (not radioWaitReady(startTime)):  # RX has started
+        return
+    # stop after the reply so it cannot be overwritten, and wait for it afresh
+    machine.mem32[_NRF_RADIO___SHORTS] = _SHORTS_READY_START | _SHORTS_END_DISABLE
+    machine.mem32[_NRF_RADIO___EVENTS_DISABLED] = 0
+
+def radioSend(txAddress):
+    # From DISABLED: transmit the frame at txAddress and return once it has gone.
+    startTime = utime.ticks_us()
+    radioTransmit(txAddress, 0)
+    while (machine.mem32[_NRF_RADIO___EVENTS_DISABLED] == 0):  # busy-wait until packet is sent
+        if (utime.ticks_diff(utime.ticks_us(), startTime) > _EVENT_TIMEOUT_US):
+            radioDisable()
+            return
+
+def radioReceive(rxAddress, timeoutUs):
+    # From DISABLED: listens for a frame into the buffer at rxAddress for up to timeoutUs
+    # microseconds.  Returns True once a good one is there, or False if none arrived, with
+    # the radio DISABLED either way.  Corrupted frames are skipped.
+    startTime = utime.ticks_us()
+    radioListen(rxAddress)
+    while (utime.ticks_diff(utime.ticks_us(), startTime) < timeoutUs):
+        if (machine.mem32[_NRF_RADIO___EVENTS_DISABLED] != 0):
+            if (machine.mem32[_NRF_RADIO___EVENTS_CRCOK] != 0):
+                return True
+            radioListen(rxAddress)
+    radioDisable()
+    return False
+
+def radioNoise(frequency, samples):
+    # The radio must be DISABLED.  Listens on frequency for a moment and returns the
+    # strongest of samples RSSI samples in -dBm, so the larger the quieter.  FREQUENCY is
+    # left there.
+    machine.mem32[_NRF_RADIO___FREQUENCY] = frequency
+    machine.mem32[_NRF_RADIO___PACKETPTR] = radioBuffer_address
+    machine.mem32[_NRF_RADIO___EVENTS_READY] = 0
+    machine.mem32[_NRF_RADIO___SHORTS] = _SHORTS_READY_START
+    machine.mem32[_NRF_RADIO___TASKS_RXEN] = 1
+    if (not radioWaitReady(utime.ticks_us())):
+        return 0  # nothing measured, so call it loud and leave it alone
+    loudest = 127
+    i = 0
+    while (i < samples):
+        machine.mem32[_NRF_RADIO___EVENTS_RSSIEND] = 0
+        machine.mem32[_NRF_RADIO___TASKS_RSSISTART] = 1
+        startTime = utime.ticks_us()
+        while (machine.mem32[_NRF_RADIO___EVENTS_RSSIEND] == 0):
+            if (utime.ticks_diff(utime.ticks_us(), startTime) > _EVENT_TIMEOUT_US):
+                radioDisable()
+                return 0  # the sample never came, so call it loud as above
+        sample = machine.mem32[_NRF_RADIO___RSSISAMPLE] & 0x7F
+        if (sample < loudest):
+            loudest = sample
+        utime.sleep_us(50)  # spread the samples over a few Wi-Fi or BLE packets
+        i = i + 1
+    radioDisable()
+    return loudest
@@ -13,157 +13,765 @@
 # Any concrete suggestions on how to improve the code are always appreciated.
 
 from micropython import const  # needed to efficiently access memory by avoiding micropython lookups
-import machine  # so can peek and poke different registers on the nRF5x
-import uctypes # needed to create the radio buffer (a byte array)
+import micropython  # for the viper code emitter
+import machine  # for machine.reset()
+import uctypes # needed to create the receive buffers
 import utime # needed to create delays
 import gc #import garbage collector
 import uhashlib # needed for SHA-256
 import ubinascii # needed to convert the SHA-256 result into a string
-
-radioBuffer_size = 256
-radioBuffer = bytearray(radioBuffer_size)  # allocate IO buffer for use by nRF5x radio
-radioBuffer_address = uctypes.addressof(radioBuffer)
+import uos # needed for file sizes
+from nrfRadio import (radioBuffer, radioBuffer_size, radioBuffer_address, radioConfigure, radioSetMode,
+                      radioSetFrequency, radioSendTo, radioMatch, deviceId, radioDisable, radioListen,
+                      radioReceived, radioTransmit, radioSend, radioNoise)  # the radio driver, see nrfRadio.py
 
 _my_prefixAddress = const(0xAA)
 _my_baseAddress = const(0xDEADBEEF)
 _target_prefixAddress = const(0xAA) # prefix address of the other node
 _target_baseAddress = const(0xFEEDBEEF) # base address of the other node
-
-_NRF_POWER = const(0x40000000)
-_DCDCEN = const(0x578)
-_NRF_POWER___DCDCEN = const(_NRF_POWER + _DCDCEN)
-
-_NRF_CLOCK = const(0x40000000)
-_TASKS_HFCLKSTART = const(0)
-_EVENTS_HFCLKSTARTED = const(0x100)
-_NRF_CLOCK___TASKS_HFCLKSTART = const(_NRF_CLOCK + _TASKS_HFCLKSTART)
-_NRF_CLOCK___EVENTS_HFCLKSTARTED = const(_NRF_CLOCK + _EVENTS_HFCLKSTARTED)
-
-_NRF_RADIO = const(0x40001000)
-_BASE0 = const(0x51C)
-_PREFIX0 = const(0x524)
-_FREQUENCY = const(0x508)
-_PCNF1 = const(0x518)
-_PCNF0 = const(0x514)
-_MODE = const(0x510)
-_MODECNF0 = const(0x650)
-_CRCCNF = const(0x534)
-_PACKETPTR = const(0x504)
-_RXADDRESSES = const(0x530)
-_TXPOWER = const(0x50C)
-_TASKS_DISABLE = const(0x010)
-_STATE = const(0x550)
-_TASKS_TXEN = const(0)
-_TASKS_RXEN = const(0x004)
-_EVENTS_READY = const(0x100)
-_TASKS_START = const(0x008)
-_EVENTS_END = const(0x10C)
-_EVENTS_CRCOK = const(0x130)
-_NRF_RADIO___BASE0 = const(_NRF_RADIO + _BASE0)
-_NRF_RADIO___PREFIX0 = const(_NRF_RADIO + _PREFIX0)
-_NRF_RADIO___FREQUENCY = const(_NRF_RADIO + _FREQUENCY)
-_NRF_RADIO___PCNF1 = const(_NRF_RADIO + _PCNF1)
-_NRF_RADIO___PCNF0 = const(_NRF_RADIO + _PCNF0)
-_NRF_RADIO___MODE = const(_NRF_RADIO + _MODE)
-_NRF_RADIO___MODECNF0 = const(_NRF_RADIO + _MODECNF0)
-_NRF_RADIO___CRCCNF = const(_NRF_RADIO + _CRCCNF)
-_NRF_RADIO___PACKETPTR = const(_NRF_RADIO + _PACKETPTR)
-_NRF_RADIO___RXADDRESSES = const(_NRF_RADIO + _RXADDRESSES)
-_NRF_RADIO___TXPOWER = const(_NRF_RADIO + _TXPOWER)
-_NRF_RADIO___TASKS_DISABLE = const(_NRF_RADIO + _TASKS_DISABLE)
-_NRF_RADIO___STATE = const(_NRF_RADIO + _STATE)
-_NRF_RADIO___TASKS_TXEN = const(_NRF_RADIO + _TASKS_TXEN)
-_NRF_RADIO___TASKS_RXEN = const(_NRF_RADIO + _TASKS_RXEN)
-_NRF_RADIO___EVENTS_READY = const(_NRF_RADIO + _EVENTS_READY)
-_NRF_RADIO___TASKS_START = const(_NRF_RADIO + _TASKS_START)
-_NRF_RADIO___EVENTS_END = const(_NRF_RADIO + _EVENTS_END)
-_NRF_RADIO___EVENTS_CRCOK = const(_NRF_RADIO + _EVENTS_CRCOK)
+# prefix of the transmitter's group address, which it broadcasts to; the group address is this
+# prefix followed by the transmitter's base address
+_group_prefixAddress = const(0xA5)
 
 def initializeSerialOutput():
     print("Starting...")
 
-def initializeHardware():  # enable the DCDC voltage regulator
-    machine.mem32[_NRF_POWER___DCDCEN] = 1  # NRF_POWER->DCDCEN=1;   
-    
-def initializeClocks():    
-    machine.mem32[_NRF_CLOCK___TASKS_HFCLKSTART] = 1 # activate the high frequency crystal oscillator
-    # wait until high frequency clock is confirmed to be started:
-    while (machine.mem32[_NRF_CLOCK___EVENTS_HFCLKSTARTED] == 0):
-        True
-        
-def initializeRxMode():        
-    machine.mem32[_NRF_RADIO___BASE0] = _my_baseAddress
-    machine.mem32[_NRF_RADIO___PREFIX0] = _my_prefixAddress
+def initializeRadio():
+    # also listens on the transmitter's group address, for broadcasts
+    radioConfigure(_my_baseAddress, _my_prefixAddress, _target_baseAddress, _target_prefixAddress,
+                   _group_prefixAddress)
+    resetLink()  # FREQUENCY, MODE and TXPOWER, see setLink()
 
-    machine.mem32[_NRF_RADIO___TASKS_DISABLE] = 1  # DISABLE the radio to establish a known state.
-    while (machine.mem32[_NRF_RADIO___STATE] != 0):  # wait until radio is DISABLED (i.e. STATE=0);
-        True
-    machine.mem32[_NRF_RADIO___TASKS_RXEN] = 1  # turn on the radio transmitter and shift into RXIDLE.
-    while (machine.mem32[_NRF_RADIO___EVENTS_READY] == 0):  # Busy-wait.  After event READY, radio shall be in state TXIDLE.
-        True    
-    # ASSERTION: now ready to receive a packet.
+# Every radio packet is a compact binary frame laid out in radioBuffer as:
+#   byte  0     LENGTH (number of bytes that follow; read by the radio hardware)
+#   byte  1     frame type
+#   bytes 2..3  sequence number (16 bit, little endian)
+#   bytes 4..   payload (up to 252 bytes, so the whole 255 byte radio payload is used)
+_FRAME_LENGTH = const(0)
+_FRAME_TYPE = const(1)
+_FRAME_SEQ = const(2)
+_FRAME_PAYLOAD = const(4)
+_FRAME_HEADER_SIZE = const(3)  # type and sequence number bytes counted by LENGTH
+_MAX_PAYLOAD = const(252)
+
+_FILE_CHUNK_SIZE = const(512)  # bytes read at a time when hashing or copying files
+
+# flags byte sent after the digest in the END frame
+_IMAGE_MPY = const(0x01)  # the file is precompiled .mpy bytecode rather than Python source
+_IMAGE_COMPRESSED = const(0x02)  # the file was sent zlib compressed, see inflateFile()
+_IMAGE_DELTA = const(0x04)  # the file is a delta against the current main.py, see applyDelta()
+_IMAGE_BUNDLE = const(0x08)  # the file is a bundle of several files, see unpackBundle()
+
+# History window used to inflate a compressed update, 2**_DEFLATE_WBITS bytes.  This is all
+# the RAM inflating needs, however large the file.  Must match the transmitter.
+_DEFLATE_WBITS = const(10)
+
+mpyModuleName = "ota_app"  # a .mpy image is installed as this module, see installImage()
+
+# A/B install.  The image is received into a file of its own (the inactive slot) and put in
+# place with renames, so installing takes the same time whatever its size, and each file it
+# replaces is kept as <name>.bak.  _INSTALL_RECORD holds the state of the last install on its
+# first line and the files it replaced on the lines after.  The state counts the boots of the
+# new image until it confirms it started properly, see confirmImage(), and is then "ok".
+# boot.py rolls back an image that keeps booting without confirming; rollback() does it on
+# demand.
+_INSTALL_RECORD = "ota_install.txt"
+
+# Delta updates.  main.py is split into blocks (see fileBlocks()) and its signature, a
+# truncated SHA-256 and the length of each block, is sent to the transmitter on request.  The
+# transmitter then sends a delta made of these instructions:
+#   _DELTA_COPY  offset (4 bytes) and length (2 bytes) of bytes to copy from the current main.py
+#   _DELTA_DATA  length (2 bytes) followed by that many new bytes
+_DELTA_MIN_BLOCK = const(128)
+_DELTA_MAX_BLOCK = const(1024)
+_DELTA_HASH_SIZE = const(4)
+_SIGNATURE_ENTRY_SIZE = const(6)  # block hash and 2 byte length
+_SIGNATURE_ENTRIES_PER_FRAME = const(42)  # _MAX_PAYLOAD // _SIGNATURE_ENTRY_SIZE
+_DELTA_COPY = const(1)
+_DELTA_DATA = const(2)
+
+_FRAME_DATA = const(0)  # payload is the next chunk of the file
+_FRAME_END = const(1)  # payload is the 32 byte SHA-256 digest of the whole file and a flags byte
+_FRAME_ACK = const(2)  # sent by the receiver, see copyAckToRadioBuffer()
+_FRAME_SIGNATURE_REQUEST = const(3)  # asks for the signature entries from the one numbered seq
+_FRAME_SIGNATURE = const(4)  # sent by the receiver, see copySignatureToRadioBuffer()
+_FRAME_POLL = const(5)  # broadcast only: seq is the END frame's, payload the number of NACK slots
+_FRAME_NACK = const(6)  # broadcast only, see copyNackToRadioBuffer()
+_FRAME_PARITY = const(7)  # XOR of a group of full DATA frames; seq is the group's first, see fecAdd()
+_FRAME_RESUME = const(8)  # payload is the size (4 bytes), flags and SHA-256 (32 bytes) of the update
+_FRAME_RESUME_POINT = const(9)  # sent by the receiver, see sendResumePoint()
+_FRAME_START = const(10)  # the transfer starts at frame seq; answered with an ACK
+_FRAME_HELLO = const(11)  # asks what this node runs and can take; payload is the image flags
+_FRAME_CAPABILITIES = const(12)  # sent by the receiver, see sendCapabilities()
+_FRAME_SET_LINK = const(13)  # move to the link level in the payload, see changeLink()
+_FRAME_FILE_QUERY = const(14)  # payload is the size (4 bytes), SHA-256 and name of a file, see hasFile()
+_FRAME_FILE_STATE = const(15)  # sent by the receiver, see sendFileState()
+_FRAME_TYPE_MASK = const(0x7F)
+_FLAG_ACK_REQUEST = const(0x80)  # set by the transmitter on the last frame of a burst
+
+# Selective-repeat window: frames that arrive ahead of a missing one are held until the gap
+# is filled.  The transmitter's window must not be larger than this (at most 32).
+_WINDOW_SIZE = const(8)
+
+# Broadcasts arrive on the group address (logical address _GROUP_ADDRESS).  The file goes
+# out once and then in repair rounds, so each frame is written at its own offset as it
+# arrives and a bit is kept for every frame received.  After each round the transmitter
+# sends a POLL, and a receiver still missing frames answers with a NACK in one of the slots
+# that follow it.  The slot changes every round so two receivers do not keep colliding.
+_GROUP_ADDRESS = const(2)
+_TARGET_ADDRESS = const(1)  # the transmitter's own address, where unicast replies go
+_GROUP_MAX_FRAMES = const(4096)
+_NACK_SLOT_US = const(3000)  # must match the transmitter
+_NACK_GUARD_US = const(1000)
+
+# Forward error correction.  The transmitter may follow each group of _FEC_GROUP full DATA
+# frames (starting at a multiple of _FEC_GROUP) with a PARITY frame, the XOR of their payloads.
+# If the parity and all but one of the group's frames arrive, the missing one is rebuilt here
+# instead of waiting for it to be sent again.  The running XOR of each group in flight is kept
+# in fecXor; at most _FEC_GROUPS groups fit in the window at once.
+_FEC_GROUP = const(4)  # must match the transmitter
+_FEC_GROUPS = const(3)  # _WINDOW_SIZE // _FEC_GROUP + 1
+
+# Block checks.  While a unicast update is written, a check (see checksumPayload()) is kept
+# of each _CHECK_BLOCK frames, and every ACK reports the last block written in full and its
+# check.  The transmitter compares that with its own, so a block that was put together
+# wrongly stops the update there instead of at the SHA-256 check after the whole file.
+_CHECK_BLOCK = const(16)  # must match the transmitter
+
+# Resuming.  While a unicast update is written, _CHECKPOINT_FILE holds the size, flags and
+# SHA-256 of the update (from the RESUME frame) followed by the check of every block written,
+# and both files are flushed to flash every _CHECKPOINT_BLOCKS blocks, the update first.  If
+# the transfer is cut short, the next one of the same update is told how many whole blocks
+# are already here, checks them against its own copy and carries on after them.  A RESUME
+# frame that arrives while a transfer is still open means the transmitter started again, so
+# that transfer is closed first.
+_CHECKPOINT_FILE = "update.chk"
+_CHECKPOINT_BLOCKS = const(4)
+_CHECKPOINT_HEADER = const(37)
+
+# What this receiver tells the transmitter it can take, in the CAPABILITIES frame.
+_CAN_INFLATE = const(0x01)
+_CAN_DELTA = const(0x02)
+_CAN_SET_LINK = const(0x04)
+_CAN_BUNDLE = const(0x08)
+_NO_IMAGE = const(0xFFFFFFFF)  # size reported when nothing is installed
+
+# Link settings, see the transmitter.  A setting packs a level (a radio MODE and TXPOWER) in
+# bits 0-2, the channel in use in bits 3-4 and a backup channel in bits 5-6, the last two as
+# indexes into _CHANNELS.  The transmitter picks the setting and the receiver follows, see
+# changeLink().  While nothing is heard the receiver undoes the last move after
+# _LINK_PROBATION_MS, moves to the backup channel after _LINK_LOST_MS and goes back to
+# _LINK_DEFAULT, where every transfer starts, after _LINK_IDLE_MS; see linkSilence().
+_LINK_MODES = (1, 1, 0, 6, 5)  # Nrf_2Mbit, Nrf_2Mbit, Nrf_1Mbit, Ble_LR500Kbit, Ble_LR125Kbit
+_LINK_POWERS = (0, 8, 8, 8, 8)  # dBm
+_LINK_LEVELS = const(5)
+_LINK_LEVEL_MASK = const(0x07)
+_LINK_DEFAULT = const(1)  # level 1 on channel 0, with no other channel to go to
+_LINK_PROBATION_MS = const(500)
+_LINK_LOST_MS = const(1000)
+_LINK_IDLE_MS = const(2500)  # shorter than the transmitter keeps asking before it gives up
+# FREQUENCY values (MHz above 2400) of the channels.  98 is above the Wi-Fi channels; the
+# others sit in the gaps around Wi-Fi channels 1, 6 and 11 and at the top of the band.
+_CHANNELS = (98, 80, 50, 25)
+_CHANNEL_COUNT = const(4)
+_SCAN_SAMPLES = const(16)  # RSSI samples per channel, see radioNoise()
+linkSetting = _LINK_DEFAULT
+linkFallback = _LINK_DEFAULT  # the setting before the last move
+
+# After the END frame keep answering for this long after the last packet, in case the
+# final ACK was lost and the transmitter polls again.
+_LINGER_MS = const(250)
+
+# With serve(), the receive loop lets the application run between polls of the radio, and
+# once nothing has been heard for _LINK_IDLE_MS it polls only this often.  Well under the
+# transmitter's first reply timeout, so a HELLO is answered at the first or second try.
+_IDLE_POLL_MS = const(10)
+# A transfer that has started but hears nothing for _SESSION_IDLE_MS is given up, long after
+# the transmitter has stopped asking.  What is on flash is kept for the next transfer to
+# carry on from, and receiveUpdate() comes to an end, so serve() waits afresh.
+_SESSION_IDLE_MS = const(5000)
+
+# Frames are received straight into a pool of buffers.  As soon as a frame arrives the radio
+# is pointed at a free buffer and restarted, so frames sent back to back are not missed while
+# the previous one is processed.  A frame that arrived out of order keeps its buffer until
+# it can be written to the file.  Everything the receive loop touches is allocated here, up
+# front, so receiving a frame does not allocate on the heap and never triggers a GC pause.
+rxBuffers = []
+rxAddresses = []
+rxPayloads = []
+for i in range(_WINDOW_SIZE + 1):
+    rxBuffers.append(bytearray(radioBuffer_size))
+    rxAddresses.append(uctypes.addressof(rxBuffers[i]))
+    rxPayloads.append(memoryview(rxBuffers[i])[_FRAME_PAYLOAD:])
+freeBuffers = list(range(_WINDOW_SIZE + 1))  # stack of buffer indexes; never grows past this
+heldBuffers = [-1] * _WINDOW_SIZE  # index of the buffer holding frame seq, at seq % _WINDOW_SIZE
+
+groupFrames = bytearray(_GROUP_MAX_FRAMES // 8)  # bit set for each broadcast frame received
+nackSeed = 1  # picks the NACK slot, see sendNack()
+
+fecXor = []
+for i in range(_FEC_GROUPS):
+    fecXor.append(bytearray(_MAX_PAYLOAD))
+fecGroups = [-1] * _FEC_GROUPS  # group number whose running XOR is in fecXor[i]
+fecSeen = bytearray(_FEC_GROUPS)  # bit j: frame j of the group is in; bit _FEC_GROUP: its parity
+
+blockCheck = bytearray(4)  # check of the block being written
+ackBlockCheck = bytearray(6)  # number (0xFFFF for none yet) and check of the last block written
+
+# The frames of a unicast update are gathered into pages and written to flash a page at a
+# time, rather than a frame at a time.  There are two pages: once one is full it waits to be
+# written until the radio has nothing for the receive loop, and the frames go on into the
+# other meanwhile.  A page holds one checked block (see _CHECK_BLOCK), so the checkpoint is
+# saved as its page is written.  Broadcast frames arrive in any order and are written
+# straight away.
+_PAGE_SIZE = const(4032)  # _CHECK_BLOCK * _MAX_PAYLOAD
+pages = (bytearray(_PAGE_SIZE), bytearray(_PAGE_SIZE))
+pageFill = [0, 0]  # bytes gathered in each page
+pageBlocks = [0, 0]  # block number of each full page
+pageChecks = bytearray(8)  # check of the block in each full page
+pageCheckViews = (memoryview(pageChecks)[0:4], memoryview(pageChecks)[4:8])
+fillingPage = 0
+pendingPage = -1  # the full page waiting to be written, if any
+
+signature = bytearray()  # signature of main.py for delta updates, see computeSignature()
+signatureView = memoryview(signature)
+
+# Telemetry for the last transfer, see stats().  The counters are kept in a list allocated
+# here and indexed by the constants below, so counting in the receive loop does not allocate.
+_STAT_PACKETS = const(0)  # frames received with a good CRC
+_STAT_CRC_FAILURES = const(1)
+_STAT_DUPLICATES = const(2)  # frames received before, or too far ahead of the window
+_STAT_REBUILT = const(3)  # frames rebuilt from parity
+_STAT_REPLIES = const(4)  # ACK, NACK and SIGNATURE frames sent
+_STAT_BYTES_WRITTEN = const(5)
+_STAT_RECEIVE_MS = const(6)  # from the first frame to the last
+_STAT_CHECK_MS = const(7)  # undoing the transfer encodings and checking the hash
+_STAT_COUNT = const(8)
+statNames = ("packets", "crcFailures", "duplicates", "rebuilt", "repliesSent", "bytesWritten",
+             "receiveMs", "checkMs")
+statCounters = [0] * _STAT_COUNT
+
+# How much is printed during a transfer: 0 only results and errors, 1 also the stats at the
+# end, 2 also a line per ACK or NACK.  At 115200 baud a line takes longer to print than a
+# whole burst takes to arrive, so that is off unless asked for.
+_LOG_SUMMARY = const(1)
+_LOG_PACKETS = const(2)
+logLevel = _LOG_SUMMARY
+
+def resetWindow():
+    while (freeBuffers):
+        freeBuffers.pop()
+    i = 0
+    while (i <= _WINDOW_SIZE):
+        freeBuffers.append(i)
+        i = i + 1
+    i = 0
+    while (i < _WINDOW_SIZE):
+        heldBuffers[i] = -1
+        i = i + 1
+
+@micropython.viper
+def copyPayload(destination: ptr8, source: ptr8, length: int):
+    i = 0
+    while (i < length):
+        destination[i] = source[i]
+        i = i + 1
+
+@micropython.viper
+def copyPayloadTo(destination: ptr8, offset: int, source: ptr8, length: int):
+    i = 0
+    while (i < length):
+        destination[offset + i] = source[i]
+        i = i + 1
+
+@micropython.viper
+def xorPayload(destination: ptr8, source: ptr8, length: int):
+    i = 0
+    while (i < length):
+        destination[i] = destination[i] ^ source[i]
+        i = i + 1
+
+def resetStats():
+    i = 0
+    while (i < _STAT_COUNT):
+        statCounters[i] = 0
+        i = i + 1
+
+def stats():
+    # the counters of the last transfer by name
+    result = {}
+    i = 0
+    while (i < _STAT_COUNT):
+        result[statNames[i]] = statCounters[i]
+        i = i + 1
+    return result
+
+def printStats():
+    i = 0
+    while (i < _STAT_COUNT):
+        print(statNames[i], " = ", statCounters[i])
+        i = i + 1
+
+@micropython.viper
+def checksumPayload(check: ptr8, payload: ptr8, length: int):
+    # Adds length bytes of payload to check, a Fletcher checksum: two 16 bit sums, of the
+    # bytes and of the running first sum, kept little endian in its 4 bytes
+    a = check[0] | (check[1] << 8)
+    b = check[2] | (check[3] << 8)
+    i = 0
+    while (i < length):
+        a = (a + payload[i]) & 0xFFFF
+        b = (b + a) & 0xFFFF
+        i = i + 1
+    check[0] = a & 0xFF
+    check[1] = a >> 8
+    check[2] = b & 0xFF
+    check[3] = b >> 8
+
+def resetBlockCheck():
+    i = 0
+    while (i < 4):
+        blockCheck[i] = 0
+        i = i + 1
+    ackBlockCheck[0] = 0xFF
+    ackBlockCheck[1] = 0xFF
+
+def addToBlockCheck(seq, bufferIndex):
+    # Called for each DATA frame of a unicast update as it is written, in order.  Returns
+    # True once it completes a block.
+    checksumPayload(blockCheck, rxPayloads[bufferIndex], framePayloadLength(rxBuffers[bufferIndex]))
+    if (seq % _CHECK_BLOCK != _CHECK_BLOCK - 1):
+        return False
+    block = seq // _CHECK_BLOCK
+    ackBlockCheck[0] = block & 0xFF
+    ackBlockCheck[1] = (block >> 8) & 0xFF
+    i = 0
+    while (i < 4):
+        ackBlockCheck[2 + i] = blockCheck[i]
+        blockCheck[i] = 0
+        i = i + 1
+    return True
+
+def saveCheckpoint(f, checkpoint, check, block):
+    checkpoint.write(check)
+    if (block % _CHECKPOINT_BLOCKS == _CHECKPOINT_BLOCKS - 1):
+        f.flush()  # so the checkpoint never covers more than is on flash
+        checkpoint.flush()
+
+def readCheckpoint(size, flags, digest):
+    # Returns the checks of the blocks of this update that update.txt already holds in full,
+    # from the checkpoint of an earlier transfer, or b"" if there are none.
+    try:
+        c=open(_CHECKPOINT_FILE,"rb")
+        header = c.read(_CHECKPOINT_HEADER)
+        checks = c.read()
+        c.close()
+        held = uos.stat("update.txt")[6] // (_CHECK_BLOCK * _MAX_PAYLOAD)
+    except OSError:
+        return b""
+    if ((len(header) < _CHECKPOINT_HEADER) or (header[4] != flags) or (header[5:37] != digest) or
+            ((header[0] | (header[1] << 8) | (header[2] << 16) | (header[3] << 24)) != size)):
+        return b""  # a different update
+    blocks = len(checks) // 4
+    if (blocks > held):
+        blocks = held
+    return checks[0 : blocks * 4]
+
+def newCheckpoint(size, flags, digest):
+    checkpoint = open(_CHECKPOINT_FILE,"wb")
+    checkpoint.write(bytes((size & 0xFF, (size >> 8) & 0xFF, (size >> 16) & 0xFF, (size >> 24) & 0xFF, flags)))
+    checkpoint.write(digest)
+    return checkpoint
+
+def resumeBlockCheck(checks):
+    # the last block already held is the one reported in ACKs until the next is written
+    block = len(checks) // 4 - 1
+    ackBlockCheck[0] = block & 0xFF
+    ackBlockCheck[1] = (block >> 8) & 0xFF
+    i = 0
+    while (i < 4):
+        ackBlockCheck[2 + i] = checks[block * 4 + i]
+        i = i + 1
+
+def resetFec():
+    i = 0
+    while (i < _FEC_GROUPS):
+        fecGroups[i] = -1
+        fecSeen[i] = 0
+        i = i + 1
+
+def fecAdd(seq, bufferIndex, parity):
+    # Adds a full DATA frame that has just arrived for the first time, or a PARITY frame, to
+    # its group's running XOR.  Once the parity and all but one of the group's frames are in,
+    # the running XOR is the missing frame: returns its sequence number, otherwise -1.
+    group = seq // _FEC_GROUP
+    i = group % _FEC_GROUPS
+    if (fecGroups[i] != group):
+        if (fecGroups[i] > group):
+            return -1  # an old group, long since dealt with
+        fecGroups[i] = group
+        fecSeen[i] = 0
+    if (parity):
+        bit = 1 << _FEC_GROUP
+    else:
+        bit = 1 << (seq % _FEC_GROUP)
+    if (fecSeen[i] & bit):
+        return -1
+    if (fecSeen[i] == 0):
+        copyPayload(fecXor[i], rxPayloads[bufferIndex], _MAX_PAYLOAD)
+    else:
+        xorPayload(fecXor[i], rxPayloads[bufferIndex], _MAX_PAYLOAD)
+    fecSeen[i] = fecSeen[i] | bit
+    missing = (~fecSeen[i]) & ((1 << _FEC_GROUP) - 1)
+    if ((fecSeen[i] & (1 << _FEC_GROUP)) and (missing != 0) and ((missing & (missing - 1)) == 0)):
+        fecSeen[i] = (2 << _FEC_GROUP) - 1  # nothing more to do for this group
+        j = 0
+        while (not (missing & (1 << j))):
+            j = j + 1
+        return group * _FEC_GROUP + j
+    return -1
+
+def rebuildFrame(seq, bufferIndex):
+    # puts the frame fecAdd() rebuilt into the buffer, as if it had been received
+    copyPayload(rxPayloads[bufferIndex], fecXor[(seq // _FEC_GROUP) % _FEC_GROUPS], _MAX_PAYLOAD)
+    buffer = rxBuffers[bufferIndex]
+    buffer[_FRAME_LENGTH] = _FRAME_HEADER_SIZE + _MAX_PAYLOAD
+    buffer[_FRAME_TYPE] = _FRAME_DATA
+    buffer[_FRAME_SEQ] = seq & 0xFF
+    buffer[_FRAME_SEQ + 1] = (seq >> 8) & 0xFF
+
+def resetGroup():
+    global nackSeed
+    i = 0
+    while (i < len(groupFrames)):
+        groupFrames[i] = 0
+        i = i + 1
+    # seeded from this chip's unique id, so receivers pick different slots
+    nackSeed = deviceId() + 1
+
+def frameSeq(buffer):
+    return buffer[_FRAME_SEQ] | (buffer[_FRAME_SEQ + 1] << 8)
+
+def framePayloadLength(buffer):
+    payloadLength = buffer[_FRAME_LENGTH] - _FRAME_HEADER_SIZE
+    if (payloadLength < 0):  # too short to be a frame
+        return 0
+    return payloadLength
+
+def writePayload(f, bufferIndex):
+    # Write straight from the receive buffer.  A full frame uses the preallocated memoryview
+    # as it is; only the short last frame of a file needs a slice.
+    payloadLength = framePayloadLength(rxBuffers[bufferIndex])
+    if (payloadLength == _MAX_PAYLOAD):
+        chunk = rxPayloads[bufferIndex]
+    else:
+        chunk = rxPayloads[bufferIndex][0:payloadLength]
+    f.write(chunk)
+    statCounters[_STAT_BYTES_WRITTEN] = statCounters[_STAT_BYTES_WRITTEN] + payloadLength
+
+def resetPages():
+    global fillingPage, pendingPage
+    pageFill[0] = 0
+    pageFill[1] = 0
+    fillingPage = 0
+    pendingPage = -1
+
+def bufferPayload(bufferIndex):
+    # Like writePayload(), for the frames of a unicast update, which come in order: gathers
+    # the payload into the page being filled.
+    payloadLength = framePayloadLength(rxBuffers[bufferIndex])
+    copyPayloadTo(pages[fillingPage], pageFill[fillingPage], rxPayloads[bufferIndex], payloadLength)
+    pageFill[fillingPage] = pageFill[fillingPage] + payloadLength
+
+def finishPage(f, checkpoint, block, theHash):
+    # Called once the page being filled holds the whole of block, whose check is the last
+    # one taken (see addToBlockCheck()).  The page waits to be written, see writePage(), and
+    # the next block goes into the other page, written out first if it is still waiting.
+    global fillingPage, pendingPage
+    i = 0
+    while (i < 4):
+        pageChecks[fillingPage * 4 + i] = ackBlockCheck[2 + i]
+        i = i + 1
+    pageBlocks[fillingPage] = block
+    if (pendingPage >= 0):
+        writePage(f, checkpoint, theHash)
+    pendingPage = fillingPage
+    fillingPage = 1 - fillingPage
+
+def writePage(f, checkpoint, theHash):
+    # Writes out the page waiting to be written, or if there is none what has been gathered
+    # in the page being filled (the end of the file), and adds it to theHash.
+    global pendingPage
+    page = pendingPage
+    if (page < 0):
+        page = fillingPage
+    fill = pageFill[page]
+    if (fill == _PAGE_SIZE):
+        chunk = pages[page]
+    else:
+        chunk = memoryview(pages[page])[0:fill]  # only the last page of a file is short
+    f.write(chunk)
+    theHash.update(chunk)
+    statCounters[_STAT_BYTES_WRITTEN] = statCounters[_STAT_BYTES_WRITTEN] + fill
+    if (page == pendingPage):
+        saveCheckpoint(f, checkpoint, pageCheckViews[page], pageBlocks[page])
+        pendingPage = -1
+    pageFill[page] = 0
+
+def closeTransfer(f, checkpoint, theHash):
+    # Closes a transfer that was cut short, keeping what is on flash for the next one to
+    # carry on from: the full page waiting to be written goes out first, so the checkpoint
+    # covers it too.  checkpoint is None for a broadcast.  Frees the window for a new transfer.
+    if ((checkpoint is not None) and (pendingPage >= 0)):
+        writePage(f, checkpoint, theHash)
+    f.close()
+    if (checkpoint is not None):
+        checkpoint.close()
+    i = 0
+    while (i < _WINDOW_SIZE):
+        if (heldBuffers[i] >= 0):
+            freeBuffers.append(heldBuffers[i])
+            heldBuffers[i] = -1
+        i = i + 1
+    resetGroup()
+    resetFec()
+    resetBlockCheck()
+    resetPages()
+
+def copyAckToRadioBuffer(expectedSeq):
+    # The ACK carries the next sequence number expected (every earlier frame has arrived)
+    # and a bitmap of the frames after it that are already held, so the transmitter
+    # only resends the gaps.  The bitmap is followed by ackBlockCheck.
+    bitmap = 0
+    i = 1
+    while (i < _WINDOW_SIZE):
+        if (heldBuffers[(expectedSeq + i) % _WINDOW_SIZE] >= 0):
+            bitmap = bitmap | (1 << (i - 1))
+        i = i + 1
+    i = 0
+    while (i < 6):
+        radioBuffer[_FRAME_PAYLOAD + 4 + i] = ackBlockCheck[i]
+        i = i + 1
+    radioBuffer[_FRAME_LENGTH] = _FRAME_HEADER_SIZE + 10
+    radioBuffer[_FRAME_TYPE] = _FRAME_ACK
+    radioBuffer[_FRAME_SEQ] = expectedSeq & 0xFF
+    radioBuffer[_FRAME_SEQ + 1] = (expectedSeq >> 8) & 0xFF
+    radioBuffer[_FRAME_PAYLOAD] = bitmap & 0xFF
+    radioBuffer[_FRAME_PAYLOAD + 1] = (bitmap >> 8) & 0xFF
+    radioBuffer[_FRAME_PAYLOAD + 2] = (bitmap >> 16) & 0xFF
+    radioBuffer[_FRAME_PAYLOAD + 3] = (bitmap >> 24) & 0xFF
+
+def copySignatureToRadioBuffer(firstEntry):
+    # Up to _SIGNATURE_ENTRIES_PER_FRAME entries from firstEntry on.  Fewer than that tells
+    # the transmitter it has the whole signature.
+    start = firstEntry * _SIGNATURE_ENTRY_SIZE
+    if (start > len(signature)):
+        start = len(signature)
+    end = start + _SIGNATURE_ENTRIES_PER_FRAME * _SIGNATURE_ENTRY_SIZE
+    if (end > len(signature)):
+        end = len(signature)
+    radioBuffer[_FRAME_PAYLOAD : _FRAME_PAYLOAD + end - start] = signatureView[start:end]
+    radioBuffer[_FRAME_LENGTH] = _FRAME_HEADER_SIZE + end - start
+    radioBuffer[_FRAME_TYPE] = _FRAME_SIGNATURE
+    radioBuffer[_FRAME_SEQ] = firstEntry & 0xFF
+    radioBuffer[_FRAME_SEQ + 1] = (firstEntry >> 8) & 0xFF
+
+def sendSignature(firstEntry, rxAddress):
+    copySignatureToRadioBuffer(firstEntry)
+    radioTransmit(radioBuffer_address, rxAddress)
+    statCounters[_STAT_REPLIES] = statCounters[_STAT_REPLIES] + 1
+
+def sendResumePoint(checks, rxAddress):
+    # seq is the number of whole blocks of the file already here and the payload the SHA-256
+    # of their checks, see readCheckpoint()
+    blocks = len(checks) // 4
+    radioBuffer[_FRAME_PAYLOAD : _FRAME_PAYLOAD + 32] = uhashlib.sha256(checks).digest()
+    radioBuffer[_FRAME_LENGTH] = _FRAME_HEADER_SIZE + 32
+    radioBuffer[_FRAME_TYPE] = _FRAME_RESUME_POINT
+    radioBuffer[_FRAME_SEQ] = blocks & 0xFF
+    radioBuffer[_FRAME_SEQ + 1] = (blocks >> 8) & 0xFF
+    radioTransmit(radioBuffer_address, rxAddress)
+    statCounters[_STAT_REPLIES] = statCounters[_STAT_REPLIES] + 1
 
+def copyUint32ToRadioBuffer(position, value):
+    radioBuffer[_FRAME_PAYLOAD + position] = value & 0xFF
+    radioBuffer[_FRAME_PAYLOAD + position + 1] = (value >> 8) & 0xFF
+    radioBuffer[_FRAME_PAYLOAD + position + 2] = (value >> 16) & 0xFF
+    radioBuffer[_FRAME_PAYLOAD + position + 3] = (value >> 24) & 0xFF
 
-def initializeTxMode():
-    machine.mem32[_NRF_RADIO___BASE0] = _target_baseAddress
-    machine.mem32[_NRF_RADIO___PREFIX0] = _target_prefixAddress
+def canInflate():
+    try:
+        import deflate
+        return True
+    except ImportError:
+        pass
+    try:
+        import uzlib
+        return True
+    except ImportError:
+        return False
 
+def freeFlash():
+    # bytes free for an update; update.txt is written over, so its space counts as free
+    s = uos.statvfs("/")
+    free = s[0] * s[3]
+    try:
+        free = free + uos.stat("update.txt")[6]
+    except OSError:
+        pass
+    return free
 
-    machine.mem32[_NRF_RADIO___TASKS_DISABLE] = 1  # DISABLE the radio to establish a known state.
-    while (machine.mem32[_NRF_RADIO___STATE] != 0):  # wait until radio is DISABLED (i.e. STATE=0);
+def sendCapabilities(imageFile, theDigest, rxAddress):
+    # The size and SHA-256 digest of the image installed from imageFile, so the transmitter
+    # can tell whether the update is installed already, then the longest payload, the window,
+    # the free flash and heap in bytes, the _CAN_ bits and the noise on each of _CHANNELS
+    # here, see radioNoise().
+    noise = scanChannels()  # first, as the radio may receive into radioBuffer meanwhile
+    try:
+        size = uos.stat(imageFile)[6]
+    except OSError:
+        size = _NO_IMAGE
+        theDigest = bytes(32)  # nothing is installed, so no update can match it
+    copyUint32ToRadioBuffer(0, size)
+    radioBuffer[_FRAME_PAYLOAD + 4 : _FRAME_PAYLOAD + 36] = theDigest
+    radioBuffer[_FRAME_PAYLOAD + 36] = _MAX_PAYLOAD
+    radioBuffer[_FRAME_PAYLOAD + 37] = _WINDOW_SIZE
+    copyUint32ToRadioBuffer(38, freeFlash())
+    copyUint32ToRadioBuffer(42, gc.mem_free())
+    capabilities = _CAN_DELTA | _CAN_SET_LINK | _CAN_BUNDLE
+    if (canInflate()):
+        capabilities = capabilities | _CAN_INFLATE
+    radioBuffer[_FRAME_PAYLOAD + 46] = capabilities
+    radioBuffer[_FRAME_PAYLOAD + 47 : _FRAME_PAYLOAD + 47 + _CHANNEL_COUNT] = noise
+    radioBuffer[_FRAME_LENGTH] = _FRAME_HEADER_SIZE + 47 + _CHANNEL_COUNT
+    radioBuffer[_FRAME_TYPE] = _FRAME_CAPABILITIES
+    radioBuffer[_FRAME_SEQ] = 0
+    radioBuffer[_FRAME_SEQ + 1] = 0
+    radioTransmit(radioBuffer_address, rxAddress)
+    statCounters[_STAT_REPLIES] = statCounters[_STAT_REPLIES] + 1
+
+def sendFileState(seq, has, rxAddress):
+    # answers the FILE_QUERY frame numbered seq: payload 1 if the file is here already
+    radioBuffer[_FRAME_PAYLOAD] = 0
+    if (has):
+        radioBuffer[_FRAME_PAYLOAD] = 1
+    radioBuffer[_FRAME_LENGTH] = _FRAME_HEADER_SIZE + 1
+    radioBuffer[_FRAME_TYPE] = _FRAME_FILE_STATE
+    radioBuffer[_FRAME_SEQ] = seq & 0xFF
+    radioBuffer[_FRAME_SEQ + 1] = (seq >> 8) & 0xFF
+    radioTransmit(radioBuffer_address, rxAddress)
+    statCounters[_STAT_REPLIES] = statCounters[_STAT_REPLIES] + 1
+
+def setLink(setting):
+    # the radio must be DISABLED
+    global linkSetting
+    level = setting & _LINK_LEVEL_MASK
+    radioSetMode(_LINK_MODES[level], _LINK_POWERS[level], _CHANNELS[(setting >> 3) & 3])
+    linkSetting = setting
+
+def resetLink():
+    global linkFallback
+    setLink(_LINK_DEFAULT)
+    linkFallback = _LINK_DEFAULT
+
+def swapChannels(setting):
+    # the same setting on its backup channel, with the channel in use as the backup
+    return (setting & _LINK_LEVEL_MASK) | (((setting >> 5) & 3) << 3) | (((setting >> 3) & 3) << 5)
+
+def scanChannels():
+    # the noise on each of _CHANNELS, see radioNoise(); the radio must be DISABLED
+    noise = bytearray(_CHANNEL_COUNT)
+    i = 0
+    while (i < _CHANNEL_COUNT):
+        noise[i] = radioNoise(_CHANNELS[i], _SCAN_SAMPLES)
+        i = i + 1
+    radioSetFrequency(_CHANNELS[(linkSetting >> 3) & 3])
+    return noise
+
+def changeLink(setting, rxAddress):
+    # Answers the transmitter's SET_LINK frame on the setting both are on, then moves to the
+    # new one, keeping the one before to go back to, and listens into the buffer at rxAddress.
+    global linkFallback
+    radioBuffer[_FRAME_LENGTH] = _FRAME_HEADER_SIZE + 1
+    radioBuffer[_FRAME_TYPE] = _FRAME_SET_LINK
+    radioBuffer[_FRAME_SEQ] = 0
+    radioBuffer[_FRAME_SEQ + 1] = 0
+    radioBuffer[_FRAME_PAYLOAD] = setting
+    radioSend(radioBuffer_address)  # MODE can only change once it has gone
+    statCounters[_STAT_REPLIES] = statCounters[_STAT_REPLIES] + 1
+    linkFallback = linkSetting
+    setLink(setting)
+    radioListen(rxAddress)
+
+def moveLink(setting, rxAddress):
+    global linkFallback
+    radioDisable()
+    setLink(setting)
+    linkFallback = setting
+    radioListen(rxAddress)
+    if (logLevel >= _LOG_PACKETS):
+        print("Nothing heard, link setting ", setting, " now")
+
+def linkSilence(silence, stage, rxAddress):
+    # Called while nothing is heard, with the milliseconds since the last frame and the stage
+    # that silence has reached (0 when a frame has just arrived); returns the new stage.
+    # The transmitter does the same, so if either misses a move, or a move or the channel
+    # stops working, both end up on the same setting again.
+    if ((stage == 0) and (silence >= _LINK_PROBATION_MS)):
+        if (linkSetting != linkFallback):
+            moveLink(linkFallback, rxAddress)
+        return 1
+    if ((stage == 1) and (silence >= _LINK_LOST_MS)):
+        if (swapChannels(linkSetting) != linkSetting):
+            moveLink(swapChannels(linkSetting), rxAddress)
+        return 2
+    if ((stage == 2) and (silence >= _LINK_IDLE_MS)):
+        if (linkSetting != _LINK_DEFAULT):
+            moveLink(_LINK_DEFAULT, rxAddress)
+        return 3
+    return stage
+
+def copyNackToRadioBuffer(endSeq):
+    # seq is the first frame covered, a multiple of 8, and bit i of payload byte j is set if
+    # frame seq + 8 * j + i is missing.  At least one frame up to endSeq must be missing.
+    first = 0
+    while (groupFrames[first] == 0xFF):
+        first = first + 1
+    last = endSeq >> 3
+    if (last - first >= _MAX_PAYLOAD):
+        last = first + _MAX_PAYLOAD - 1  # the rest go in a later round
+    j = first
+    while (j <= last):
+        radioBuffer[_FRAME_PAYLOAD + j - first] = (~groupFrames[j]) & 0xFF
+        j = j + 1
+    if (last == (endSeq >> 3)):  # there are no frames after endSeq
+        radioBuffer[_FRAME_PAYLOAD + last - first] = radioBuffer[_FRAME_PAYLOAD + last - first] & ((2 << (endSeq & 7)) - 1)
+    radioBuffer[_FRAME_LENGTH] = _FRAME_HEADER_SIZE + last - first + 1
+    radioBuffer[_FRAME_TYPE] = _FRAME_NACK
+    radioBuffer[_FRAME_SEQ] = (first << 3) & 0xFF
+    radioBuffer[_FRAME_SEQ + 1] = (first >> 5) & 0xFF
+
+def sendNack(endSeq, slots, pollTime, rxAddress):
+    # Answers the POLL that arrived at pollTime in one of the slots after it, then listens
+    # into the buffer at rxAddress.
+    global nackSeed
+    nackSeed = (nackSeed * 75 + 74) % 65537  # next in this receiver's own sequence of slots
+    radioDisable()
+    copyNackToRadioBuffer(endSeq)
+    slotStart = _NACK_GUARD_US + (nackSeed % slots) * _NACK_SLOT_US
+    while (utime.ticks_diff(utime.ticks_us(), pollTime) < slotStart):
         True
-    machine.mem32[_NRF_RADIO___TASKS_TXEN] = 1  # turn on the radio transmitter and shift into TXIDLE.
-    while (machine.mem32[_NRF_RADIO___EVENTS_READY] == 0):  # Busy-wait.  After event READY, radio shall be in state TXIDLE.
-        True    
-    # ASSERTION: now ready to transmit a packet.
+    radioSendTo(_GROUP_ADDRESS)
+    radioTransmit(radioBuffer_address, rxAddress)
+    radioSendTo(_TARGET_ADDRESS)  # the NACK has gone, so unicast replies go to the transmitter again
+    statCounters[_STAT_REPLIES] = statCounters[_STAT_REPLIES] + 1
 
-def initializeRadio():
-    # value must be between 0 and 100
-    machine.mem32[_NRF_RADIO___FREQUENCY] = 98  # 2498Mhz.  
-    
-    # Enable data whitening.
-    # Base address is 4 bytes long (possible range is 2 to 4) and 
-    # max size of payload is 255,and 0 bytes of static length payload
-    machine.mem32[_NRF_RADIO___PCNF1] = 0x020400FF  # 0x020400FF
-    # Use an 8-byte preamble, and LENGTH can be 8 bits long.  S0 and S1 are all zero bits long.
-    machine.mem32[_NRF_RADIO___PCNF0] = 0x03000008
-    
-    machine.mem32[_NRF_RADIO___MODE] = 1  # set 2Mbps datarate.
-    machine.mem32[_NRF_RADIO___MODECNF0] = 1  # enable fast ramp-up of radio from DISABLED state.
-    
-    machine.mem32[_NRF_RADIO___CRCCNF] = 3  # CRC will be 3 (3 is max)  bytes and is computed including the address field
-    machine.mem32[_NRF_RADIO___PACKETPTR] = radioBuffer_address  # pointer to the payload in radioBuffer
-    
-    machine.mem32[_NRF_RADIO___RXADDRESSES] = 1  # receive on logical address 0.  Not important for transmitting.
-    machine.mem32[_NRF_RADIO___TXPOWER] = 8  # set to 8db transmit power, which is the maximum. 
-
-
-
-def copyStringToRadioBuffer(theString):
-    stringLength=len(theString)
-    i=0
-    while (i<stringLength):
-        radioBuffer[i]=ord(theString[i])
-        i=i+1
-    radioBuffer[i]=0  # delimit the end of the string
-
-
-def copyRadioBufferToString(i):
-#    if (radioBuffer[i]==0):
-#        print("Radio buffer length = ", i)
-#        return " "  # null string
-#    else:
-#        return chr(radioBuffer[i])+copyRadioBufferToString(i+1)
-    returnString=""
-    i=0
-    while (radioBuffer[i] != 0):
-        returnString = returnString + chr(radioBuffer[i])
-        i=i+1
-    return returnString
-
-def receivedString():
-    # print("Radio Buffer = ",radioBuffer)
-    return copyRadioBufferToString(0)
+def sendAck(expectedSeq, rxAddress):
+    # The radio is DISABLED after the frame that asked for this ACK.  Once the ACK has gone
+    # the radio turns around in hardware and listens into the buffer at rxAddress.
+    copyAckToRadioBuffer(expectedSeq)
+    radioTransmit(radioBuffer_address, rxAddress)
+    statCounters[_STAT_REPLIES] = statCounters[_STAT_REPLIES] + 1
 
 
 def printFile(fileName):
@@ -176,124 +784,632 @@ def printFile(fileName):
 
 def copyFile(sourceFile,destinationFile):
     print("Starting copy of ",sourceFile, " onto ", destinationFile)
-    s=open(sourceFile)
-    d = open(destinationFile,"w")
-    line=s.readline()
-    while line:
-        d.write(line)
-        line=s.readline()
+    s=open(sourceFile,"rb")
+    d = open(destinationFile,"wb")
+    chunk=s.read(_FILE_CHUNK_SIZE)
+    while chunk:
+        d.write(chunk)
+        chunk=s.read(_FILE_CHUNK_SIZE)
     s.close()
     d.close()
     print("Finished copying ",sourceFile, " onto ", destinationFile)    
 
-def backupMainPy():
-    print("Starting backup....")
-    copyFile("main.py","backup.py")
-    print("Finished backup.")
-        
+def removeFile(theFile):
+    try:
+        uos.remove(theFile)
+    except OSError:  # not there
+        pass
+
+def hashFilePrefix(theFile, length, theHash):
+    # adds the first length bytes of theFile to theHash
+    if (length <= 0):
+        return
+    f=open(theFile,"rb")
+    while (length > 0):
+        chunk = f.read(min(length, _FILE_CHUNK_SIZE))
+        if (not chunk):
+            break
+        theHash.update(chunk)
+        length = length - len(chunk)
+    f.close()
+
 def computeFileHash(theFile):
-    f=open(theFile)
+    # the file is read as raw bytes, so any file (including .mpy bytecode) hashes correctly
+    f=open(theFile,"rb")
     theHash = uhashlib.sha256()
-    line = f.readline()
-    while line:
-        theHash.update(line)
-        line = f.readline()
+    chunk = f.read(_FILE_CHUNK_SIZE)
+    while chunk:
+        theHash.update(chunk)
+        chunk = f.read(_FILE_CHUNK_SIZE)
+    f.close()
     theRawHash = theHash.digest() # type is 'bytes'
     hexHash =  ubinascii.hexlify(theRawHash) # still 'bytes', but now in hex
     return hexHash.decode()  # hexHash coverted to a string type   
 
+def hasFile(theFile, size, digest):
+    # Whether theFile is here already, size bytes with this SHA-256 digest.  Only a file of
+    # the same size can be, so only then is it read to hash it.
+    try:
+        if (uos.stat(theFile)[6] != size):
+            return False
+    except OSError:  # not here at all
+        return False
+    return computeFileHash(theFile) == ubinascii.hexlify(digest).decode()
+
+def makeParents(path):
+    # creates the directories path is in, where they are not there yet
+    i = path.find("/", 1)
+    while (i > 0):
+        try:
+            uos.mkdir(path[:i])
+        except OSError:  # there already
+            pass
+        i = path.find("/", i + 1)
+
+def unpackBundle(theFile):
+    # Takes the files out of a bundle (see writeBundle() in txRadio_v011.py), each into
+    # <name>.new beside where it goes, and returns their names, or None if the bundle is cut
+    # short.  The SHA-256 of the bundle is checked already, and that covers every file in it.
+    f=open(theFile,"rb")
+    files = []
+    line = f.readline()
+    while (line and (line != b"\n")):
+        fields = line.decode().rstrip("\n").split(" ", 2)
+        files.append((int(fields[0]), fields[2]))
+        line = f.readline()
+    targets = []
+    for size, target in files:
+        makeParents(target)
+        targets.append(target)
+        d=open(target + ".new","wb")
+        while (size > 0):
+            chunk = f.read(min(size, _FILE_CHUNK_SIZE))
+            if (not chunk):
+                break
+            d.write(chunk)
+            size = size - len(chunk)
+        d.close()
+        if (size > 0):
+            f.close()
+            for name in targets:
+                removeFile(name + ".new")
+            return None
+    f.close()
+    return targets
+
+def openInflater(f):
+    # Newer firmware has the deflate module, older firmware has uzlib.  Either one inflates
+    # from the stream through a window of 2**_DEFLATE_WBITS bytes.
+    try:
+        import deflate
+        return deflate.DeflateIO(f, deflate.ZLIB, _DEFLATE_WBITS)
+    except ImportError:
+        import uzlib
+        return uzlib.DecompIO(f, _DEFLATE_WBITS)
+
+def inflateFile(sourceFile, destinationFile):
+    # Inflates sourceFile onto destinationFile a chunk at a time and hashes the inflated
+    # content on the way.  Returns the SHA-256 like computeFileHash(), or "" if the
+    # compressed stream is corrupt.
+    print("Inflating ",sourceFile, " onto ", destinationFile)
+    s=open(sourceFile,"rb")
+    d = open(destinationFile,"wb")
+    theHash = uhashlib.sha256()
+    try:
+        inflater = openInflater(s)
+        chunk = inflater.read(_FILE_CHUNK_SIZE)
+        while chunk:
+            theHash.update(chunk)
+            d.write(chunk)
+            chunk = inflater.read(_FILE_CHUNK_SIZE)
+        hexHash = ubinascii.hexlify(theHash.digest()).decode()
+    except (OSError, ValueError):
+        hexHash = ""
+    s.close()
+    d.close()
+    return hexHash
+
+def isBlockStart(line):
+    # a top-level line (not indented, blank or a comment) can start a new block
+    if (len(line) == 0):
+        return False
+    c = line[0]
+    return ((c != 0x20) and (c != 0x09) and (c != 0x0D) and (c != 0x0A) and (c != 0x23))
+
+def fileBlocks(f):
+    # Splits a file into the blocks used by delta updates.  A block ends before a top-level
+    # line once it holds _DELTA_MIN_BLOCK bytes, so blocks follow the functions of a source
+    # file and an edit only changes the blocks it touches; the blocks after it stay the same
+    # even if lines were added or removed.  No block is longer than _DELTA_MAX_BLOCK bytes.
+    # Must match the transmitter.
+    block = b""
+    line = f.readline(_DELTA_MAX_BLOCK)
+    while line:
+        if (((len(block) >= _DELTA_MIN_BLOCK) and isBlockStart(line)) or
+                (len(block) + len(line) > _DELTA_MAX_BLOCK)):
+            yield block
+            block = b""
+        block = block + line
+        line = f.readline(_DELTA_MAX_BLOCK)
+    if (block):
+        yield block
+
+def computeSignature(theFile, theHash):
+    # theFile is added to theHash on the way
+    signature = bytearray()
+    try:
+        f=open(theFile,"rb")
+    except OSError:  # nothing installed yet, every block will have to be sent
+        return signature
+    for block in fileBlocks(f):
+        theHash.update(block)
+        signature.extend(uhashlib.sha256(block).digest()[0:_DELTA_HASH_SIZE])
+        signature.append(len(block) & 0xFF)
+        signature.append(len(block) >> 8)
+    f.close()
+    return signature
+
+def copyBytes(s, d, length, theHash):
+    while (length > 0):
+        n = length
+        if (n > _FILE_CHUNK_SIZE):
+            n = _FILE_CHUNK_SIZE
+        chunk = s.read(n)
+        if (not chunk):
+            raise ValueError("delta runs past the end of a file")
+        theHash.update(chunk)
+        d.write(chunk)
+        length = length - len(chunk)
+
+def applyDelta(deltaFile, baseFile, destinationFile):
+    # Rebuilds the new file from the delta and the file it was made against, hashing it on
+    # the way.  Returns the SHA-256 like computeFileHash(), or "" if the delta is corrupt.
+    print("Applying ",deltaFile, " to ", baseFile, " onto ", destinationFile)
+    s=open(deltaFile,"rb")
+    d = open(destinationFile,"wb")
+    b = None
+    theHash = uhashlib.sha256()
+    try:
+        op = s.read(1)
+        while op:
+            if (op[0] == _DELTA_COPY):
+                header = s.read(6)
+                offset = header[0] | (header[1] << 8) | (header[2] << 16) | (header[3] << 24)
+                if (b is None):
+                    b = open(baseFile,"rb")
+                b.seek(offset)
+                copyBytes(b, d, header[4] | (header[5] << 8), theHash)
+            elif (op[0] == _DELTA_DATA):
+                header = s.read(2)
+                copyBytes(s, d, header[0] | (header[1] << 8), theHash)
+            else:
+                raise ValueError("unknown delta instruction")
+            op = s.read(1)
+        hexHash = ubinascii.hexlify(theHash.digest()).decode()
+    except (OSError, ValueError, IndexError):
+        hexHash = ""
+    s.close()
+    d.close()
+    if (b is not None):
+        b.close()
+    return hexHash
+
+def readInstallRecord():
+    # returns the state of the last install and the files it replaced, or None
+    try:
+        f=open(_INSTALL_RECORD)
+    except OSError:  # nothing installed over the air yet
+        return None
+    lines = f.read().split("\n")
+    f.close()
+    return (lines[0], [line for line in lines[1:] if line])
+
+def writeInstallRecord(state, targets):
+    # written aside and renamed over the old record, so it is never left half written
+    d = open(_INSTALL_RECORD + ".tmp","w")
+    d.write(state + "\n")
+    for target in targets:
+        d.write(target + "\n")
+    d.close()
+    uos.rename(_INSTALL_RECORD + ".tmp", _INSTALL_RECORD)
+
+def installFile(theFile, target):
+    removeFile(target + ".bak")
+    try:
+        uos.rename(target, target + ".bak")
+    except OSError:  # nothing there yet
+        pass
+    uos.rename(theFile, target)
+
+def swapBackup(target):
+    # Puts target.bak back in place of target and keeps target as the backup, so rolling
+    # back twice rolls forward again.  Must match boot.py.
+    try:
+        uos.stat(target + ".bak")
+    except OSError:
+        return  # nothing to go back to
+    try:
+        uos.rename(target, target + ".tmp")
+    except OSError:  # an install that was cut short
+        pass
+    uos.rename(target + ".bak", target)
+    try:
+        uos.rename(target + ".tmp", target + ".bak")
+    except OSError:
+        pass
+
+def installImage(theFile, imageFlags):
+    # The record goes first, so boot.py can undo an install that is cut short.  The files of a
+    # bundle are all put in place under one record, so they go in, and are rolled back,
+    # together.  Returns False if there was nothing to install.
+    if (imageFlags & _IMAGE_BUNDLE):
+        targets = unpackBundle(theFile)
+        if (targets is None):
+            return False
+        writeInstallRecord("0", targets)
+        for target in targets:
+            installFile(target + ".new", target)
+        removeFile(theFile)
+    elif (imageFlags & _IMAGE_MPY):
+        # Precompiled bytecode is installed as a module, and main.py becomes a one line
+        # loader for it, so nothing has to be compiled from source at boot.
+        d = open("update.ldr","w")
+        d.write("from " + mpyModuleName + " import *\n")
+        d.close()
+        writeInstallRecord("0", (mpyModuleName + ".mpy", "main.py"))
+        installFile(theFile, mpyModuleName + ".mpy")
+        installFile("update.ldr", "main.py")
+    else:
+        writeInstallRecord("0", ("main.py",))
+        installFile(theFile, "main.py")
+    return True
+
+def confirmImage():
+    # Called by the application once it is running properly, e.g. after the first pass
+    # through its main loop, so boot.py keeps this image instead of rolling it back.
+    record = readInstallRecord()
+    if ((record is not None) and (record[0] != "ok")):
+        writeInstallRecord("ok", record[1])
+        print("Update confirmed.")
+
+def rollback():
+    # puts back whatever the last update replaced and restarts with it
+    record = readInstallRecord()
+    if (record is None):
+        print("There is no update to roll back.")
+        return
+    for target in record[1]:
+        swapBackup(target)
+    writeInstallRecord("ok", record[1])
+    print("Rolled back the last update.  Rebooting....")
+    machine.reset()
+
 def initializeEverything():
     # Main setup    
     print("rxRadio version 6.000")
-    # backupMainPy()
     initializeSerialOutput()
-    initializeHardware()
-    initializeClocks()
     initializeRadio() 
 
 def testReceiveSha():
     initializeEverything()
     print(receiveSha256StringFromTransmitter())
 
-def start():
-    initializeEverything()
+def receiveUpdate():
+    # The receive loop, as a generator so that it can run in the foreground (start()) or as
+    # a uasyncio task next to the application (serve()).  It yields whenever the radio has
+    # nothing for it, with the milliseconds it could wait before looking again, and comes to
+    # an end if an update fails or stops partway.  Checking and installing a good update, and the reset after
+    # it, run without yielding.
+    global signature, signatureView
     print("Waiting to receive update.txt file...")
 
     # Main loop
-    f=open("update.txt","w")
-    packetCounter = 0
+    f = None  # update.txt, opened by the START frame, or by the first frame of a broadcast
+    checkpoint = None
+    resumeChecks = b""  # see readCheckpoint()
+    imageSize = 0  # as announced in the RESUME frame
+    announcedFlags = 0
+    announcedDigest = b""
+    resetStats()
     receivedHash=""
-    timeToAssembleHash = False
+    fileHash = uhashlib.sha256()  # of the frames written in order, so the file is not read again
+    streamedHash = ""
+    imageFlags = 0
     finishedReceiving = False
 
-    timeToCloseReceiveFile = False
-    receivedPacketIdTracker = 0
+    expectedSeq = 0  # sequence number of the next frame to write to the file
+    resetWindow()
+    groupEndSeq = -1  # sequence number of a broadcast's END frame, once known
+    groupReceived = 0  # broadcast frames received so far
+    resetGroup()
+    resetFec()
+    resetBlockCheck()
+    resetPages()
+    receiving = freeBuffers.pop()  # buffer the radio is currently receiving into
 
-    initializeRxMode()
-    machine.mem32[_NRF_RADIO___EVENTS_CRCOK] = 0 # clear the semaphore
-    while (machine.mem32[_NRF_RADIO___EVENTS_CRCOK]): True  # wait for semaphore to be cleared
-    print ("Ready to receive")
-    machine.mem32[_NRF_RADIO___TASKS_START] = 1  # Move from RXIDLE mode into RX mode 
+    # the signature of main.py is ready before the transmitter asks for it, and so is its
+    # hash, which tells the transmitter whether the update is installed already
+    mainHash = uhashlib.sha256()
+    signature = computeSignature("main.py", mainHash)
+    signatureView = memoryview(signature)
+    mainDigest = mainHash.digest()
 
-    while (not (finishedReceiving)):
-        gc.collect()
+    radioDisable()
+    gc.collect()  # collect once now rather than during the transfer
+    print ("Ready to receive")
+    radioListen(rxAddresses[receiving])
 
-        if (machine.mem32[_NRF_RADIO___EVENTS_CRCOK] != 0):  #if valid packet received
-            print ("Packet received")
+    lastPacketTime = utime.ticks_ms()
+    firstPacketTime = lastPacketTime
+    linkStage = 0  # see linkSilence()
+    while ((not finishedReceiving) or (utime.ticks_diff(utime.ticks_ms(), lastPacketTime) < _LINGER_MS)):
+        state = radioReceived()
+        if (state != 0):  #if a packet has arrived
+            if (state < 0):  # corrupted, listen again
+                radioListen(rxAddresses[receiving])
+                statCounters[_STAT_CRC_FAILURES] = statCounters[_STAT_CRC_FAILURES] + 1
+                continue
+            lastPacketTime = utime.ticks_ms()
+            linkStage = 0
+            if (statCounters[_STAT_PACKETS] == 0):
+                firstPacketTime = lastPacketTime
+            received = receiving
+            buffer = rxBuffers[received]
+            receiving = freeBuffers.pop()
+            ackRequested = buffer[_FRAME_TYPE] & _FLAG_ACK_REQUEST
+            group = (radioMatch() == _GROUP_ADDRESS)  # read before listening again
+            if (not ackRequested):
+                radioListen(rxAddresses[receiving])  # keep receiving while this frame is processed
 
-            packetCounter = packetCounter + 1
-            theReceivedString=receivedString()
-            print(theReceivedString)
+            statCounters[_STAT_PACKETS] = statCounters[_STAT_PACKETS] + 1
 
-            # process the packe received 
-            receivedPacketId = int(theReceivedString[0:10])
-            if (receivedPacketId == receivedPacketIdTracker + 1):  #filter out redundant packets
-                receivedPacketIdTracker = receivedPacketIdTracker + 1
-                receivedPayload = theReceivedString[10:]
-                #print("receivedPacketId = ",receivedPacketId, " receivedPayload = ", receivedPayload)   
-                #print(packetCounter, "Payload received:  " + theReceivedString)
+            # process the frame received 
+            seq = frameSeq(buffer)
+            frameType = buffer[_FRAME_TYPE] & _FRAME_TYPE_MASK
+            isFull = (framePayloadLength(buffer) == _MAX_PAYLOAD)
+            if (group):
+                rebuilt = -1
+                if (f is None):
+                    f=open("update.txt","wb")
+                    removeFile(_CHECKPOINT_FILE)  # update.txt holds none of its blocks now
+                if (frameType == _FRAME_POLL):
+                    groupEndSeq = seq
+                    if (groupReceived <= groupEndSeq):
+                        sendNack(groupEndSeq, rxPayloads[received][0], utime.ticks_us(), rxAddresses[receiving])
+                        if (logLevel >= _LOG_PACKETS):
+                            print("Asked for missing frames after ", statCounters[_STAT_PACKETS], " packets")
+                elif (((frameType == _FRAME_DATA) or (frameType == _FRAME_END)) and (seq < _GROUP_MAX_FRAMES) and
+                        ((groupFrames[seq >> 3] & (1 << (seq & 7))) == 0)):
+                    if (frameType == _FRAME_END):
+                        receivedHash = ubinascii.hexlify(bytes(rxPayloads[received][0:32])).decode()
+                        if (framePayloadLength(buffer) > 32):
+                            imageFlags = rxPayloads[received][32]
+                        groupEndSeq = seq
+                    else:
+                        f.seek(seq * _MAX_PAYLOAD)  # frames may arrive in any order
+                        writePayload(f, received)
+                        if (isFull):
+                            rebuilt = fecAdd(seq, received, False)
+                    groupFrames[seq >> 3] = groupFrames[seq >> 3] | (1 << (seq & 7))
+                    groupReceived = groupReceived + 1
+                elif ((frameType == _FRAME_PARITY) and isFull):
+                    rebuilt = fecAdd(seq, received, True)
+                elif ((frameType == _FRAME_DATA) or (frameType == _FRAME_END)):
+                    statCounters[_STAT_DUPLICATES] = statCounters[_STAT_DUPLICATES] + 1
+                if ((rebuilt >= 0) and ((groupFrames[rebuilt >> 3] & (1 << (rebuilt & 7))) == 0)):
+                    statCounters[_STAT_REBUILT] = statCounters[_STAT_REBUILT] + 1
+                    rebuildFrame(rebuilt, received)
+                    f.seek(rebuilt * _MAX_PAYLOAD)
+                    writePayload(f, received)
+                    groupFrames[rebuilt >> 3] = groupFrames[rebuilt >> 3] | (1 << (rebuilt & 7))
+                    groupReceived = groupReceived + 1
+                freeBuffers.append(received)
+                if ((groupEndSeq >= 0) and (groupReceived > groupEndSeq)):  # every frame is here
+                    f.close()
+                    break
+                continue
+            if (frameType == _FRAME_SIGNATURE_REQUEST):
+                freeBuffers.append(received)  # not part of the file
+                if (ackRequested):
+                    sendSignature(seq, rxAddresses[receiving])
+                continue
+            if (frameType == _FRAME_SET_LINK):
+                setting = rxPayloads[received][0]
+                freeBuffers.append(received)
+                if (ackRequested):
+                    if (((setting & _LINK_LEVEL_MASK) < _LINK_LEVELS) and (setting < 0x80)):
+                        changeLink(setting, rxAddresses[receiving])
+                    else:
+                        radioListen(rxAddresses[receiving])
+                continue
+            if (frameType == _FRAME_HELLO):
+                flags = rxPayloads[received][0]
+                freeBuffers.append(received)
+                if (ackRequested):
+                    imageFile = "main.py"
+                    digest = mainDigest
+                    if (flags & _IMAGE_MPY):
+                        imageFile = mpyModuleName + ".mpy"
+                        try:
+                            digest = ubinascii.unhexlify(computeFileHash(imageFile))
+                        except OSError:  # no .mpy image yet; its size says so
+                            pass
+                    sendCapabilities(imageFile, digest, rxAddresses[receiving])
+                continue
+            if (frameType == _FRAME_FILE_QUERY):
+                payload = rxPayloads[received]
+                size = payload[0] | (payload[1] << 8) | (payload[2] << 16) | (payload[3] << 24)
+                digest = bytes(payload[4:36])
+                target = bytes(payload[36:framePayloadLength(buffer)]).decode()
+                freeBuffers.append(received)
+                if (ackRequested):
+                    sendFileState(seq, hasFile(target, size, digest), rxAddresses[receiving])
+                continue
+            if (frameType == _FRAME_RESUME):
+                payload = rxPayloads[received]
+                size = payload[0] | (payload[1] << 8) | (payload[2] << 16) | (payload[3] << 24)
+                flags = payload[4]
+                digest = bytes(payload[5:37])
+                freeBuffers.append(received)
+                if (ackRequested and (not finishedReceiving)):
+                    if (f is not None):  # the transmitter started again, so this transfer is over
+                        closeTransfer(f, checkpoint, fileHash)
+                        f = None
+                        checkpoint = None
+                        expectedSeq = 0
+                        groupEndSeq = -1
+                        groupReceived = 0
+                        imageFlags = 0
+                        receivedHash = ""
+                    imageSize = size
+                    announcedFlags = flags
+                    announcedDigest = digest
+                    resumeChecks = readCheckpoint(imageSize, announcedFlags, announcedDigest)
+                    sendResumePoint(resumeChecks, rxAddresses[receiving])
+                    # hash what is already here while the transmitter checks its own copy
+                    fileHash = uhashlib.sha256()
+                    hashFilePrefix("update.txt", len(resumeChecks) // 4 * _CHECK_BLOCK * _MAX_PAYLOAD, fileHash)
+                elif (ackRequested):
+                    radioListen(rxAddresses[receiving])  # not answered, so listen again here
+                continue
+            if (frameType == _FRAME_START):
+                freeBuffers.append(received)
+                if (f is None):  # not a repeat of the START frame whose ACK was lost
+                    if ((seq > 0) and (seq == len(resumeChecks) // 4 * _CHECK_BLOCK)):
+                        f=open("update.txt","r+b")
+                        f.seek(seq * _MAX_PAYLOAD)
+                        checkpoint = open(_CHECKPOINT_FILE,"r+b")
+                        checkpoint.seek(_CHECKPOINT_HEADER + len(resumeChecks))
+                        resumeBlockCheck(resumeChecks)
+                        expectedSeq = seq
+                        print("Carrying on from byte ", seq * _MAX_PAYLOAD, " of an earlier transfer")
+                    else:
+                        f=open("update.txt","wb")
+                        fileHash = uhashlib.sha256()
+                        checkpoint = newCheckpoint(imageSize, announcedFlags, announcedDigest)
+                    resumeChecks = b""
+                if (ackRequested):
+                    sendAck(expectedSeq, rxAddresses[receiving])
+                continue
+            if (f is None):
+                freeBuffers.append(received)  # nothing is written before the START frame
+                if (ackRequested):
+                    radioListen(rxAddresses[receiving])
+                continue
+            rebuilt = -1
+            offset = seq - expectedSeq
+            if (frameType == _FRAME_PARITY):
+                if (isFull):
+                    rebuilt = fecAdd(seq, received, True)
+                freeBuffers.append(received)
+            elif ((offset >= 0) and (offset < _WINDOW_SIZE) and (heldBuffers[seq % _WINDOW_SIZE] < 0)):
+                heldBuffers[seq % _WINDOW_SIZE] = received
+                if ((frameType == _FRAME_DATA) and isFull):
+                    rebuilt = fecAdd(seq, received, False)
+            else:
+                freeBuffers.append(received)  # redundant frame, or too far ahead of the window
+                statCounters[_STAT_DUPLICATES] = statCounters[_STAT_DUPLICATES] + 1
+            offset = rebuilt - expectedSeq
+            if ((rebuilt >= 0) and (offset >= 0) and (offset < _WINDOW_SIZE) and (heldBuffers[rebuilt % _WINDOW_SIZE] < 0)):
+                heldBuffers[rebuilt % _WINDOW_SIZE] = freeBuffers.pop()
+                statCounters[_STAT_REBUILT] = statCounters[_STAT_REBUILT] + 1
+                rebuildFrame(rebuilt, heldBuffers[rebuilt % _WINDOW_SIZE])
 
-                if (receivedPayload == "$$$$$$$$"):  # Use $$$$$$$$ to signify end of file transmission
-                    timeToCloseReceiveFile = True
+            # write out every frame that is now in order
+            slot = expectedSeq % _WINDOW_SIZE
+            while (heldBuffers[slot] >= 0):
+                inOrder = heldBuffers[slot]
+                heldBuffers[slot] = -1
+                frameType = rxBuffers[inOrder][_FRAME_TYPE] & _FRAME_TYPE_MASK
+                if (frameType == _FRAME_END):  # the END frame carries the SHA-256 of the file
+                    while ((pendingPage >= 0) or (pageFill[fillingPage] > 0)):
+                        writePage(f, checkpoint, fileHash)
                     f.close()  #close the update.txt file
-                    timeToAssembleHash = True
+                    checkpoint.close()
+                    streamedHash = ubinascii.hexlify(fileHash.digest()).decode()
+                    receivedHash = ubinascii.hexlify(bytes(rxPayloads[inOrder][0:32])).decode()
+                    if (framePayloadLength(rxBuffers[inOrder]) > 32):
+                        imageFlags = rxPayloads[inOrder][32]
+                    finishedReceiving = True
                 else:
-                    if (receivedPayload == "$!$!$!$!"):  # Use $!$!$!$! to signify end of hash transmission
-                        finishedReceiving = True
-                    else:
-                        if (timeToAssembleHash):
-                            receivedHash = receivedHash + receivedPayload               
-                        else:
-                            if (not timeToCloseReceiveFile):  
-                                f.write(receivedPayload)  
-
-                     
-            initializeTxMode()
-            machine.mem32[_NRF_RADIO___EVENTS_END] = 0  #Clear Semaphore
-            while (machine.mem32[_NRF_RADIO___EVENTS_END] != 0): True  # wait
-            radioBuffer[0] = 0  #send a null payload as an acknowledgment
-            machine.mem32[_NRF_RADIO___TASKS_START] = 1  # Move from TXIDLE mode into TX mode to transmit an acknowledgment
-            while (machine.mem32[_NRF_RADIO___EVENTS_END] == 0): True  # busy-wait until packet is sent
-            initializeRxMode()
-            machine.mem32[_NRF_RADIO___EVENTS_CRCOK] = 0 # clear the semaphore
-            while (machine.mem32[_NRF_RADIO___EVENTS_CRCOK]): True  # wait for semaphore to be cleared
-            machine.mem32[_NRF_RADIO___TASKS_START] = 1  # Move from RXIDLE mode into RX mode 
+                    bufferPayload(inOrder)
+                    if (addToBlockCheck(expectedSeq, inOrder)):
+                        finishPage(f, checkpoint, expectedSeq // _CHECK_BLOCK, fileHash)
+                freeBuffers.append(inOrder)
+                expectedSeq = expectedSeq + 1
+                slot = expectedSeq % _WINDOW_SIZE
 
+            if (ackRequested):
+                sendAck(expectedSeq, rxAddresses[receiving])
+                if (logLevel >= _LOG_PACKETS):
+                    print("Received up to frame ", expectedSeq, " after ", statCounters[_STAT_PACKETS], " packets")
+        elif (pendingPage >= 0):  # nothing else to do until the next frame arrives
+            writePage(f, checkpoint, fileHash)
+        elif (linkStage < 3):
+            linkStage = linkSilence(utime.ticks_diff(utime.ticks_ms(), lastPacketTime), linkStage, rxAddresses[receiving])
+            yield 0
+        elif ((f is not None) and (not finishedReceiving) and
+                (utime.ticks_diff(utime.ticks_ms(), lastPacketTime) >= _SESSION_IDLE_MS)):
+            closeTransfer(f, checkpoint, fileHash)
+            radioDisable()
+            print("Nothing heard for ", _SESSION_IDLE_MS, " ms in the middle of the update.  Update aborted.")
+            return
+        else:
+            # nothing heard for a while, so no transfer to keep up with; a frame that arrives
+            # meanwhile waits in its buffer, and the transmitter asks again anyway
+            yield _IDLE_POLL_MS
+
+    radioDisable()
+    statCounters[_STAT_RECEIVE_MS] = utime.ticks_diff(lastPacketTime, firstPacketTime)
+    checkTime = utime.ticks_ms()
     print()
     print()
-    print("Here is the received fie:")
-    printFile("update.txt")
+    # the file may be binary, so report its size rather than printing it
+    print("Received ", uos.stat("update.txt")[6], " bytes into update.txt")
     print("Received SHA-256 hash is:  ", receivedHash)
-    computedHash = computeFileHash("update.txt")
+    # undo the transfer encodings in turn; the hash covers the file that comes out of the last
+    imageFile = "update.txt"
+    if (imageFlags & _IMAGE_COMPRESSED):
+        computedHash = inflateFile(imageFile, "update.inf")
+        imageFile = "update.inf"
+    if (imageFlags & _IMAGE_DELTA):
+        computedHash = applyDelta(imageFile, "main.py", "update.new")
+        imageFile = "update.new"
+    if (not (imageFlags & (_IMAGE_COMPRESSED | _IMAGE_DELTA))):
+        computedHash = streamedHash
+        if (not computedHash):  # a broadcast is written out of order, so hash it now
+            computedHash = computeFileHash(imageFile)
     print ("Computed SHA-256 hash of received file is ", computedHash)
+    statCounters[_STAT_CHECK_MS] = utime.ticks_diff(utime.ticks_ms(), checkTime)
+    if (logLevel >= _LOG_SUMMARY):
+        printStats()
+    removeFile(_CHECKPOINT_FILE)  # whole now, or not worth carrying on from
     if (receivedHash  == computedHash):
         print("Sucess!  Hash values match.  File successfully received.")
-        copyFile("update.txt","main.py")
-        print("Rebooting....")
-        machine.reset() 
+        if (installImage(imageFile, imageFlags)):
+            print("Rebooting....")
+            machine.reset() 
+        else:
+            print("Fail!  The bundle is cut short.  Update aborted.")
     else:
         print("Fail!  Hash values do NOT match.  Failed to receive update file successfully.  Update aborted.")
 
+def start():
+    initializeEverything()
+    for wait in receiveUpdate():
+        pass  # nothing else to do, so look again straight away
+
+async def serve():
+    # Receives updates in the background of the application, as a uasyncio task:
+    #   uasyncio.create_task(rxRadio_v011.serve())
+    # Waits for the next update after one that fails.
+    import uasyncio  # only here, so that receive() runs on firmware without it
+    initializeEverything()
+    while True:
+        for wait in receiveUpdate():
+            await uasyncio.sleep_ms(wait)
+        print("Waiting for the update to be sent again")
+
 def receive():
     start()
 
@@ -305,6 +1421,8 @@ print("My address is 0x{:02X}".format(_my_prefixAddress) + "{:08X}".format(_my_b
 print("The transmitter node's address is 0x{:02X}".format(_target_prefixAddress) + "{:08X}".format(_target_baseAddress))
 print ("I am ready to perform an over-the-air code update.")
 print("Type 'receive()' at the REPL prompt to begin.")
+print("Or type 'rollback()' to go back to the code this node ran before its last update.")
+print("Type 'confirmImage()' once the code of the last update runs properly, so that it is kept.")
 
 
 
@@ -4,7 +4,8 @@
 
 # You can use:
 # ampy --port /dev/ttyACM0 put update.txt
-# from LINUX to load the update code onto the nRF52840 transmitter board
+# from LINUX to load the update code onto the nRF52840 transmitter board, and the same for
+# nrfRadio.py, the radio driver this program runs on.
 
 # Start program by typing:
 # transit()
@@ -17,185 +18,570 @@
 # Any concrete suggestions on how to improve the code are always appreciated.
 
 from micropython import const  # needed to efficiently access memory by avoiding micropython lookups
-import machine  # so can peek and poke different registers on the nRF5x
-import uctypes # needed to create the radio buffer (a byte array)
+import micropython  # for the viper code emitter
+import uctypes # needed to create the window buffers
 import utime # needed to create delays
-import gc #import garbage collector
 import uhashlib # needed for SHA-256
 import ubinascii # needed to convert the SHA-256 result into a string
-
-radioBuffer_size = 256
-radioBuffer = bytearray(radioBuffer_size)  # allocate IO buffer for use by nRF5x radio
-radioBuffer_address = uctypes.addressof(radioBuffer)
+import uos # needed for file sizes
+from nrfRadio import (radioBuffer, radioBuffer_size, radioBuffer_address, radioConfigure, radioSetMode, radioSetFrequency,
+                      radioUseGroup, radioDisable, radioListen, radioReceived, radioTransmit, radioSend,
+                      radioNoise)  # the radio driver, see nrfRadio.py
 
 _target_prefixAddress = const(0xAA) # prefix address of the other node
 _target_baseAddress = const(0xDEADBEEF) # base address of the other node
 _my_prefixAddress = const(0xAA)  # prefix address of this node
 _my_baseAddress = const(0xFEEDBEEF)  # base address of this node
+# prefix of the group address used for broadcasts; the group address is this prefix followed
+# by this node's base address, and every receiver listens on it as well as on its own
+_group_prefixAddress = const(0xA5)
 
 
-_NRF_POWER = const(0x40000000)
-_DCDCEN = const(0x578)
-_NRF_POWER___DCDCEN = const(_NRF_POWER + _DCDCEN)
-
-_NRF_CLOCK = const(0x40000000)
-_TASKS_HFCLKSTART = const(0)
-_EVENTS_HFCLKSTARTED = const(0x100)
-_NRF_CLOCK___TASKS_HFCLKSTART = const(_NRF_CLOCK + _TASKS_HFCLKSTART)
-_NRF_CLOCK___EVENTS_HFCLKSTARTED = const(_NRF_CLOCK + _EVENTS_HFCLKSTARTED)
-
-_NRF_RADIO = const(0x40001000)
-_BASE0 = const(0x51C)
-_PREFIX0 = const(0x524)
-_FREQUENCY = const(0x508)
-_PCNF1 = const(0x518)
-_PCNF0 = const(0x514)
-_MODE = const(0x510)
-_MODECNF0 = const(0x650)
-_CRCCNF = const(0x534)
-_PACKETPTR = const(0x504)
-_RXADDRESSES = const(0x530)
-_TXPOWER = const(0x50C)
-_TASKS_DISABLE = const(0x010)
-_STATE = const(0x550)
-_TASKS_TXEN = const(0)
-_TASKS_RXEN = const(0x004)
-_EVENTS_READY = const(0x100)
-_TASKS_START = const(0x008)
-_EVENTS_END = const(0x10C)
-_EVENTS_CRCOK = const(0x130)
-_NRF_RADIO___BASE0 = const(_NRF_RADIO + _BASE0)
-_NRF_RADIO___PREFIX0 = const(_NRF_RADIO + _PREFIX0)
-_NRF_RADIO___FREQUENCY = const(_NRF_RADIO + _FREQUENCY)
-_NRF_RADIO___PCNF1 = const(_NRF_RADIO + _PCNF1)
-_NRF_RADIO___PCNF0 = const(_NRF_RADIO + _PCNF0)
-_NRF_RADIO___MODE = const(_NRF_RADIO + _MODE)
-_NRF_RADIO___MODECNF0 = const(_NRF_RADIO + _MODECNF0)
-_NRF_RADIO___CRCCNF = const(_NRF_RADIO + _CRCCNF)
-_NRF_RADIO___PACKETPTR = const(_NRF_RADIO + _PACKETPTR)
-_NRF_RADIO___RXADDRESSES = const(_NRF_RADIO + _RXADDRESSES)
-_NRF_RADIO___TXPOWER = const(_NRF_RADIO + _TXPOWER)
-_NRF_RADIO___TASKS_DISABLE = const(_NRF_RADIO + _TASKS_DISABLE)
-_NRF_RADIO___STATE = const(_NRF_RADIO + _STATE)
-_NRF_RADIO___TASKS_TXEN = const(_NRF_RADIO + _TASKS_TXEN)
-_NRF_RADIO___TASKS_RXEN = const(_NRF_RADIO + _TASKS_RXEN)
-_NRF_RADIO___EVENTS_READY = const(_NRF_RADIO + _EVENTS_READY)
-_NRF_RADIO___TASKS_START = const(_NRF_RADIO + _TASKS_START)
-_NRF_RADIO___EVENTS_END = const(_NRF_RADIO + _EVENTS_END)
-_NRF_RADIO___EVENTS_CRCOK = const(_NRF_RADIO + _EVENTS_CRCOK)
-
 def initializeSerialOutput():
     print("Starting...")
 
-def initializeHardware():  # enable the DCDC voltage regulator
-    machine.mem32[_NRF_POWER___DCDCEN] = 1  # NRF_POWER->DCDCEN=1;   
-    
-def initializeClocks():    
-    machine.mem32[_NRF_CLOCK___TASKS_HFCLKSTART] = 1 # activate the high frequency crystal oscillator
-    # wait until high frequency clock start is confirmed
-    while (machine.mem32[_NRF_CLOCK___EVENTS_HFCLKSTARTED] == 0):
-        True
-    # ASERTION: High frequency clock now activated and running
-
-def initializeRxMode():        
-    machine.mem32[_NRF_RADIO___BASE0] = _my_baseAddress
-    machine.mem32[_NRF_RADIO___PREFIX0] = _my_prefixAddress
-
-    machine.mem32[_NRF_RADIO___TASKS_DISABLE] = 1  # DISABLE the radio to establish a known state.
-    while (machine.mem32[_NRF_RADIO___STATE] != 0):  # wait until radio is DISABLED (i.e. STATE=0);
-        True
-    machine.mem32[_NRF_RADIO___TASKS_RXEN] = 1  # turn on the radio transmitter and shift into RXIDLE.
-    while (machine.mem32[_NRF_RADIO___EVENTS_READY] == 0):  # Busy-wait.  After event READY, radio shall be in state TXIDLE.
-        True    
-    # ASSERTION: now ready to receive a packet.
-
-
-def initializeTxMode():
-    machine.mem32[_NRF_RADIO___BASE0] = _target_baseAddress
-    machine.mem32[_NRF_RADIO___PREFIX0] = _target_prefixAddress
-
-
-    machine.mem32[_NRF_RADIO___TASKS_DISABLE] = 1  # DISABLE the radio to establish a known state.
-    while (machine.mem32[_NRF_RADIO___STATE] != 0):  # wait until radio is DISABLED (i.e. STATE=0);
-        True
-    machine.mem32[_NRF_RADIO___TASKS_TXEN] = 1  # turn on the radio transmitter and shift into TXIDLE.
-    while (machine.mem32[_NRF_RADIO___EVENTS_READY] == 0):  # Busy-wait.  After event READY, radio shall be in state TXIDLE.
-        True    
-    # ASSERTION: now ready to transmit a packet.
-
 def initializeRadio():
-    # value must be between 0 and 100
-    machine.mem32[_NRF_RADIO___FREQUENCY] = 98  # 2498Mhz.  
-    
-    # Enable data whitening.
-    # Base address is 4 bytes long (possible range is 2 to 4) and 
-    # max size of payload is 255,and 0 bytes of static length payload
-    machine.mem32[_NRF_RADIO___PCNF1] = 0x020400FF  # 0x020400FF
-    # Use an 8-byte preamble, and LENGTH can be 8 bits long.  S0 and S1 are all zero bits long.
-    machine.mem32[_NRF_RADIO___PCNF0] = 0x03000008
-    
-    machine.mem32[_NRF_RADIO___MODE] = 1  # set 2Mbps datarate.
-    machine.mem32[_NRF_RADIO___MODECNF0] = 1  # enable fast ramp-up of radio from DISABLED state.
-    
-    machine.mem32[_NRF_RADIO___CRCCNF] = 3  # CRC will be 3 (3 is max)  bytes and is computed including the address field
-    machine.mem32[_NRF_RADIO___PACKETPTR] = radioBuffer_address  # pointer to the payload in radioBuffer
-    
-    machine.mem32[_NRF_RADIO___RXADDRESSES] = 1  # receive on logical address 0.  Not important for transmitting.
-    machine.mem32[_NRF_RADIO___TXPOWER] = 8  # set to 8db transmit power, which is the maximum. 
-    
+    radioConfigure(_my_baseAddress, _my_prefixAddress, _target_baseAddress, _target_prefixAddress)
+    resetLink()  # FREQUENCY, MODE and TXPOWER, see setLink()
+
+# Every radio packet is a compact binary frame laid out in radioBuffer as:
+#   byte  0     LENGTH (number of bytes that follow; read by the radio hardware)
+#   byte  1     frame type
+#   bytes 2..3  sequence number (16 bit, little endian)
+#   bytes 4..   payload (up to 252 bytes, so the whole 255 byte radio payload is used)
+_FRAME_LENGTH = const(0)
+_FRAME_TYPE = const(1)
+_FRAME_SEQ = const(2)
+_FRAME_PAYLOAD = const(4)
+_FRAME_HEADER_SIZE = const(3)  # type and sequence number bytes counted by LENGTH
+_MAX_PAYLOAD = const(252)
+_FRAME_SIZE = const(256)  # a whole frame as stored in an image, see openImage()
+
+_FILE_CHUNK_SIZE = const(512)  # bytes read at a time when hashing or copying files
+
+# flags byte sent after the digest in the END frame
+_IMAGE_MPY = const(0x01)  # the file is precompiled .mpy bytecode rather than Python source
+_IMAGE_COMPRESSED = const(0x02)  # the file is sent zlib compressed; the digest is of the inflated file
+_IMAGE_DELTA = const(0x04)  # the file is a delta against the receiver's main.py, see writeDelta()
+_IMAGE_BUNDLE = const(0x08)  # the file is a bundle of several files, see writeBundle()
+
+# A bundle manifest (e.g. bundle.txt) lists the files of a release, one line each: the name
+# of the file here, then the name to install it under on the receiver if that differs, e.g.
+#   update.txt main.py
+#   sensors.py
+#   lib/display.py
+# The receiver is asked about each file in turn (see receiverHasFile()) and only the ones it
+# does not have already are sent, together, as one bundle.  _MAX_TARGET_NAME is what fits in
+# a FILE_QUERY frame.
+_BUNDLE_FILE = "update.b"
+_MAX_TARGET_NAME = const(216)  # _MAX_PAYLOAD - 36
+
+# An image built on a host by host/buildImage.py (a name ending in .ota) holds the update
+# already cut into frames, with its SHA-256 and block checks taken there, so sending it is
+# only a matter of copying frames into the window slots.  It starts with a header:
+#   0   _IMAGE_MAGIC
+#   4   the flags for the END frame (_IMAGE_MPY, _IMAGE_COMPRESSED, _IMAGE_BUNDLE), then 3 bytes of 0
+#   8   bytes of payload in its DATA frames, the size of the update as sent
+#   12  size of the file the receiver ends up with
+#   16  offset of frame 0, a multiple of _FRAME_SIZE
+#   20  SHA-256 of the file the receiver ends up with
+# followed by the check (see checksumPayload()) of each whole block of _CHECK_BLOCK DATA
+# frames, 4 bytes each.  From frame 0 on, each frame takes _FRAME_SIZE bytes, LENGTH first
+# and padded with 0; the last one is the END frame.  Numbers are little endian.  Must match
+# host/buildImage.py.
+_IMAGE_MAGIC = b"OTA1"
+_IMAGE_HEADER_SIZE = const(52)
+imageChecks = b""  # the block checks of the image being sent, see openImage()
+imageFramesOffset = 0
+
+# what the receiver says it can take, in its CAPABILITIES frame
+_CAN_INFLATE = const(0x01)
+_CAN_DELTA = const(0x02)
+_CAN_SET_LINK = const(0x04)
+_CAN_BUNDLE = const(0x08)
+_NO_IMAGE = const(0xFFFFFFFF)  # size the receiver reports when nothing is installed
+
+# History window of the compressed stream, 2**_DEFLATE_WBITS bytes.  The receiver inflates
+# with a window this size, so a file compressed on a host must not use a larger one.
+_DEFLATE_WBITS = const(10)
+
+# Delta updates.  The receiver splits its main.py into blocks (see fileBlocks()) and sends
+# the signature of each block, a truncated SHA-256 and the length.  The new file is split the
+# same way and sent as a delta made of these instructions:
+#   _DELTA_COPY  offset (4 bytes) and length (2 bytes) of bytes to copy from the current main.py
+#   _DELTA_DATA  length (2 bytes) followed by that many new bytes
+_DELTA_MIN_BLOCK = const(128)
+_DELTA_MAX_BLOCK = const(1024)
+_DELTA_HASH_SIZE = const(4)
+_SIGNATURE_ENTRY_SIZE = const(6)  # block hash and 2 byte length
+_SIGNATURE_ENTRIES_PER_FRAME = const(42)  # _MAX_PAYLOAD // _SIGNATURE_ENTRY_SIZE
+_DELTA_COPY = const(1)
+_DELTA_DATA = const(2)
+
+_FRAME_DATA = const(0)  # payload is the next chunk of the file
+_FRAME_END = const(1)  # payload is the 32 byte SHA-256 digest of the whole file and a flags byte
+_FRAME_ACK = const(2)  # sent by the receiver, see processAck()
+_FRAME_SIGNATURE_REQUEST = const(3)  # asks for the signature entries from the one numbered seq
+_FRAME_SIGNATURE = const(4)  # sent by the receiver, see fetchSignature()
+_FRAME_POLL = const(5)  # broadcast only: seq is the END frame's, payload the number of NACK slots
+_FRAME_NACK = const(6)  # broadcast only: sent by a receiver that is missing frames
+_FRAME_PARITY = const(7)  # XOR of a group of full DATA frames; seq is the group's first, see addToParity()
+_FRAME_RESUME = const(8)  # payload is the size (4 bytes), flags and SHA-256 (32 bytes) of the update
+_FRAME_RESUME_POINT = const(9)  # sent by the receiver, see resumeTransfer()
+_FRAME_START = const(10)  # the transfer starts at frame seq; answered with an ACK
+_FRAME_HELLO = const(11)  # asks what the receiver runs and can take; payload is the image flags
+_FRAME_CAPABILITIES = const(12)  # sent by the receiver, see helloReceiver()
+_FRAME_SET_LINK = const(13)  # both nodes move to the link setting in the payload, see changeLink()
+_FRAME_FILE_QUERY = const(14)  # asks whether the receiver has a file, see receiverHasFile()
+_FRAME_FILE_STATE = const(15)  # sent by the receiver: seq is the query's, payload 1 if it has the file
+_FRAME_TYPE_MASK = const(0x7F)
+_FLAG_ACK_REQUEST = const(0x80)  # set in the type byte of the last frame of a burst
+
+# Selective-repeat sliding window: up to _WINDOW_SIZE frames are sent back to back before
+# waiting for an acknowledgement, and only the frames the receiver reports missing are resent.
+# Must not be larger than the receiver's window (at most 32, the width of the ACK bitmap).
+_WINDOW_SIZE = const(8)
+# Idle time left between frames of a burst so the receiver can re-arm its radio.
+_FRAME_GAP_US = const(150)
+
+# The ACK timeout (RTO) follows the measured round trip time from the end of a poll frame
+# to its ACK: RTO = smoothed RTT + 4 * RTT variance, as in TCP (RFC 6298).  Round trips of
+# retransmitted polls are not sampled (Karn's algorithm) and every timeout doubles the RTO.
+_RTO_INITIAL_US = const(20000)
+_RTO_MIN_US = const(1000)
+_RTO_MAX_US = const(100000)
+_MAX_TIMEOUTS = const(30)  # give up after this many timeouts in a row
+
+# Broadcast updates, see broadcastUpdate().  After each round of frames the receivers that
+# are missing any answer a POLL with a NACK, each in one of the slots that follow it.
+_NACK_SLOTS = const(8)
+_NACK_SLOT_US = const(3000)  # long enough for a full NACK frame and the turnaround
+_NACK_GUARD_US = const(1000)  # before the first slot
+_QUIET_ROUNDS = const(8)  # finished after this many polls in a row that no receiver answered
+_MAX_ROUNDS = const(100)
+_GROUP_MAX_FRAMES = const(4096)  # receivers keep one bit per frame
+
+# Link adaptation (adapt=True).  Each link level is a radio MODE and TXPOWER, from the fastest
+# and quietest to the slowest and most robust; the coded (BLE long range) modes trade speed
+# for range.  After every _LINK_PERIOD frames sent the transmitter weighs the frames it lost
+# against the rate of the next level down and moves one level if that would deliver more, or
+# tries one level up after a run of periods without loss.
+# Channel agility, also with adapt=True.  Before sending, both nodes measure the noise on each
+# of _CHANNELS and the transfer moves to the quietest, keeping the next quietest as a backup
+# (see pickChannels()).  A period that loses _CHANNEL_HOP_PERCENT or more swaps the two.
+# A link setting packs the level in bits 0-2, the channel in bits 3-4 and the backup channel
+# in bits 5-6.  Both nodes move together, see changeLink().  While either hears nothing from
+# the other it undoes the last move after _LINK_PROBATION_MS and swaps to the backup channel
+# after _LINK_LOST_MS, so a move that one of them missed, a move that broke the link or a
+# channel that was jammed mid-transfer sorts itself out; see linkSilence().
+_LINK_MODES = (1, 1, 0, 6, 5)  # Nrf_2Mbit, Nrf_2Mbit, Nrf_1Mbit, Ble_LR500Kbit, Ble_LR125Kbit
+_LINK_POWERS = (0, 8, 8, 8, 8)  # dBm
+_LINK_RATES = (2000, 2000, 1000, 500, 125)  # kbit/s
+_LINK_LEVELS = const(5)  # must match the receiver, as must the three above
+_LINK_LEVEL_MASK = const(0x07)
+_LINK_DEFAULT = const(1)  # level 1, 2 Mbit/s at +8 dBm, on channel 0, where every transfer starts
+_LINK_PERIOD = const(32)  # frames
+_LINK_MARGIN_PERCENT = const(10)  # the next level down must be expected to do this much better
+_LINK_CLEAN_PERCENT = const(2)  # loss low enough to count towards trying the next level up
+_LINK_PATIENCE = const(2)  # clean periods before trying the next level up ...
+_LINK_MAX_PATIENCE = const(16)  # ... doubled, up to this, each time that level fails at once
+_LINK_PROBATION_MS = const(500)  # longer than any pause in a transfer; must match the receiver
+_LINK_LOST_MS = const(1000)  # must match the receiver
+# FREQUENCY values (MHz above 2400) of the channels; must match the receiver.  98 is above the
+# Wi-Fi channels; the others sit in the gaps around Wi-Fi channels 1, 6 and 11 and at the top
+# of the band.
+_CHANNELS = (98, 80, 50, 25)
+_CHANNEL_COUNT = const(4)
+_SCAN_SAMPLES = const(16)  # RSSI samples per channel, see radioNoise()
+_CHANNEL_HOP_PERCENT = const(20)
+_CHANNEL_HOP_PERIODS = const(4)  # periods between swaps
+linkSetting = _LINK_DEFAULT
+linkFallback = _LINK_DEFAULT  # the setting before the last move
+linkCleanPeriods = 0  # -1 during the first period after moving up
+linkPatience = _LINK_PATIENCE
+linkHopPeriods = _CHANNEL_HOP_PERIODS  # periods since the channels were last swapped
+
+smoothedRtt = 0  # microseconds; 0 until the first sample
+rttVariance = 0
+retransmissionTimeout = _RTO_INITIAL_US
+
+# One complete frame per window slot, kept intact until acknowledged, and one more in
+# _CONTROL_SLOT for the frames that are not part of the file, see requestReply().
+_CONTROL_SLOT = const(_WINDOW_SIZE)
+windowBuffers = []
+windowAddresses = []
+windowPayloads = []
+for i in range(_WINDOW_SIZE + 1):
+    windowBuffers.append(bytearray(radioBuffer_size))
+    windowAddresses.append(uctypes.addressof(windowBuffers[i]))
+    windowPayloads.append(memoryview(windowBuffers[i])[_FRAME_PAYLOAD:])
+windowAcked = bytearray(_WINDOW_SIZE)  # 1 once the receiver has the frame in that slot
+windowPending = bytearray(_WINDOW_SIZE)  # 1 if the frame in that slot still has to be (re)sent
+windowSent = bytearray(_WINDOW_SIZE)  # 1 once the frame in that slot has been transmitted
+
+# A unicast update is read from flash a block at a time, rather than a frame at a time, into
+# one of two read-ahead buffers, and the window slots are filled from it.  The next block is
+# read into the other buffer while waiting for an ACK, see waitForAck(), so reading the file
+# mostly overlaps the round trip.  A block is _CHECK_BLOCK payloads, or _CHECK_BLOCK whole
+# frames of an image from host/buildImage.py.
+_READ_BUFFER_SIZE = const(4096)  # _CHECK_BLOCK * _FRAME_SIZE
+readBuffers = (bytearray(_READ_BUFFER_SIZE), bytearray(_READ_BUFFER_SIZE))
+readPayloadBlocks = (memoryview(readBuffers[0])[0:4032], memoryview(readBuffers[1])[0:4032])
+readBlocks = readPayloadBlocks  # what each block is read into, see resetReadAhead()
+readChunk = _MAX_PAYLOAD  # bytes copied to a slot at a time
+readFill = [-1, -1]  # bytes read into each buffer, or -1 if it has not been read yet
+readingBuffer = 0  # the buffer the slots are being filled from
+readPosition = 0  # in that buffer
+
+# Forward error correction (fec=True).  Each group of _FEC_GROUP full DATA frames, starting at
+# a multiple of _FEC_GROUP, is followed by a PARITY frame holding the XOR of their payloads, so
+# the receiver can rebuild any one of them that is lost without waiting for a retransmission.
+# The PARITY frame is kept in the slot of its group's last frame and sent with that frame.
+_FEC_GROUP = const(4)  # must match the receiver
+parityBuffers = []
+parityAddresses = []
+parityPayloads = []
+for i in range(_WINDOW_SIZE):
+    parityBuffers.append(bytearray(radioBuffer_size))
+    parityAddresses.append(uctypes.addressof(parityBuffers[i]))
+    parityPayloads.append(memoryview(parityBuffers[i])[_FRAME_PAYLOAD:])
+parityReady = bytearray(_WINDOW_SIZE)  # 1 if the PARITY frame in that slot is still to be sent
+parityAccumulator = bytearray(_MAX_PAYLOAD)  # XOR of the frames of the group being read
+parityFull = False  # every frame of that group so far is a full one
 
-        
+# Block checks.  The receiver keeps a check (see checksumPayload()) of each _CHECK_BLOCK
+# frames of a unicast update as it writes them and reports the last block written in full in
+# every ACK.  The same check is taken here as the frames are read, for the last few blocks,
+# so a block that was put together wrongly stops the update as soon as it is acknowledged.
+_CHECK_BLOCK = const(16)  # must match the receiver
+_CHECK_BLOCKS = const(4)  # blocks whose check is kept; more than fit in the window
+blockCheck = bytearray(4)  # check of the block being read
+blockChecks = bytearray(4 * _CHECK_BLOCKS)  # check of block b at (b % _CHECK_BLOCKS) * 4
+blockNumbers = [-1] * _CHECK_BLOCKS
+
+# Telemetry for the last transfer, see stats().  The counters are kept in a list allocated
+# here and indexed by the constants below, so counting in the send loop does not allocate.
+_STAT_FRAMES_SENT = const(0)  # every frame transmitted, including resends, polls and parity
+_STAT_RETRANSMISSIONS = const(1)  # DATA and END frames sent again
+_STAT_ACK_TIMEOUTS = const(2)
+_STAT_NACKS = const(3)  # broadcast only
+_STAT_BYTES_SENT = const(4)  # size of the file sent, after compression or delta
+_STAT_PREPARE_MS = const(5)  # hashing, delta and compression, before the first frame
+_STAT_TRANSFER_MS = const(6)  # from the first frame to the end of the transfer
+_STAT_COUNT = const(7)
+statNames = ("framesSent", "retransmissions", "ackTimeouts", "nacksHeard", "bytesSent",
+             "prepareMs", "transferMs")
+statCounters = [0] * _STAT_COUNT
+# Round trip times used for the RTO, in buckets that double in width: bucket i counts
+# those under 1024 << i microseconds and the last bucket everything longer.
+_RTT_BUCKETS = const(8)
+rttHistogram = [0] * _RTT_BUCKETS
+
+# How much is printed during a transfer: 0 only results and errors, 1 also the stats at the
+# end, 2 also a line per ACK, timeout or broadcast round.  At 115200 baud a line takes longer
+# to print than a whole burst takes to send, so that is off unless asked for.
+_LOG_SUMMARY = const(1)
+_LOG_PACKETS = const(2)
+logLevel = _LOG_SUMMARY
 
 mv = memoryview(radioBuffer)
 
 def copyStringToRadioBuffer(s):
-    l = len(s)
-    mv[: l] = s.encode('utf8')[: l]
-    mv[l] = 0  
-
-def sendShortStrings(payloadCounter,theString,maxSubStringLength):
-    stringLength = len(theString)
-    if (stringLength > 0):
-        index = 0
-        maxIndex = stringLength + 1
-        while (index<maxIndex):
-            stopIndex = index + maxSubStringLength  
-            if (stopIndex > maxIndex):
-                stopIndex = maxIndex
-            payloadCounter = payloadCounter + 1
-            #print("payloadCounter=", payloadCounter)
-            payloadCounterString =  ("{:<10}".format(str(payloadCounter)))
-            #print("payloadCounterString = ", payloadCounterString)
-            stringSubset = theString[index:stopIndex]
-            txString=payloadCounterString + stringSubset
-            #print("txString = ", txString)
-            copyStringToRadioBuffer(txString)
-            index = stopIndex 
-            #print("Radio Buffer = ", radioBuffer)
-            transmissionSucceeded = False  #transmission not yet sent
-            while (not transmissionSucceeded):
-                print(txString)
-                initializeTxMode()
-                machine.mem32[_NRF_RADIO___EVENTS_END] = 0  #Clear Semaphore
-                while (machine.mem32[_NRF_RADIO___EVENTS_END] != 0): True  # wait
-                machine.mem32[_NRF_RADIO___TASKS_START] = 1  # Move from TXIDLE mode into TX mode to transmit the packet
-                while (machine.mem32[_NRF_RADIO___EVENTS_END] == 0): True  # busy-wait until packet is sent
-                initializeRxMode()
-                machine.mem32[_NRF_RADIO___EVENTS_CRCOK] = 0  # clear the semaphore
-                while (machine.mem32[_NRF_RADIO___EVENTS_CRCOK] != 0): True  # wait until Semaphore clear is confirmed
-                machine.mem32[_NRF_RADIO___TASKS_START] = 1  # Move from RXIDLE mode into RX mode to receive a packet
-                #currentTime=utime.time_ms()
-                #timeOutTime = currentTime + 200  # timeout in 200ms
-                #utime.sleep_ms(200)  # sleep for a 100ms after transmitting to give the receiver node time to acknowledge the transmission   
-                busyWaitCounter=0  
-                while ((not machine.mem32[_NRF_RADIO___EVENTS_CRCOK]) and (busyWaitCounter < 10000)): 
-                    busyWaitCounter = busyWaitCounter + 1
-  # wait until acknowledgement received or time out
-                if (machine.mem32[_NRF_RADIO___EVENTS_CRCOK]):
-                    transmissionSucceeded = True         
-                    print ("Transmitted: ", txString)
-
-        return payloadCounter
+    b = s.encode('utf8')[: _MAX_PAYLOAD]
+    l = len(b)
+    mv[_FRAME_PAYLOAD : _FRAME_PAYLOAD + l] = b
+    radioBuffer[_FRAME_LENGTH] = _FRAME_HEADER_SIZE + l
+    radioBuffer[_FRAME_TYPE] = _FRAME_DATA
+    radioBuffer[_FRAME_SEQ] = 0
+    radioBuffer[_FRAME_SEQ + 1] = 0
+
+def setFrameHeader(buffer, frameType, seq, payloadLength):
+    buffer[_FRAME_LENGTH] = _FRAME_HEADER_SIZE + payloadLength
+    buffer[_FRAME_TYPE] = frameType
+    buffer[_FRAME_SEQ] = seq & 0xFF
+    buffer[_FRAME_SEQ + 1] = (seq >> 8) & 0xFF
+
+def hashPayload(theHash, slot, payloadLength):
+    # straight from the window slot; only the short last frame of a file needs a slice
+    if (payloadLength == _MAX_PAYLOAD):
+        theHash.update(windowPayloads[slot])
+    else:
+        theHash.update(windowPayloads[slot][0:payloadLength])
+
+def transmitFrame(slot, requestAck):
+    # Transmit straight from the window slot.  The radio must be DISABLED.  A frame that asks
+    # for an ACK leaves the radio listening for it in radioBuffer.
+    buffer = windowBuffers[slot]
+    if (requestAck):
+        buffer[_FRAME_TYPE] = buffer[_FRAME_TYPE] | _FLAG_ACK_REQUEST
+        radioTransmit(windowAddresses[slot], radioBuffer_address)
+    else:
+        buffer[_FRAME_TYPE] = buffer[_FRAME_TYPE] & _FRAME_TYPE_MASK
+        radioSend(windowAddresses[slot])
+    statCounters[_STAT_FRAMES_SENT] = statCounters[_STAT_FRAMES_SENT] + 1
+
+@micropython.viper
+def copyPayload(destination: ptr8, source: ptr8, length: int):
+    i = 0
+    while (i < length):
+        destination[i] = source[i]
+        i = i + 1
+
+@micropython.viper
+def copyPayloadFrom(destination: ptr8, source: ptr8, offset: int, length: int):
+    i = 0
+    while (i < length):
+        destination[i] = source[offset + i]
+        i = i + 1
+
+@micropython.viper
+def xorPayload(destination: ptr8, source: ptr8, length: int):
+    i = 0
+    while (i < length):
+        destination[i] = destination[i] ^ source[i]
+        i = i + 1
+
+@micropython.viper
+def checksumPayload(check: ptr8, payload: ptr8, length: int):
+    # Adds length bytes of payload to check, a Fletcher checksum: two 16 bit sums, of the
+    # bytes and of the running first sum, kept little endian in its 4 bytes.  Must match
+    # the receiver.
+    a = check[0] | (check[1] << 8)
+    b = check[2] | (check[3] << 8)
+    i = 0
+    while (i < length):
+        a = (a + payload[i]) & 0xFFFF
+        b = (b + a) & 0xFFFF
+        i = i + 1
+    check[0] = a & 0xFF
+    check[1] = a >> 8
+    check[2] = b & 0xFF
+    check[3] = b >> 8
+
+def resetBlockChecks():
+    i = 0
+    while (i < 4):
+        blockCheck[i] = 0
+        i = i + 1
+    i = 0
+    while (i < _CHECK_BLOCKS):
+        blockNumbers[i] = -1
+        i = i + 1
+
+def addToBlockCheck(slot, seq, payloadLength):
+    # called for each DATA frame as it is read into its slot, in order
+    checksumPayload(blockCheck, windowPayloads[slot], payloadLength)
+    if (seq % _CHECK_BLOCK == _CHECK_BLOCK - 1):
+        block = seq // _CHECK_BLOCK
+        i = block % _CHECK_BLOCKS
+        blockNumbers[i] = block
+        j = 0
+        while (j < 4):
+            blockChecks[i * 4 + j] = blockCheck[j]
+            blockCheck[j] = 0
+            j = j + 1
+
+def useImageBlockCheck(seq):
+    # like addToBlockCheck(), for a frame of an image, whose checks were taken on the host
+    if (seq % _CHECK_BLOCK == _CHECK_BLOCK - 1):
+        block = seq // _CHECK_BLOCK
+        i = block % _CHECK_BLOCKS
+        blockNumbers[i] = block
+        j = 0
+        while (j < 4):
+            blockChecks[i * 4 + j] = imageChecks[block * 4 + j]
+            j = j + 1
+
+def ackBlockCheckFails():
+    # True if the block check in the ACK in radioBuffer differs from the one taken here
+    if (radioBuffer[_FRAME_LENGTH] < _FRAME_HEADER_SIZE + 10):
+        return False  # the receiver sent no check
+    block = radioBuffer[_FRAME_PAYLOAD + 4] | (radioBuffer[_FRAME_PAYLOAD + 5] << 8)
+    i = block % _CHECK_BLOCKS
+    if (blockNumbers[i] != block):
+        return False  # no block written yet, or a stale ACK
+    j = 0
+    while (j < 4):
+        if (radioBuffer[_FRAME_PAYLOAD + 6 + j] != blockChecks[i * 4 + j]):
+            return True
+        j = j + 1
+    return False
+
+def addToParity(slot, seq, payloadLength):
+    # Called for each DATA frame as it is read into its slot, in order.  Once the last frame of
+    # a group of full frames is in, that group's PARITY frame is made ready in the same slot.
+    global parityFull
+    if (seq % _FEC_GROUP == 0):
+        copyPayload(parityAccumulator, windowPayloads[slot], _MAX_PAYLOAD)
+        parityFull = True
+    else:
+        xorPayload(parityAccumulator, windowPayloads[slot], _MAX_PAYLOAD)
+    if (payloadLength != _MAX_PAYLOAD):
+        parityFull = False  # the end of the file; this group gets no parity
+    if ((seq % _FEC_GROUP == _FEC_GROUP - 1) and parityFull):
+        copyPayload(parityPayloads[slot], parityAccumulator, _MAX_PAYLOAD)
+        setFrameHeader(parityBuffers[slot], _FRAME_PARITY, seq - _FEC_GROUP + 1, _MAX_PAYLOAD)
+        parityReady[slot] = 1
+
+def transmitParity(slot):
+    parityReady[slot] = 0
+    radioSend(parityAddresses[slot])
+    statCounters[_STAT_FRAMES_SENT] = statCounters[_STAT_FRAMES_SENT] + 1
+
+def sendBurst(base, nextSeq, windowSize):
+    # Send every pending frame in the window back to back.  The last one asks the receiver
+    # for an acknowledgement.  Returns the sequence number of that last frame, or -1.
+    lastSeq = nextSeq - 1
+    while ((lastSeq >= base) and (not windowPending[lastSeq % windowSize])):
+        lastSeq = lastSeq - 1
+    if (lastSeq < base):
+        return -1
+    firstFrame = True
+    seq = base
+    while (seq <= lastSeq):
+        slot = seq % windowSize
+        if (windowPending[slot]):
+            if (not firstFrame):
+                utime.sleep_us(_FRAME_GAP_US)
+            if (parityReady[slot] and (seq == lastSeq)):
+                transmitParity(slot)  # before the poll, which the receiver answers straight away
+                utime.sleep_us(_FRAME_GAP_US)
+            transmitFrame(slot, seq == lastSeq)
+            if (windowSent[slot]):
+                statCounters[_STAT_RETRANSMISSIONS] = statCounters[_STAT_RETRANSMISSIONS] + 1
+            if (parityReady[slot]):
+                utime.sleep_us(_FRAME_GAP_US)
+                transmitParity(slot)
+            windowPending[slot] = 0
+            windowSent[slot] = windowSent[slot] + 1
+            firstFrame = False
+        seq = seq + 1
+    return lastSeq
+
+def updateRto(rtt):
+    global smoothedRtt, rttVariance, retransmissionTimeout
+    if (smoothedRtt == 0):
+        smoothedRtt = rtt
+        rttVariance = rtt >> 1
+    else:
+        error = rtt - smoothedRtt
+        smoothedRtt = smoothedRtt + (error >> 3)  # gain 1/8
+        if (error < 0):
+            error = -error
+        rttVariance = rttVariance + ((error - rttVariance) >> 2)  # gain 1/4
+    retransmissionTimeout = smoothedRtt + 4 * rttVariance
+    if (retransmissionTimeout < _RTO_MIN_US):
+        retransmissionTimeout = _RTO_MIN_US
+    if (retransmissionTimeout > _RTO_MAX_US):
+        retransmissionTimeout = _RTO_MAX_US
+
+def countRtt(rtt):
+    bucket = 0
+    rtt = rtt >> 10
+    while ((rtt > 0) and (bucket < _RTT_BUCKETS - 1)):
+        rtt = rtt >> 1
+        bucket = bucket + 1
+    rttHistogram[bucket] = rttHistogram[bucket] + 1
+
+def resetRto():
+    global smoothedRtt, rttVariance, retransmissionTimeout
+    smoothedRtt = 0
+    rttVariance = 0
+    retransmissionTimeout = _RTO_INITIAL_US
+
+def backOffRto():
+    global retransmissionTimeout
+    statCounters[_STAT_ACK_TIMEOUTS] = statCounters[_STAT_ACK_TIMEOUTS] + 1
+    retransmissionTimeout = retransmissionTimeout * 2
+    if (retransmissionTimeout > _RTO_MAX_US):
+        retransmissionTimeout = _RTO_MAX_US
+
+def waitForAck(timeoutUs, frameType=_FRAME_ACK, minPayload=4, f=None):
+    # The radio is already listening, see transmitFrame().  Returns the round trip time in
+    # microseconds once a valid ACK (or other reply of frameType) is in radioBuffer (the
+    # radio is then DISABLED again), or -1 if none arrived within timeoutUs.  If f is given,
+    # its next block is read ahead while the reply is on its way, see readAhead().
+    startTime = utime.ticks_us()
+    elapsed = 0
+    while (elapsed < timeoutUs):
+        state = radioReceived()
+        if (state != 0):  # a packet has arrived
+            if ((state > 0) and
+                    ((radioBuffer[_FRAME_TYPE] & _FRAME_TYPE_MASK) == frameType) and
+                    (radioBuffer[_FRAME_LENGTH] >= _FRAME_HEADER_SIZE + minPayload)):
+                return elapsed
+            radioListen(radioBuffer_address)  # not an ACK, keep listening
+        elif (f is not None):
+            readAhead(f)
+            f = None
+        elapsed = utime.ticks_diff(utime.ticks_us(), startTime)
+    radioDisable()
+    return -1
+
+def resetReadAhead(framed):
+    # framed: f is an image of whole frames rather than a file of payloads
+    global readBlocks, readChunk, readingBuffer, readPosition
+    if (framed):
+        readBlocks = readBuffers
+        readChunk = _FRAME_SIZE
+    else:
+        readBlocks = readPayloadBlocks
+        readChunk = _MAX_PAYLOAD
+    readFill[0] = -1
+    readFill[1] = -1
+    readingBuffer = 0
+    readPosition = 0
+
+def readAhead(f):
+    # Reads the next block of f into the buffer the slots are not being filled from, unless
+    # it holds one already or the file has ended.
+    spare = 1 - readingBuffer
+    if ((readFill[spare] < 0) and (readFill[readingBuffer] == readChunk * _CHECK_BLOCK)):
+        readFill[spare] = f.readinto(readBlocks[spare])
+
+def readNext(f, destination):
+    # Copies the next payload of f, or the next frame of an image, into destination (a
+    # window slot's payload or whole buffer) from the read-ahead buffers, reading f first if
+    # they have run dry.  Returns its length, 0 once the file has ended.
+    global readingBuffer, readPosition
+    if (readFill[readingBuffer] < 0):  # the first block
+        readFill[readingBuffer] = f.readinto(readBlocks[readingBuffer])
+    if (readPosition == readFill[readingBuffer]):
+        if (readFill[readingBuffer] < readChunk * _CHECK_BLOCK):
+            return 0  # that was the last block
+        readFill[readingBuffer] = -1
+        readingBuffer = 1 - readingBuffer
+        readPosition = 0
+        if (readFill[readingBuffer] < 0):  # not read ahead in time
+            readFill[readingBuffer] = f.readinto(readBlocks[readingBuffer])
+    length = readFill[readingBuffer] - readPosition
+    if (length > readChunk):
+        length = readChunk
+    copyPayloadFrom(destination, readBuffers[readingBuffer], readPosition, length)
+    readPosition = readPosition + length
+    return length
+
+def processAck(base, nextSeq, pollSeq, windowSize):
+    # An ACK carries the receiver's next expected sequence number (every earlier frame has
+    # arrived) and a 32 bit bitmap of the frames after it that it already holds, then the
+    # receiver's last block check (see ackBlockCheckFails()).
+    # Anything sent up to the poll frame that is still missing is queued to be sent again.
+    # Returns the new window base.
+    cumulative = radioBuffer[_FRAME_SEQ] | (radioBuffer[_FRAME_SEQ + 1] << 8)
+    bitmap = (radioBuffer[_FRAME_PAYLOAD] | (radioBuffer[_FRAME_PAYLOAD + 1] << 8) |
+              (radioBuffer[_FRAME_PAYLOAD + 2] << 16) | (radioBuffer[_FRAME_PAYLOAD + 3] << 24))
+    seq = base
+    while (seq < nextSeq):
+        slot = seq % windowSize
+        if ((seq < cumulative) or ((seq > cumulative) and ((bitmap >> (seq - cumulative - 1)) & 1))):
+            windowAcked[slot] = 1
+            windowPending[slot] = 0
+        elif ((seq <= pollSeq) and (not windowAcked[slot])):
+            windowPending[slot] = 1
+        seq = seq + 1
+    while ((base < nextSeq) and windowAcked[base % windowSize]):
+        base = base + 1
+    return base
 
 
 def send(theString):
@@ -203,9 +589,7 @@ def send(theString):
         # theString = theString[0:radioBuffer_size] # then cut it down the maximum length allowed
     copyStringToRadioBuffer(theString)
     print("Radio Buffer = ", radioBuffer)
-    machine.mem32[_NRF_RADIO___EVENTS_END] = const(0)
-    machine.mem32[_NRF_RADIO___TASKS_START] = 1  # Move from TXIDLE mode into TX mode to transmit the packet
-    while (machine.mem32[_NRF_RADIO___EVENTS_END] == const(0)): True  # busy-wait until packet is sent
+    radioSend(radioBuffer_address)
     print ("Finished transmitting: " + theString)
 
 
@@ -217,38 +601,887 @@ def printFile(theFileName):
         lineOfFile = f.read()
     f.close()
 
-def transmitUpdate():
+def openInflater(f):
+    # Newer firmware has the deflate module, older firmware has uzlib.  Either one inflates
+    # from the stream through a window of 2**_DEFLATE_WBITS bytes.
+    try:
+        import deflate
+        return deflate.DeflateIO(f, deflate.ZLIB, _DEFLATE_WBITS)
+    except ImportError:
+        import uzlib
+        return uzlib.DecompIO(f, _DEFLATE_WBITS)
+
+def deflateFile(sourceFile, destinationFile, theHash=None):
+    # Compressing needs the deflate module built with compression support, which many
+    # firmware builds leave out.  Returns False if the file could not be compressed.
+    # The source is added to theHash, if there is one, as it is read.
+    try:
+        import deflate
+    except ImportError:
+        return False
+    s=open(sourceFile,"rb")
+    d=open(destinationFile,"wb")
+    compressed = True
+    try:
+        compressor = deflate.DeflateIO(d, deflate.ZLIB, _DEFLATE_WBITS)
+        chunk = s.read(_FILE_CHUNK_SIZE)
+        while chunk:
+            if (theHash is not None):
+                theHash.update(chunk)
+            compressor.write(chunk)
+            chunk = s.read(_FILE_CHUNK_SIZE)
+        compressor.close()  # flushes the end of the stream; d stays open
+    except (AttributeError, OSError):  # built without compression
+        compressed = False
+    s.close()
+    d.close()
+    return compressed
+
+def isBlockStart(line):
+    # a top-level line (not indented, blank or a comment) can start a new block
+    if (len(line) == 0):
+        return False
+    c = line[0]
+    return ((c != 0x20) and (c != 0x09) and (c != 0x0D) and (c != 0x0A) and (c != 0x23))
+
+def fileBlocks(f):
+    # Splits a file into the blocks used by delta updates.  A block ends before a top-level
+    # line once it holds _DELTA_MIN_BLOCK bytes, so blocks follow the functions of a source
+    # file and an edit only changes the blocks it touches; the blocks after it stay the same
+    # even if lines were added or removed.  No block is longer than _DELTA_MAX_BLOCK bytes.
+    # Must match the receiver.
+    block = b""
+    line = f.readline(_DELTA_MAX_BLOCK)
+    while line:
+        if (((len(block) >= _DELTA_MIN_BLOCK) and isBlockStart(line)) or
+                (len(block) + len(line) > _DELTA_MAX_BLOCK)):
+            yield block
+            block = b""
+        block = block + line
+        line = f.readline(_DELTA_MAX_BLOCK)
+    if (block):
+        yield block
+
+def blockKey(block):
+    # the form a block takes in the receiver's signature
+    return uhashlib.sha256(block).digest()[0:_DELTA_HASH_SIZE] + bytes((len(block) & 0xFF, len(block) >> 8))
+
+def fetchSignature():
+    # Asks the receiver for the signature of its main.py, a frame of entries at a time.
+    # Returns a dict from each block's signature entry to its offset in that file, or None
+    # if the receiver does not answer.
+    blocks = {}
+    offset = 0
+    entry = 0
+    timeouts = 0
+    while True:
+        setFrameHeader(windowBuffers[0], _FRAME_SIGNATURE_REQUEST, entry, 0)
+        transmitFrame(0, True)
+        if (waitForAck(retransmissionTimeout, _FRAME_SIGNATURE, 0) < 0):
+            backOffRto()
+            timeouts = timeouts + 1
+            if (timeouts >= _MAX_TIMEOUTS):
+                return None
+            continue
+        timeouts = 0
+        if ((radioBuffer[_FRAME_SEQ] | (radioBuffer[_FRAME_SEQ + 1] << 8)) != (entry & 0xFFFF)):
+            continue  # a late reply to an earlier request
+        count = (radioBuffer[_FRAME_LENGTH] - _FRAME_HEADER_SIZE) // _SIGNATURE_ENTRY_SIZE
+        i = 0
+        while (i < count):
+            p = _FRAME_PAYLOAD + i * _SIGNATURE_ENTRY_SIZE
+            key = bytes(radioBuffer[p : p + _SIGNATURE_ENTRY_SIZE])
+            if (key not in blocks):
+                blocks[key] = offset
+            offset = offset + (radioBuffer[p + 4] | (radioBuffer[p + 5] << 8))
+            i = i + 1
+        entry = entry + count
+        if (count < _SIGNATURE_ENTRIES_PER_FRAME):
+            return blocks
+
+def writeCopy(d, offset, length):
+    if (length > 0):
+        d.write(bytes((_DELTA_COPY, offset & 0xFF, (offset >> 8) & 0xFF, (offset >> 16) & 0xFF,
+                       (offset >> 24) & 0xFF, length & 0xFF, length >> 8)))
+
+def writeDelta(theFile, blocks, deltaFile):
+    # Writes the instructions that rebuild theFile from the receiver's main.py, whose blocks
+    # are in blocks (see fetchSignature()).  Blocks the receiver already has are copied,
+    # runs of them in one instruction; the rest are sent.  Returns the number of bytes copied
+    # and the SHA-256 of theFile, taken on the way.
+    f=open(theFile,"rb")
+    d=open(deltaFile,"wb")
+    copyOffset = 0
+    copyLength = 0
+    copied = 0
+    theHash = uhashlib.sha256()
+    for block in fileBlocks(f):
+        theHash.update(block)
+        offset = blocks.get(blockKey(block), -1)
+        if (offset >= 0):
+            copied = copied + len(block)
+            if ((copyLength > 0) and (copyOffset + copyLength == offset) and
+                    (copyLength + len(block) <= 0xFFFF)):
+                copyLength = copyLength + len(block)  # carries on from the last block copied
+            else:
+                writeCopy(d, copyOffset, copyLength)
+                copyOffset = offset
+                copyLength = len(block)
+        else:
+            writeCopy(d, copyOffset, copyLength)
+            copyLength = 0
+            d.write(bytes((_DELTA_DATA, len(block) & 0xFF, len(block) >> 8)))
+            d.write(block)
+    writeCopy(d, copyOffset, copyLength)
+    f.close()
+    d.close()
+    return (copied, ubinascii.hexlify(theHash.digest()).decode())
+
+def uint32At(data, position):
+    return data[position] | (data[position + 1] << 8) | (data[position + 2] << 16) | (data[position + 3] << 24)
+
+def openImage(theFile):
+    # Reads the header of an image from host/buildImage.py and keeps its block checks.
+    # Returns the size of the update as sent, the size of the file it installs, the SHA-256
+    # of that file and the flags, or None if theFile is not such an image.
+    global imageChecks, imageFramesOffset
+    try:
+        f=open(theFile,"rb")
+    except OSError:
+        return None
+    header = f.read(_IMAGE_HEADER_SIZE)
+    if ((len(header) < _IMAGE_HEADER_SIZE) or (header[0:4] != _IMAGE_MAGIC)):
+        f.close()
+        return None
+    size = uint32At(header, 8)
+    imageFramesOffset = uint32At(header, 16)
+    imageChecks = f.read((size + _MAX_PAYLOAD - 1) // _MAX_PAYLOAD // _CHECK_BLOCK * 4)
+    f.close()
+    return (size, uint32At(header, 12), ubinascii.hexlify(header[20:52]).decode(), header[4])
+
+def prepareImage(theFile, compress, delta, theHash=None):
+    # theFile may hold anything, including 0 bytes.  A name ending in .mpy is sent as
+    # precompiled bytecode, which the receiver installs as a module instead of main.py.
+    # A name ending in .z is a file already compressed on a host (zlib format, see
+    # _DEFLATE_WBITS), e.g. update.txt.z or app.mpy.z.  With compress=True the file is
+    # compressed here first, if this firmware can.  The receiver inflates it either way.
+    # With delta=True only the parts of the file that the receiver's main.py lacks are sent.
+    # Returns the file to send, the SHA-256 for the END frame and its flags, or None.
+    # theHash is the SHA-256 if the caller has it already.  If not, it is taken on the way
+    # through whatever pass already reads the whole file, and is None for a file sent as it
+    # is; broadcastUpdate() then takes the hash as the frames are read.
+    imageFlags = 0
+    imageName = theFile
+    if (theFile.endswith(".z")):
+        imageFlags = _IMAGE_COMPRESSED
+        imageName = theFile[:-2]
+        if (theHash is None):
+            theHash = computeFileHash(theFile, True)
+    else:
+        if (delta):
+            blocks = fetchSignature()
+            if (blocks is None):
+                print("The receiver did not send the signature of its main.py.  Update aborted.")
+                return None
+            copied, theHash = writeDelta(theFile, blocks, "update.d")
+            print("The receiver already has ", copied, " of the ", uos.stat(theFile)[6], " bytes")
+            imageFlags = _IMAGE_DELTA
+            theFile = "update.d"
+        if (compress):
+            sourceHash = None
+            if (theHash is None):
+                sourceHash = uhashlib.sha256()
+            if (deflateFile(theFile, "update.z", sourceHash) and (uos.stat("update.z")[6] < uos.stat(theFile)[6])):
+                print("Compressed ", uos.stat(theFile)[6], " bytes to ", uos.stat("update.z")[6])
+                imageFlags = imageFlags | _IMAGE_COMPRESSED
+                theFile = "update.z"
+                if (sourceHash is not None):
+                    theHash = ubinascii.hexlify(sourceHash.digest()).decode()
+            else:
+                print("Could not compress ", theFile, ", sending it as it is.")
+    if (imageName.endswith(".mpy")):
+        imageFlags = imageFlags | _IMAGE_MPY
+    return (theFile, theHash, imageFlags)
+
+def resetStats():
+    i = 0
+    while (i < _STAT_COUNT):
+        statCounters[i] = 0
+        i = i + 1
+    i = 0
+    while (i < _RTT_BUCKETS):
+        rttHistogram[i] = 0
+        i = i + 1
+
+def prepareStats(size, startTime):
+    # records the time taken to prepare the update and its size; returns the start of the transfer
+    now = utime.ticks_ms()
+    statCounters[_STAT_PREPARE_MS] = utime.ticks_diff(now, startTime)
+    statCounters[_STAT_BYTES_SENT] = size
+    return now
+
+def finishStats(startTime):
+    statCounters[_STAT_TRANSFER_MS] = utime.ticks_diff(utime.ticks_ms(), startTime)
+    if (logLevel >= _LOG_SUMMARY):
+        printStats()
+
+def stats():
+    # the counters of the last transfer by name, and the RTT histogram (see _RTT_BUCKETS)
+    result = {}
+    i = 0
+    while (i < _STAT_COUNT):
+        result[statNames[i]] = statCounters[i]
+        i = i + 1
+    result["rttHistogram"] = list(rttHistogram)
+    return result
+
+def printStats():
+    i = 0
+    while (i < _STAT_COUNT):
+        print(statNames[i], " = ", statCounters[i])
+        i = i + 1
+    print("rttHistogram = ", rttHistogram, " (round trips under about 1, 2, 4 ... 64 ms, then longer)")
+
+def requestReply(replyType, minPayload):
+    # Sends the frame in _CONTROL_SLOT until the receiver answers it with a frame of
+    # replyType, which is then in radioBuffer.  Returns False if it never does.
+    timeouts = 0
+    while (timeouts < _MAX_TIMEOUTS):
+        transmitFrame(_CONTROL_SLOT, True)
+        if (waitForAck(retransmissionTimeout, replyType, minPayload) >= 0):
+            return True
+        backOffRto()
+        timeouts = timeouts + 1
+    return False
+
+def radioUint32(position):
+    return (radioBuffer[_FRAME_PAYLOAD + position] | (radioBuffer[_FRAME_PAYLOAD + position + 1] << 8) |
+            (radioBuffer[_FRAME_PAYLOAD + position + 2] << 16) | (radioBuffer[_FRAME_PAYLOAD + position + 3] << 24))
+
+def helloReceiver(imageFlags):
+    # Asks the receiver what it runs and what it can take.  Returns the size and SHA-256
+    # digest of the image an update with imageFlags would replace, the longest payload and
+    # the window it takes, its free flash and heap in bytes, its _CAN_ bits and the noise it
+    # hears on each of _CHANNELS, or None if it does not answer.  With nothing installed the
+    # size is _NO_IMAGE and the digest all zeros.
+    setFrameHeader(windowBuffers[_CONTROL_SLOT], _FRAME_HELLO, 0, 1)
+    windowPayloads[_CONTROL_SLOT][0] = imageFlags
+    if (not requestReply(_FRAME_CAPABILITIES, 47 + _CHANNEL_COUNT)):
+        return None
+    return (radioUint32(0), bytes(radioBuffer[_FRAME_PAYLOAD + 4 : _FRAME_PAYLOAD + 36]),
+            radioBuffer[_FRAME_PAYLOAD + 36], radioBuffer[_FRAME_PAYLOAD + 37],
+            radioUint32(38), radioUint32(42), radioBuffer[_FRAME_PAYLOAD + 46],
+            bytes(radioBuffer[_FRAME_PAYLOAD + 47 : _FRAME_PAYLOAD + 47 + _CHANNEL_COUNT]))
+
+def readManifest(manifestFile):
+    # the (file here, name on the receiver) pairs listed in a bundle manifest, see _BUNDLE_FILE
+    files = []
+    f=open(manifestFile)
+    for line in f.read().split("\n"):
+        names = line.split()
+        if (len(names) == 1):
+            files.append((names[0], names[0]))
+        elif (len(names) > 1):
+            files.append((names[0], names[1]))
+    f.close()
+    return files
+
+def receiverHasFile(index, target, size, digest):
+    # Asks the receiver whether its file target is size bytes with this SHA-256 digest
+    # already.  index numbers the question, so that a late answer to an earlier one is not
+    # taken for this one's.  Returns True or False, or None if the receiver does not answer.
+    name = target.encode()
+    setFrameHeader(windowBuffers[_CONTROL_SLOT], _FRAME_FILE_QUERY, index, 36 + len(name))
+    windowPayloads[_CONTROL_SLOT][0] = size & 0xFF
+    windowPayloads[_CONTROL_SLOT][1] = (size >> 8) & 0xFF
+    windowPayloads[_CONTROL_SLOT][2] = (size >> 16) & 0xFF
+    windowPayloads[_CONTROL_SLOT][3] = (size >> 24) & 0xFF
+    windowPayloads[_CONTROL_SLOT][4:36] = digest
+    windowPayloads[_CONTROL_SLOT][36:36 + len(name)] = name
+    while (requestReply(_FRAME_FILE_STATE, 1)):
+        if ((radioBuffer[_FRAME_SEQ] | (radioBuffer[_FRAME_SEQ + 1] << 8)) == index):
+            return radioBuffer[_FRAME_PAYLOAD] == 1
+    return None
+
+def changedFiles(manifestFile):
+    # Returns the files of the manifest that the receiver does not have already, as (file
+    # here, name there, size, SHA-256) each, or None if they cannot be sent.
+    changed = []
+    index = 0
+    for source, target in readManifest(manifestFile):
+        try:
+            size = uos.stat(source)[6]
+        except OSError:
+            print("There is no ", source, " to send.  Update aborted.")
+            return None
+        if (len(target.encode()) > _MAX_TARGET_NAME):
+            print("The name ", target, " is too long to send.  Update aborted.")
+            return None
+        theHash = computeFileHash(source)
+        has = receiverHasFile(index, target, size, ubinascii.unhexlify(theHash))
+        if (has is None):
+            print("The receiver did not answer.  Update aborted.")
+            return None
+        if (not has):
+            changed.append((source, target, size, theHash))
+        index = index + 1
+    return changed
+
+def writeBundle(files, bundleFile):
+    # Writes the files (see changedFiles()) into one file for the receiver to take apart
+    # again: a line for each with its size, SHA-256 and name on the receiver, an empty line,
+    # then the files themselves one after the other.
+    d=open(bundleFile,"wb")
+    for source, target, size, theHash in files:
+        d.write((str(size) + " " + theHash + " " + target + "\n").encode())
+    d.write(b"\n")
+    for source, target, size, theHash in files:
+        s=open(source,"rb")
+        chunk = s.read(_FILE_CHUNK_SIZE)
+        while chunk:
+            d.write(chunk)
+            chunk = s.read(_FILE_CHUNK_SIZE)
+        s.close()
+    d.close()
+
+def resumeTransfer(f, size, imageFlags, theHash, framed):
+    # Tells the receiver which update is coming, by its size, flags and SHA-256, and asks how
+    # many whole blocks of it (see _CHECK_BLOCK) it kept from an earlier transfer of the same
+    # update that was cut short.  Those blocks are read here, to check them against the
+    # receiver's, and the transfer carries on after them.  An image (framed) has the checks
+    # already and is not read.  Returns the first frame to send, or -1 if the receiver does
+    # not answer.
+    setFrameHeader(windowBuffers[_CONTROL_SLOT], _FRAME_RESUME, 0, 37)
+    windowPayloads[_CONTROL_SLOT][0] = size & 0xFF
+    windowPayloads[_CONTROL_SLOT][1] = (size >> 8) & 0xFF
+    windowPayloads[_CONTROL_SLOT][2] = (size >> 16) & 0xFF
+    windowPayloads[_CONTROL_SLOT][3] = (size >> 24) & 0xFF
+    windowPayloads[_CONTROL_SLOT][4] = imageFlags
+    windowPayloads[_CONTROL_SLOT][5:37] = ubinascii.unhexlify(theHash)
+    if (not requestReply(_FRAME_RESUME_POINT, 32)):
+        return -1
+    blocks = radioBuffer[_FRAME_SEQ] | (radioBuffer[_FRAME_SEQ + 1] << 8)
+    startSeq = 0
+    if ((blocks > 0) and (blocks * _CHECK_BLOCK * _MAX_PAYLOAD <= size)):
+        held = bytes(radioBuffer[_FRAME_PAYLOAD : _FRAME_PAYLOAD + 32])
+        checks = uhashlib.sha256()
+        seq = 0
+        while (seq < blocks * _CHECK_BLOCK):
+            if (framed):
+                useImageBlockCheck(seq)
+            else:
+                payloadLength = f.readinto(windowPayloads[0])
+                addToBlockCheck(0, seq, payloadLength)
+            if (seq % _CHECK_BLOCK == _CHECK_BLOCK - 1):
+                i = (seq // _CHECK_BLOCK) % _CHECK_BLOCKS
+                checks.update(blockChecks[i * 4 : i * 4 + 4])
+            seq = seq + 1
+        if (checks.digest() == held):
+            startSeq = seq
+            if (framed):
+                f.seek(imageFramesOffset + startSeq * _FRAME_SIZE)
+        else:  # the receiver kept part of some other file
+            if (framed):
+                f.seek(imageFramesOffset)
+            else:
+                f.seek(0)
+            resetBlockChecks()
+    setFrameHeader(windowBuffers[_CONTROL_SLOT], _FRAME_START, startSeq, 0)
+    if ((not requestReply(_FRAME_ACK, 4)) or
+            ((radioBuffer[_FRAME_SEQ] | (radioBuffer[_FRAME_SEQ + 1] << 8)) != startSeq)):
+        return -1
+    return startSeq
+
+def setLink(setting):
+    # the radio must be DISABLED
+    global linkSetting
+    level = setting & _LINK_LEVEL_MASK
+    radioSetMode(_LINK_MODES[level], _LINK_POWERS[level], _CHANNELS[(setting >> 3) & 3])
+    linkSetting = setting
+
+def resetLink():
+    global linkFallback, linkCleanPeriods, linkPatience, linkHopPeriods
+    setLink(_LINK_DEFAULT)
+    linkFallback = _LINK_DEFAULT
+    linkCleanPeriods = 0
+    linkPatience = _LINK_PATIENCE
+    linkHopPeriods = _CHANNEL_HOP_PERIODS
+
+def swapChannels(setting):
+    # the same setting on its backup channel, with the channel in use as the backup
+    return (setting & _LINK_LEVEL_MASK) | (((setting >> 5) & 3) << 3) | (((setting >> 3) & 3) << 5)
+
+def pickChannels(receiverNoise):
+    # Returns the link setting on the quietest of _CHANNELS, with the next quietest as its
+    # backup.  A channel is as noisy as it is at the noisier of the two nodes; receiverNoise
+    # is what the receiver measured, see radioNoise().  Ties keep the channel in use.
+    level = linkSetting & _LINK_LEVEL_MASK
+    current = (linkSetting >> 3) & 3
+    quiet = bytearray(_CHANNEL_COUNT)
+    i = 0
+    while (i < _CHANNEL_COUNT):
+        quiet[i] = min(radioNoise(_CHANNELS[i], _SCAN_SAMPLES), receiverNoise[i])
+        i = i + 1
+    radioSetFrequency(_CHANNELS[current])
+    best = current
+    i = 0
+    while (i < _CHANNEL_COUNT):
+        if (quiet[i] > quiet[best]):
+            best = i
+        i = i + 1
+    backup = -1
+    i = 0
+    while (i < _CHANNEL_COUNT):
+        if ((i != best) and ((backup < 0) or (quiet[i] > quiet[backup]))):
+            backup = i
+        i = i + 1
+    return level | (best << 3) | (backup << 5)
+
+def changeLink(setting):
+    # Asks the receiver to move to setting and moves too once it has answered on the setting
+    # both are on now, which is kept to go back to.  Returns False if it did not answer.
+    global linkFallback
+    setFrameHeader(windowBuffers[_CONTROL_SLOT], _FRAME_SET_LINK, 0, 1)
+    windowPayloads[_CONTROL_SLOT][0] = setting
+    if ((not requestReply(_FRAME_SET_LINK, 1)) or (radioBuffer[_FRAME_PAYLOAD] != setting)):
+        return False
+    linkFallback = linkSetting
+    setLink(setting)
+    resetRto()  # round trips take longer or shorter at the new rate
+    if (logLevel >= _LOG_PACKETS):
+        printLink()
+    return True
+
+def moveLink(setting):
+    # without asking the receiver, see linkSilence()
+    global linkFallback
+    radioDisable()
+    setLink(setting)
+    linkFallback = setting
+    resetRto()
+    if (logLevel >= _LOG_PACKETS):
+        printLink()
+
+def printLink():
+    level = linkSetting & _LINK_LEVEL_MASK
+    print("Link: MODE ", _LINK_MODES[level], " at ", _LINK_POWERS[level], " dBm on ", 2400 + _CHANNELS[(linkSetting >> 3) & 3],
+          " MHz, backup ", 2400 + _CHANNELS[(linkSetting >> 5) & 3], " MHz")
+
+def adaptLink(sent, lost):
+    # Called after every _LINK_PERIOD frames or so with the frames sent and those lost
+    # (sent again, or timed out waiting for).
+    global linkCleanPeriods, linkPatience, linkHopPeriods
+    if (sent == 0):
+        return
+    loss = lost * 100 // sent
+    level = linkSetting & _LINK_LEVEL_MASK
+    onProbation = (linkCleanPeriods < 0)
+    slower = ((level < _LINK_LEVELS - 1) and
+              (_LINK_RATES[level] * (100 - loss) < _LINK_RATES[level + 1] * (100 - _LINK_MARGIN_PERCENT)))
+    if (slower and onProbation):  # the level was just tried and did not hold up
+        linkPatience = min(linkPatience * 2, _LINK_MAX_PATIENCE)
+        linkCleanPeriods = 0
+        changeLink(linkSetting + 1)
+        return
+    if ((loss >= _CHANNEL_HOP_PERCENT) and (linkHopPeriods >= _CHANNEL_HOP_PERIODS) and
+            (swapChannels(linkSetting) != linkSetting)):
+        # a busy channel rather than a long link, perhaps; the rate only changes if the backup
+        # channel does no better
+        linkHopPeriods = 0
+        linkCleanPeriods = 0
+        changeLink(swapChannels(linkSetting))
+        return
+    linkHopPeriods = linkHopPeriods + 1
+    if (slower):
+        linkCleanPeriods = 0
+        changeLink(linkSetting + 1)
+        return
+    if (onProbation):
+        linkCleanPeriods = 0
+        linkPatience = _LINK_PATIENCE
+    if (loss > _LINK_CLEAN_PERCENT):
+        linkCleanPeriods = 0
+        return
+    linkCleanPeriods = linkCleanPeriods + 1
+    if ((level > 0) and (linkCleanPeriods >= linkPatience) and changeLink(linkSetting - 1)):
+        linkCleanPeriods = -1
+
+def linkSilence(silence, stage):
+    # Called after a timeout with the milliseconds since the last ACK and the stage that
+    # silence has reached (0 after an ACK); returns the new stage.  The receiver does the same
+    # when it hears nothing, so both end up on the same setting again.
+    global linkCleanPeriods, linkPatience, linkHopPeriods
+    if ((stage == 0) and (silence >= _LINK_PROBATION_MS)):
+        if (linkSetting != linkFallback):
+            moveLink(linkFallback)
+            linkCleanPeriods = 0
+            linkPatience = min(linkPatience * 2, _LINK_MAX_PATIENCE)
+        return 1
+    if ((stage == 1) and (silence >= _LINK_LOST_MS)):
+        if (swapChannels(linkSetting) != linkSetting):
+            moveLink(swapChannels(linkSetting))
+            linkHopPeriods = 0  # the losses before the swap would swap straight back
+        return 2
+    return stage
+
+def setEndFrame(slot, seq, theHash, imageFlags):
+    windowPayloads[slot][0:32] = ubinascii.unhexlify(theHash)
+    windowPayloads[slot][32] = imageFlags
+    setFrameHeader(windowBuffers[slot], _FRAME_END, seq, 33)
+
+def transmitUpdate(windowSize=_WINDOW_SIZE, theFile="update.txt", compress=False, delta=False, fec=False, adapt=True,
+                   bundle=None):
+    # see prepareImage() and openImage() for what can be sent, _FEC_GROUP for fec and
+    # _LINK_MODES for adapt.  Nothing is sent if the receiver runs theFile already; compress,
+    # delta, windowSize and adapt are cut down to what the receiver can take.  bundle names a
+    # manifest (see _BUNDLE_FILE) to send the files it lists instead of theFile.
+    start()
+    startTime = utime.ticks_ms()
+    framed = (bundle is None) and theFile.endswith(".ota")  # an image of whole frames from host/buildImage.py
+    imageFlags = 0
+    theHash = None
+    if (bundle is not None):
+        imageFlags = _IMAGE_BUNDLE
+        delta = False  # a bundle only holds whole files
+    elif (framed):
+        image = openImage(theFile)
+        if (image is None):
+            print(theFile, " is not an image from buildImage.py.  Update aborted.")
+            return False
+        theHash = image[2]
+        imageFlags = image[3]
+        compress = False  # the image is sent as it was built
+        delta = False
+    else:
+        # read once here: the receiver may run it already, and the RESUME frame needs the hash
+        theHash = computeFileHash(theFile, theFile.endswith(".z"))
+        if (theFile.endswith(".mpy") or theFile.endswith(".mpy.z")):
+            imageFlags = _IMAGE_MPY
+    receiver = helloReceiver(imageFlags)
+    if (receiver is None):
+        print("The receiver did not answer.  Update aborted.")
+        return False
+    imageSize, imageDigest, maxPayload, receiverWindow, freeFlash, freeHeap, capabilities, receiverNoise = receiver
+    if (logLevel >= _LOG_SUMMARY):
+        print("The receiver has ", freeFlash, " bytes of flash and ", freeHeap, " bytes of heap free")
+    if (maxPayload < _MAX_PAYLOAD):
+        print("The receiver takes only ", maxPayload, " bytes a frame.  Update aborted.")
+        return False
+    if ((imageFlags & _IMAGE_BUNDLE) and (not (capabilities & _CAN_BUNDLE))):
+        print("The receiver cannot take bundles.  Update aborted.")
+        return False
+    if (bundle is not None):
+        files = changedFiles(bundle)
+        if (files is None):
+            return False
+        if (not files):
+            print("The receiver already has every file in ", bundle, ".  Nothing to send.")
+            return True
+        print("Sending ", len(files), " changed files of ", bundle)
+        writeBundle(files, _BUNDLE_FILE)
+        theFile = _BUNDLE_FILE
+        theHash = computeFileHash(theFile)
+    elif ((imageSize != _NO_IMAGE) and (theHash == ubinascii.hexlify(imageDigest).decode())):
+        print("The receiver already runs this update.  Nothing to send.")
+        return True
+    if (not (capabilities & _CAN_INFLATE)):
+        if (theFile.endswith(".z") or (imageFlags & _IMAGE_COMPRESSED)):
+            print("The receiver cannot inflate ", theFile, ".  Update aborted.")
+            return False
+        compress = False
+    if (not (capabilities & _CAN_DELTA)):
+        delta = False
+    if (not (capabilities & _CAN_SET_LINK)):
+        adapt = False
+    if (windowSize > receiverWindow):
+        windowSize = receiverWindow
+    # the receiver keeps the file as sent and, if it was compressed or a delta here, the file rebuilt from it
+    if (framed):
+        size, needed, theHash, imageFlags = image
+        if (imageFlags & _IMAGE_BUNDLE):  # and the files taken out of it
+            needed = needed + needed
+        if (imageFlags & _IMAGE_COMPRESSED):
+            needed = needed + size
+    else:
+        sourceFile = theFile
+        image = prepareImage(theFile, compress, delta, theHash)
+        if (image is None):
+            return False
+        theFile, theHash, imageFlags = image
+        size = uos.stat(theFile)[6]
+        needed = size
+        if (theFile != sourceFile):
+            needed = needed + uos.stat(sourceFile)[6]
+        if (bundle is not None):  # and the files taken out of it
+            imageFlags = imageFlags | _IMAGE_BUNDLE
+            needed = needed + uos.stat(sourceFile)[6]
+    startTime = prepareStats(size, startTime)
+    if (needed > freeFlash):
+        print("The update needs ", needed, " bytes of flash and the receiver has ", freeFlash, ".  Update aborted.")
+        return False
+    if (adapt):
+        if (not changeLink(pickChannels(receiverNoise))):
+            print("The receiver did not answer.  Update aborted.")
+            finishStats(startTime)
+            return False
+        if (logLevel >= _LOG_SUMMARY):
+            printLink()
+    if (windowSize > _WINDOW_SIZE):
+        windowSize = _WINDOW_SIZE
+    if (windowSize < 1):
+        windowSize = 1  # a window of one frame is plain stop-and-wait
+    base = 0  # oldest frame not yet acknowledged
+    nextSeq = 0  # next frame to be read from the file; each frame is numbered
+    endSeq = -1  # sequence number of the END frame once the whole file has been read
+    timeouts = 0  # timeouts in a row
+    parityReady[:] = bytes(_WINDOW_SIZE)
+    resetBlockChecks()
+    f=open(theFile,"rb")
+    if (framed):
+        f.seek(imageFramesOffset)
+    base = resumeTransfer(f, size, imageFlags, theHash, framed)
+    if (base < 0):
+        f.close()
+        print("The receiver did not answer.  Update aborted.")
+        finishStats(startTime)
+        return False
+    if (base > 0):
+        print("The receiver already has the first ", base * _MAX_PAYLOAD, " bytes, carrying on from there.")
+    nextSeq = base
+    resetReadAhead(framed)  # from where resumeTransfer() left f
+    lastAckTime = utime.ticks_ms()
+    linkStage = 0  # see linkSilence()
+    linkPeriodSent = statCounters[_STAT_FRAMES_SENT]
+    linkPeriodLost = statCounters[_STAT_RETRANSMISSIONS] + statCounters[_STAT_ACK_TIMEOUTS]
+    while ((endSeq < 0) or (base <= endSeq)):
+        # top up the window with new frames, from the read-ahead buffers
+        while ((endSeq < 0) and (nextSeq < base + windowSize)):
+            slot = nextSeq % windowSize
+            if (framed):  # the frame is ready to send as it is
+                payloadLength = 0
+                if ((readNext(f, windowBuffers[slot]) > 0) and
+                        ((windowBuffers[slot][_FRAME_TYPE] & _FRAME_TYPE_MASK) == _FRAME_DATA)):
+                    payloadLength = windowBuffers[slot][_FRAME_LENGTH] - _FRAME_HEADER_SIZE
+                    useImageBlockCheck(nextSeq)
+            else:
+                payloadLength = readNext(f, windowPayloads[slot])
+                if (payloadLength):
+                    setFrameHeader(windowBuffers[slot], _FRAME_DATA, nextSeq, payloadLength)
+                    addToBlockCheck(slot, nextSeq, payloadLength)
+            if (payloadLength):
+                if (fec):
+                    addToParity(slot, nextSeq, payloadLength)
+            else:
+                f.close()   
+                setEndFrame(slot, nextSeq, theHash, imageFlags)
+                endSeq = nextSeq
+            windowAcked[slot] = 0
+            windowPending[slot] = 1
+            windowSent[slot] = 0
+            nextSeq = nextSeq + 1
+        pollSeq = sendBurst(base, nextSeq, windowSize)
+        if (endSeq < 0):
+            rtt = waitForAck(retransmissionTimeout, _FRAME_ACK, 4, f)
+        else:
+            rtt = waitForAck(retransmissionTimeout)
+        if (rtt >= 0):
+            if (windowSent[pollSeq % windowSize] == 1):
+                updateRto(rtt)  # Karn: only time polls that were sent once
+                countRtt(rtt)
+            timeouts = 0
+            if (ackBlockCheckFails()):
+                if (endSeq < 0):
+                    f.close()
+                print("The receiver wrote block ", radioBuffer[_FRAME_PAYLOAD + 4] | (radioBuffer[_FRAME_PAYLOAD + 5] << 8),
+                      " of the file wrongly.  Update aborted.")
+                finishStats(startTime)
+                return False
+            base = processAck(base, nextSeq, pollSeq, windowSize)
+            if (logLevel >= _LOG_PACKETS):
+                print("Acknowledged up to frame ", base)
+            if (adapt):
+                lastAckTime = utime.ticks_ms()
+                linkStage = 0
+                if (statCounters[_STAT_FRAMES_SENT] - linkPeriodSent >= _LINK_PERIOD):
+                    lost = statCounters[_STAT_RETRANSMISSIONS] + statCounters[_STAT_ACK_TIMEOUTS]
+                    adaptLink(statCounters[_STAT_FRAMES_SENT] - linkPeriodSent, lost - linkPeriodLost)
+                    linkPeriodSent = statCounters[_STAT_FRAMES_SENT]
+                    linkPeriodLost = statCounters[_STAT_RETRANSMISSIONS] + statCounters[_STAT_ACK_TIMEOUTS]
+                    lastAckTime = utime.ticks_ms()
+        else:
+            backOffRto()
+            timeouts = timeouts + 1
+            if (adapt):
+                linkStage = linkSilence(utime.ticks_diff(utime.ticks_ms(), lastAckTime), linkStage)
+            if (timeouts >= _MAX_TIMEOUTS):
+                if (endSeq < 0):
+                    f.close()
+                print("No acknowledgement after ", timeouts, " tries.  Update aborted.")
+                finishStats(startTime)
+                return False
+            # Timed out: the ACK or the poll frame was lost.  Resend only the newest
+            # unacknowledged frame as a poll; the reply tells which others are missing.
+            seq = nextSeq - 1
+            while (windowAcked[seq % windowSize]):
+                seq = seq - 1
+            windowPending[seq % windowSize] = 1
+            if (logLevel >= _LOG_PACKETS):
+                print("No acknowledgement within ", retransmissionTimeout >> 1, "us, polling with frame ", seq)
+    print("Update transmitted.")
+    finishStats(startTime)
+    return True
+
+def transmit(windowSize=_WINDOW_SIZE, theFile="update.txt", compress=False, delta=False, fec=False, adapt=True,
+             bundle=None):
+    return transmitUpdate(windowSize, theFile, compress, delta, fec, adapt, bundle)
+
+def sendGroupFrames(f, resend, endSeq, theHash, imageFlags, fec, fileHash):
+    # Sends every frame whose bit is set in resend back to back, in order, and clears its bit.
+    # DATA frame seq is read from offset seq * _MAX_PAYLOAD.  With fec (only when every frame
+    # is being sent) each group is followed by its PARITY frame.  If fileHash is given (again
+    # only when every frame is being sent) the frames are added to it and the END frame gets
+    # its digest.  Returns the number of frames sent and the SHA-256 in the END frame.
+    sent = 0
+    seq = 0
+    while (seq <= endSeq):
+        if (resend[seq >> 3] == 0):
+            seq = (seq | 7) + 1  # none in this byte
+            continue
+        bit = 1 << (seq & 7)
+        if (resend[seq >> 3] & bit):
+            resend[seq >> 3] = resend[seq >> 3] & ~bit
+            if (seq == endSeq):
+                if (fileHash is not None):
+                    theHash = ubinascii.hexlify(fileHash.digest()).decode()
+                setEndFrame(0, seq, theHash, imageFlags)
+            else:
+                f.seek(seq * _MAX_PAYLOAD)
+                payloadLength = f.readinto(windowPayloads[0])
+                setFrameHeader(windowBuffers[0], _FRAME_DATA, seq, payloadLength)
+                if (fileHash is not None):
+                    hashPayload(fileHash, 0, payloadLength)
+                if (fec):
+                    addToParity(0, seq, payloadLength)
+            if (sent):
+                utime.sleep_us(_FRAME_GAP_US)
+            transmitFrame(0, False)
+            sent = sent + 1
+            if (parityReady[0]):
+                utime.sleep_us(_FRAME_GAP_US)
+                transmitParity(0)
+        seq = seq + 1
+    return (sent, theHash)
+
+def pollGroup(endSeq, slots, resend):
+    # Asks which frames the receivers are still missing.  Every receiver that is missing any
+    # answers in one of the slots after the POLL with a NACK: seq is the first frame it
+    # covers (a multiple of 8) and the payload is a bitmap of the frames missing from there
+    # on.  The NACKs are merged into resend.  Returns the number of NACKs heard.
+    setFrameHeader(windowBuffers[0], _FRAME_POLL, endSeq, 1)
+    windowPayloads[0][0] = slots
+    transmitFrame(0, True)  # leaves the radio listening for the NACKs
+    startTime = utime.ticks_us()
+    listenUs = _NACK_GUARD_US + (slots + 1) * _NACK_SLOT_US
+    heard = 0
+    while (utime.ticks_diff(utime.ticks_us(), startTime) < listenUs):
+        state = radioReceived()
+        if (state != 0):  # a packet has arrived
+            if ((state > 0) and ((radioBuffer[_FRAME_TYPE] & _FRAME_TYPE_MASK) == _FRAME_NACK)):
+                first = (radioBuffer[_FRAME_SEQ] | (radioBuffer[_FRAME_SEQ + 1] << 8)) >> 3
+                nack = bytes(radioBuffer[_FRAME_PAYLOAD : _FRAME_PAYLOAD + radioBuffer[_FRAME_LENGTH] - _FRAME_HEADER_SIZE])
+                radioListen(radioBuffer_address)  # the next slot may already be starting
+                i = 0
+                while ((i < len(nack)) and (first + i < len(resend))):
+                    resend[first + i] = resend[first + i] | nack[i]
+                    i = i + 1
+                heard = heard + 1
+            else:
+                radioListen(radioBuffer_address)
+    radioDisable()
+    return heard
+
+def broadcastUpdate(theFile="update.txt", compress=False, slots=_NACK_SLOTS, fec=False):
+    # Sends theFile to every receiver listening on the group address at once.  The whole
+    # file goes out once, then each round polls for NACKs and resends the union of the
+    # frames that any receiver is missing, so the time taken depends on the worst link and
+    # not on the number of receivers.  Finished once _QUIET_ROUNDS polls in a row go
+    # unanswered.  See prepareImage() for what can be sent; delta updates are per receiver
+    # and so are not available here.  With fec the first round carries PARITY frames too.
+    if (theFile.endswith(".ota")):
+        print("An image from buildImage.py is sent with transmit().  Update aborted.")
+        return False
     start()
-    theFile="update.txt"
-    payloadCounter = 0 #each payload is numbered
-    f=open(theFile)
-    line = f.readline()
-    while (line):
-        payloadCounter=sendShortStrings(payloadCounter,line,20)
-        print(line)
-        gc.collect()
-        #print("Memory allocated:  ", gc.mem_alloc())
-        #print("Memory free:  ", gc.mem_free())
-        #gc.collect()
-        #utime.sleep_ms(500)  # sleep for a second after transmitting the line to give the receiver time to process the  line
-        line = f.readline()
-    f.close()   
-    payloadCounter=sendShortStrings(payloadCounter,"$$$$$$$$",20)
-    theHash = computeFileHash(theFile)
-    payloadCounter=sendShortStrings(payloadCounter,theHash,20)
-    payloadCounter=sendShortStrings(payloadCounter,"$!$!$!$!",20)
-
-def transmit():
-    transmitUpdate()
-
-
-def computeFileHash(theFile):
-    f=open(theFile)
+    startTime = utime.ticks_ms()
+    image = prepareImage(theFile, compress, False)
+    if (image is None):
+        return False
+    theFile, theHash, imageFlags = image
+    startTime = prepareStats(uos.stat(theFile)[6], startTime)
+    endSeq = (uos.stat(theFile)[6] + _MAX_PAYLOAD - 1) // _MAX_PAYLOAD  # DATA frames come before it
+    if (endSeq >= _GROUP_MAX_FRAMES):
+        print("The file is too large to broadcast.  Update aborted.")
+        finishStats(startTime)
+        return False
+    if (slots > 255):
+        slots = 255
+    if (slots < 1):
+        slots = 1
+    resend = bytearray((endSeq >> 3) + 1)
+    seq = 0
+    while (seq <= endSeq):
+        resend[seq >> 3] = resend[seq >> 3] | (1 << (seq & 7))
+        seq = seq + 1
+    parityReady[0] = 0
+    fileHash = None
+    if (theHash is None):
+        fileHash = uhashlib.sha256()  # taken as the first round is read, see prepareImage()
+    radioUseGroup(_group_prefixAddress)
+    f=open(theFile,"rb")
+    pollRound = 0
+    quietRounds = 0
+    while (quietRounds < _QUIET_ROUNDS):
+        if (pollRound >= _MAX_ROUNDS):
+            f.close()
+            initializeRadio()
+            print("Receivers still missing frames after ", pollRound, " rounds.  Update aborted.")
+            finishStats(startTime)
+            return False
+        sent, theHash = sendGroupFrames(f, resend, endSeq, theHash, imageFlags, fec and (pollRound == 0), fileHash)
+        fileHash = None
+        if (pollRound > 0):
+            statCounters[_STAT_RETRANSMISSIONS] = statCounters[_STAT_RETRANSMISSIONS] + sent
+        heard = pollGroup(endSeq, slots, resend)
+        statCounters[_STAT_NACKS] = statCounters[_STAT_NACKS] + heard
+        if (logLevel >= _LOG_PACKETS):
+            print("Round ", pollRound, ": sent ", sent, " frames, ", heard, " receivers are missing some")
+        if (heard):
+            quietRounds = 0
+        else:
+            quietRounds = quietRounds + 1
+        pollRound = pollRound + 1
+    f.close()
+    initializeRadio()
+    print("Update broadcast.")
+    finishStats(startTime)
+    return True
+
+def broadcast(theFile="update.txt", compress=False, slots=_NACK_SLOTS, fec=False):
+    return broadcastUpdate(theFile, compress, slots, fec)
+
+
+def computeFileHash(theFile, compressed=False):
+    # the file is read as raw bytes, so any file (including .mpy bytecode) hashes correctly.
+    # The hash of a compressed file is taken over its inflated content.
+    f=open(theFile,"rb")
+    stream = f
+    if (compressed):
+        stream = openInflater(f)
     theHash = uhashlib.sha256()
-    line = f.readline()
-    while line:
-        theHash.update(line)
-        line = f.readline()
+    chunk = stream.read(_FILE_CHUNK_SIZE)
+    while chunk:
+        theHash.update(chunk)
+        chunk = stream.read(_FILE_CHUNK_SIZE)
+    f.close()
     theRawHash = theHash.digest() # type is 'bytes'
     hexHash =  ubinascii.hexlify(theRawHash) # still 'bytes', but now in hex
     return hexHash.decode()  # hexHash coverted to a string type   
@@ -257,13 +1490,11 @@ def computeFileHash(theFile):
 def initializeEverything():
     # Main setup    
     initializeSerialOutput()
-    initializeHardware()
-    initializeClocks()
     initializeRadio() 
-    initializeTxMode()
 
 def start():
     initializeEverything()
+    resetStats()
     print("Ready to transmit.")
 
 
@@ -275,6 +1506,8 @@ print("My address is 0x{:02X}".format(_my_prefixAddress) + "{:08X}".format(_my_b
 print("The target address is 0x{:02X}".format(_target_prefixAddress) + "{:08X}".format(_target_baseAddress))
 print ("Put update code in a file named 'update.txt'")
 print ("Type 'transmit()' at the REPL prompt to begin OTA update transmission.")
+print ("Or type 'transmit(bundle=\"bundle.txt\")' to send only the changed files of a release.")
+print ("Or type 'broadcast()' to update every receiver that is listening at once.")
           
 
    